@@ -0,0 +1,250 @@
+"""
+Módulo con una base de datos de imágenes basada en bolsa de palabras visuales.
+Sirve para elegir qué pares de imágenes merece la pena emparejar y registrar
+cuando hay muchas imágenes, en lugar de probar todos los pares.
+"""
+
+import cv2
+import numpy as np
+from feature_detection import detectar_caracteristicas
+from matching import IndiceDescriptores
+
+# Ancho y tipo de los descriptores de cada método (ORB, AKAZE MLDB y SIFT)
+DESCRIPTORES_METODO = {
+    'orb': (32, np.uint8),
+    'akaze': (61, np.uint8),
+    'sift': (128, np.float32)
+}
+
+
+class BaseDatosImagenes:
+    """
+    Vocabulario visual (k-means sobre descriptores) con índice invertido TF-IDF.
+    
+    Uso típico:
+        bd = BaseDatosImagenes('orb')
+        for nombre, img in imagenes.items():
+            bd.agregar_imagen(nombre, img)
+        bd.construir_vocabulario()
+        bd.consultar(descriptores, k=5)
+    """
+    
+    def __init__(self, metodo='orb', num_palabras=500, backend='flann', semilla=0):
+        """
+        Inicializa la base de datos.
+        
+        Args:
+            metodo: 'orb', 'sift', 'akaze' (tipo de descriptor)
+            num_palabras: tamaño del vocabulario visual
+            backend: emparejador para asignar palabras ('bf' o 'flann')
+            semilla: semilla del k-means
+        """
+        self.metodo = metodo
+        self.num_palabras = num_palabras
+        self.backend = backend
+        self.semilla = semilla
+        self.binario = metodo in ['orb', 'akaze']
+        
+        self.nombres = []
+        self._descriptores = []     # descriptores pendientes de indexar
+        self._palabras = []         # (ids_palabra, tf) por imagen indexada
+        self.vocabulario = None
+        self._indice_vocabulario = None
+        self._idf = None
+        self._invertido = None
+    
+    def __len__(self):
+        return len(self.nombres)
+    
+    def agregar(self, nombre, descriptores):
+        """
+        Añade los descriptores de una imagen a la base de datos.
+        
+        Args:
+            nombre: identificador de la imagen
+            descriptores: matriz de descriptores (de detectar_caracteristicas)
+        """
+        if descriptores is None:
+            descriptores = self._descriptores_vacios()
+        
+        self.nombres.append(nombre)
+        if self.vocabulario is None:
+            self._descriptores.append(descriptores)
+        else:
+            self._palabras.append(self._histograma(descriptores))
+            self._invertido = None
+    
+    def _descriptores_vacios(self):
+        """
+        Matriz sin filas con el ancho y el tipo de los descriptores de la base
+        (los del vocabulario o los ya añadidos; si no hay, los del método).
+        """
+        if self.vocabulario is not None:
+            referencia = self.vocabulario
+        else:
+            referencia = next((d for d in self._descriptores if len(d) > 0), None)
+        if referencia is not None:
+            return np.empty((0, referencia.shape[1]), referencia.dtype)
+        
+        ancho, tipo = DESCRIPTORES_METODO.get(self.metodo, (32, np.uint8))
+        return np.empty((0, ancho), tipo)
+    
+    def agregar_imagen(self, nombre, imagen, max_features=500, cache=None):
+        """
+        Detecta características en una imagen y la añade a la base de datos.
+        
+        Args:
+            nombre: identificador de la imagen
+            imagen: imagen en escala de grises
+            max_features: número máximo de características
+            cache: CacheCaracteristicas opcional
+        """
+        _, descriptores = detectar_caracteristicas(imagen, self.metodo, max_features, cache,
+                                                   compacto=True)
+        self.agregar(nombre, descriptores)
+    
+    def construir_vocabulario(self, max_descriptores=100000, iteraciones=20):
+        """
+        Construye el vocabulario visual con k-means y el índice invertido.
+        
+        Args:
+            max_descriptores: máximo de descriptores usados para el k-means
+            iteraciones: iteraciones máximas del k-means
+        """
+        todos = np.concatenate([d for d in self._descriptores if len(d) > 0])
+        rng = np.random.default_rng(self.semilla)
+        if len(todos) > max_descriptores:
+            todos = todos[rng.choice(len(todos), max_descriptores, replace=False)]
+        
+        # Los descriptores binarios se agrupan bit a bit y los centroides se
+        # vuelven a binarizar, para seguir usando distancia de Hamming
+        datos = np.unpackbits(todos, axis=1) if self.binario else todos
+        datos = datos.astype(np.float32)
+        k = min(self.num_palabras, len(datos))
+        
+        cv2.setRNGSeed(self.semilla)
+        criterio = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, iteraciones, 1e-3)
+        _, _, centros = cv2.kmeans(datos, k, None, criterio, 1, cv2.KMEANS_PP_CENTERS)
+        
+        if self.binario:
+            self.vocabulario = np.packbits(centros > 0.5, axis=1)
+        else:
+            self.vocabulario = centros
+        self._indice_vocabulario = IndiceDescriptores(self.vocabulario, self.metodo, self.backend)
+        
+        self._palabras = [self._histograma(d) for d in self._descriptores]
+        self._descriptores = []
+        self._invertido = None
+    
+    def _histograma(self, descriptores):
+        """
+        Asigna cada descriptor a su palabra visual y cuenta las apariciones.
+        """
+        if len(descriptores) == 0:
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        _, indices = self._indice_vocabulario.knn(descriptores, k=1)
+        palabras = indices[:, 0]
+        palabras = palabras[palabras >= 0]
+        ids, cuentas = np.unique(palabras, return_counts=True)
+        return ids, (cuentas / max(len(palabras), 1)).astype(np.float32)
+    
+    def _construir_invertido(self):
+        """
+        Construye el índice invertido en formato CSR: para cada palabra, las
+        imágenes que la contienen y su peso TF-IDF normalizado.
+        """
+        num_palabras = len(self.vocabulario)
+        ids = np.concatenate([p[0] for p in self._palabras])
+        tf = np.concatenate([p[1] for p in self._palabras])
+        imagenes = np.repeat(np.arange(len(self._palabras)), [len(p[0]) for p in self._palabras])
+        
+        df = np.bincount(ids, minlength=num_palabras)
+        self._idf = np.log((len(self._palabras) + 1) / (df + 1)).astype(np.float32)
+        
+        pesos = tf * self._idf[ids]
+        normas = np.sqrt(np.bincount(imagenes, weights=pesos ** 2, minlength=len(self._palabras)))
+        pesos = pesos / np.maximum(normas[imagenes], 1e-12)
+        
+        orden = np.argsort(ids, kind='stable')
+        self._invertido = {
+            'inicio': np.concatenate([[0], np.cumsum(df)]),
+            'imagenes': imagenes[orden],
+            'pesos': pesos[orden].astype(np.float32)
+        }
+    
+    def _puntuar(self, ids, tf):
+        """
+        Similitud coseno TF-IDF de una consulta con todas las imágenes.
+        """
+        if self._invertido is None:
+            self._construir_invertido()
+        
+        q = tf * self._idf[ids]
+        q = q / max(np.linalg.norm(q), 1e-12)
+        
+        inicio = self._invertido['inicio'][ids]
+        longitud = self._invertido['inicio'][ids + 1] - inicio
+        # Posiciones en el índice invertido de todas las entradas de las palabras consultadas
+        posiciones = np.repeat(inicio - np.cumsum(longitud) + longitud, longitud) + np.arange(longitud.sum())
+        
+        return np.bincount(
+            self._invertido['imagenes'][posiciones],
+            weights=self._invertido['pesos'][posiciones] * np.repeat(q, longitud),
+            minlength=len(self._palabras)
+        )
+    
+    def consultar(self, descriptores, k=5, excluir=None):
+        """
+        Devuelve las k imágenes más parecidas a unos descriptores de consulta.
+        
+        Args:
+            descriptores: descriptores de la imagen de consulta
+            k: número de candidatos
+            excluir: nombre de una imagen a excluir (p. ej. la propia consulta)
+        
+        Returns:
+            lista de (nombre, puntuación) ordenada de mayor a menor similitud
+        """
+        if self.vocabulario is None:
+            raise RuntimeError("Hay que llamar a construir_vocabulario() antes de consultar")
+        
+        if descriptores is None:
+            descriptores = self._descriptores_vacios()
+        puntuaciones = self._puntuar(*self._histograma(descriptores))
+        excluir = None if excluir is None else self.nombres.index(excluir)
+        return [(self.nombres[i], p) for i, p in self._mejores(puntuaciones, k, excluir)]
+    
+    def _mejores(self, puntuaciones, k, excluir=None):
+        """
+        Índices y puntuaciones de las k mejores imágenes (excluyendo un índice).
+        """
+        if excluir is not None:
+            puntuaciones[excluir] = -np.inf
+        orden = np.argsort(-puntuaciones, kind='stable')[:k]
+        return [(int(i), float(puntuaciones[i])) for i in orden if np.isfinite(puntuaciones[i])]
+    
+    def pares_candidatos(self, k=3):
+        """
+        Selecciona los pares de imágenes a registrar: cada imagen con sus k
+        vecinos más parecidos de la base de datos.
+        
+        Args:
+            k: número de candidatos por imagen
+        
+        Returns:
+            lista de (nombre_i, nombre_j, puntuación) sin pares repetidos,
+            ordenada de mayor a menor puntuación
+        """
+        if self.vocabulario is None:
+            raise RuntimeError("Hay que llamar a construir_vocabulario() antes de consultar")
+        
+        pares = {}
+        for i, (ids, tf) in enumerate(self._palabras):
+            for j, puntuacion in self._mejores(self._puntuar(ids, tf), k, excluir=i):
+                clave = (min(i, j), max(i, j))
+                pares[clave] = max(pares.get(clave, -np.inf), puntuacion)
+        
+        return sorted(
+            [(self.nombres[i], self.nombres[j], p) for (i, j), p in pares.items()],
+            key=lambda par: -par[2]
+        )
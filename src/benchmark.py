@@ -0,0 +1,466 @@
+"""
+Módulo de benchmarks de rendimiento y detección de regresiones.
+Cronometra cada etapa del registro (detección, emparejamiento, RANSAC,
+fusión y búsqueda exhaustiva) sobre las imágenes reales a varias
+resoluciones y sobre casos sintéticos de varios tamaños, guarda la mediana
+y el p95 de la latencia, el pico de memoria y el rendimiento de cada etapa
+en un historial de archivos JSON y compara dos ejecuciones marcando las
+etapas que se han vuelto más lentas que un umbral.
+
+Uso:
+    python src/benchmark.py run [--rapido] [--salida results/benchmarks]
+    python src/benchmark.py compare [base.json nuevo.json] [--umbral 10]
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+from dataset_sintetico import generar_caso
+from feature_detection import (detectar_caracteristicas, memoria_proceso_mb, reducir_imagen,
+                               reiniciar_pico_memoria)
+from lote import pares_directorio
+from matching import emparejar_caracteristicas, filtrar_matches_ransac
+from panorama import cargar_imagen_gris
+from registration import fusionar_imagenes, registro_busqueda_exhaustiva
+from utils import matriz_homogenea
+
+ETAPAS = ('deteccion', 'emparejamiento', 'ransac', 'fusion', 'busqueda_exhaustiva')
+
+DIRECTORIO_HISTORIAL = os.path.join('results', 'benchmarks')
+
+# Canvas máximo de la fusión, en múltiplos del área de la imagen de
+# referencia (evita panoramas enormes cuando un par no se solapa)
+MAX_AREA_FUSION = 4.0
+
+
+def _commit_git():
+    """
+    Hash del commit actual del repositorio (None si no se puede obtener).
+    """
+    try:
+        salida = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return salida.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _entorno():
+    """
+    Versiones y máquina en las que se ejecuta el benchmark.
+    """
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'plataforma': platform.platform(),
+        'procesador': platform.processor() or platform.machine(),
+        'num_cpus': os.cpu_count(),
+        'hilos_opencv': cv2.getNumThreads()
+    }
+
+
+def medir_etapa(funcion, repeticiones=5, calentamiento=1):
+    """
+    Cronometra una función varias veces midiendo también su pico de memoria.
+    
+    Antes de cada repetición se reinicia el pico de memoria del proceso
+    (VmHWM en Linux), de modo que el pico medido es el de esa llamada.
+    
+    Args:
+        funcion: función sin argumentos a medir
+        repeticiones: número de ejecuciones cronometradas
+        calentamiento: ejecuciones previas sin cronometrar
+    
+    Returns:
+        (resultado, tiempos, picos): resultado de la última llamada, tiempos
+        en segundos y picos de memoria en MB sobre el RSS inicial (vacío si
+        la plataforma no permite medirlo)
+    """
+    resultado = None
+    for _ in range(calentamiento):
+        resultado = funcion()
+    
+    tiempos = []
+    picos = []
+    for _ in range(repeticiones):
+        reiniciar_pico_memoria()
+        rss_inicial, _ = memoria_proceso_mb()
+        t = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - t)
+        _, pico = memoria_proceso_mb()
+        if pico is not None:
+            picos.append(max(pico - rss_inicial, 0.0))
+    
+    return resultado, tiempos, picos
+
+
+def _fila(etapa, entrada, forma, tiempos, picos, cantidad, unidad):
+    """
+    Resume las mediciones de una etapa en una fila del benchmark.
+    """
+    mediana = float(np.median(tiempos))
+    return {
+        'etapa': etapa,
+        'entrada': entrada,
+        'resolucion': f'{forma[1]}x{forma[0]}',
+        'repeticiones': len(tiempos),
+        'mediana_ms': mediana * 1000,
+        'p95_ms': float(np.percentile(tiempos, 95)) * 1000,
+        'min_ms': float(np.min(tiempos)) * 1000,
+        'pico_rss_mb': float(np.max(picos)) if picos else None,
+        'rendimiento': cantidad / mediana if mediana > 0 else None,
+        'unidad': unidad
+    }
+
+
+def _area_fusion(img1, img2, H):
+    """
+    Área del canvas de fusionar img2 (transformada con H) sobre img1
+    (infinita si la homografía es degenerada).
+    """
+    h, w = img2.shape[:2]
+    puntos = H @ np.array([[0, w, w, 0], [0, 0, h, h], [1, 1, 1, 1]], dtype=np.float64)
+    if np.any(puntos[2] <= 0):
+        return np.inf
+    proyectadas = (puntos[:2] / puntos[2]).T
+    alto1, ancho1 = img1.shape[:2]
+    x_min, y_min = np.minimum(proyectadas.min(axis=0), 0)
+    x_max, y_max = np.maximum(proyectadas.max(axis=0), (ancho1, alto1))
+    return float((x_max - x_min) * (y_max - y_min))
+
+
+def benchmark_par(img1, img2, entrada, metodo='orb', max_features=500, repeticiones=5,
+                  calentamiento=1, rango_busqueda=(-20, 20), etapas=ETAPAS, H_real=None):
+    """
+    Cronometra todas las etapas del registro sobre un par de imágenes.
+    
+    Cada etapa se mide con la salida real de la anterior (keypoints,
+    matches y homografía), como en `registro_con_caracteristicas`. Si una
+    etapa no produce resultado (pocos matches, homografía no encontrada o
+    canvas desmesurado) se omiten las etapas que dependen de ella; con
+    `H_real` la fusión se mide siempre con la transformación real.
+    
+    Args:
+        img1: imagen de referencia (escala de grises)
+        img2: imagen a registrar
+        entrada: nombre de la entrada en el benchmark
+        metodo: detector ('orb', 'sift', 'akaze')
+        max_features: número máximo de características
+        repeticiones: ejecuciones cronometradas por etapa
+        calentamiento: ejecuciones previas sin cronometrar
+        rango_busqueda: rango de traslación (en x y en y) de la búsqueda exhaustiva
+        etapas: etapas a medir (ver ETAPAS)
+        H_real: homografía real de img2 a img1 (casos sintéticos), usada en
+            la fusión en lugar de la estimada
+    
+    Returns:
+        lista de filas (una por etapa medida)
+    """
+    filas = []
+    forma = img1.shape[:2]
+    megapixeles = forma[0] * forma[1] / 1e6
+    
+    def medir(funcion):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return medir_etapa(funcion, repeticiones, calentamiento)
+    
+    (kp1, des1), tiempos, picos = medir(
+        lambda: detectar_caracteristicas(img1, metodo, max_features, compacto=True))
+    kp2, des2 = detectar_caracteristicas(img2, metodo, max_features, compacto=True)
+    if 'deteccion' in etapas:
+        filas.append(_fila('deteccion', entrada, forma, tiempos, picos, megapixeles, 'MP/s'))
+    
+    H = None
+    if des1 is not None and des2 is not None and len(kp1) >= 4 and len(kp2) >= 4:
+        matches, tiempos, picos = medir(
+            lambda: emparejar_caracteristicas(des1, des2, metodo, compacto=True))
+        if 'emparejamiento' in etapas:
+            filas.append(_fila('emparejamiento', entrada, forma, tiempos, picos, len(des1),
+                               'descriptores/s'))
+        
+        if len(matches) >= 4:
+            (H, _), tiempos, picos = medir(lambda: filtrar_matches_ransac(kp1, kp2, matches))
+            if 'ransac' in etapas:
+                filas.append(_fila('ransac', entrada, forma, tiempos, picos, len(matches),
+                                   'matches/s'))
+    
+    if H_real is not None:
+        H = H_real
+    if 'fusion' in etapas:
+        if H is None:
+            print(f"⚠️ {entrada} ({forma[1]}x{forma[0]}): sin homografía, se omite la fusión")
+        elif _area_fusion(img1, img2, H) > MAX_AREA_FUSION * forma[0] * forma[1]:
+            print(f"⚠️ {entrada} ({forma[1]}x{forma[0]}): canvas demasiado grande, "
+                  f"se omite la fusión")
+        else:
+            canvas, tiempos, picos = medir(lambda: fusionar_imagenes([img1, img2], [H]))
+            filas.append(_fila('fusion', entrada, forma, tiempos, picos,
+                               canvas.shape[0] * canvas.shape[1] / 1e6, 'MP/s'))
+    
+    if 'busqueda_exhaustiva' in etapas:
+        _, tiempos, picos = medir(lambda: registro_busqueda_exhaustiva(img1, img2, rango_busqueda,
+                                                                       rango_busqueda))
+        filas.append(_fila('busqueda_exhaustiva', entrada, forma, tiempos, picos, megapixeles,
+                           'MP/s'))
+    
+    return filas
+
+
+def ejecutar_benchmark(directorio_imagenes=os.path.join('data', 'original'),
+                       escalas=(0.25, 0.5, 1.0), tamanos_sinteticos=(256, 512, 1024),
+                       metodo='orb', max_features=500, repeticiones=5, calentamiento=1,
+                       semilla=0, etapas=ETAPAS, verbose=True):
+    """
+    Ejecuta el benchmark completo de rendimiento.
+    
+    Se miden los pares de imágenes consecutivas del directorio (por nombre)
+    reducidas a cada escala y un caso sintético reproducible (patrón con
+    traslación y ruido) de cada tamaño.
+    
+    Args:
+        directorio_imagenes: carpeta con las imágenes reales (None = solo sintéticos)
+        escalas: factores de escala de las imágenes reales
+        tamanos_sinteticos: tamaños de los casos sintéticos
+        metodo: detector ('orb', 'sift', 'akaze')
+        max_features: número máximo de características
+        repeticiones: ejecuciones cronometradas por etapa
+        calentamiento: ejecuciones previas sin cronometrar
+        semilla: semilla de los casos sintéticos
+        etapas: etapas a medir (ver ETAPAS)
+        verbose: imprimir cada etapa medida
+    
+    Returns:
+        diccionario con fecha, commit, entorno, configuración y resultados
+        (lista de filas con etapa, entrada, resolucion, repeticiones,
+        mediana_ms, p95_ms, min_ms, pico_rss_mb, rendimiento y unidad)
+    """
+    opciones = {'metodo': metodo, 'max_features': max_features, 'repeticiones': repeticiones,
+                'calentamiento': calentamiento, 'etapas': list(etapas)}
+    ejecucion = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_git(),
+        'entorno': _entorno(),
+        'config': {'directorio_imagenes': directorio_imagenes, 'escalas': list(escalas),
+                   'tamanos_sinteticos': list(tamanos_sinteticos), 'semilla': semilla, **opciones},
+        'resultados': []
+    }
+    
+    def registrar(filas):
+        ejecucion['resultados'].extend(filas)
+        if verbose:
+            for fila in filas:
+                print(f"✓ {fila['etapa']:<20} {fila['entrada']:<40} {fila['resolucion']:>10}: "
+                      f"mediana {fila['mediana_ms']:9.2f} ms, p95 {fila['p95_ms']:9.2f} ms")
+    
+    t0 = time.perf_counter()
+    pares = pares_directorio(directorio_imagenes) if directorio_imagenes else []
+    for identificador, ruta1, ruta2 in pares:
+        original1 = cargar_imagen_gris(ruta1)
+        original2 = cargar_imagen_gris(ruta2)
+        for escala in escalas:
+            img1 = original1 if escala == 1 else reducir_imagen(original1, escala)
+            img2 = original2 if escala == 1 else reducir_imagen(original2, escala)
+            registrar(benchmark_par(img1, img2, f'foto:{identificador}', **opciones))
+    
+    for size in tamanos_sinteticos:
+        fija, movil, M, _, _ = generar_caso(0, semilla, size, ('patron',), ('traslacion',), (5,))
+        H_real = np.linalg.inv(matriz_homogenea(M))
+        registrar(benchmark_par(fija, movil, 'sintetico:patron', H_real=H_real, **opciones))
+    
+    ejecucion['tiempo_total_s'] = time.perf_counter() - t0
+    if verbose:
+        print(f"✓ Benchmark: {len(ejecucion['resultados'])} mediciones en "
+              f"{ejecucion['tiempo_total_s']:.1f} s")
+    return ejecucion
+
+
+def guardar_benchmark(ejecucion, directorio=DIRECTORIO_HISTORIAL):
+    """
+    Añade una ejecución al historial (un archivo JSON por ejecución).
+    
+    Args:
+        ejecucion: resultado de `ejecutar_benchmark`
+        directorio: carpeta del historial
+    
+    Returns:
+        ruta del archivo escrito
+    """
+    os.makedirs(directorio, exist_ok=True)
+    marca = datetime.fromisoformat(ejecucion['fecha']).strftime('%Y%m%d_%H%M%S')
+    ruta = os.path.join(directorio, f'benchmark_{marca}.json')
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(ejecucion, f, indent=2, ensure_ascii=False)
+    return ruta
+
+
+def cargar_historial(directorio=DIRECTORIO_HISTORIAL):
+    """
+    Rutas de las ejecuciones guardadas en el historial, de la más antigua
+    a la más reciente.
+    """
+    return sorted(glob.glob(os.path.join(directorio, 'benchmark_*.json')))
+
+
+def _cargar(ejecucion):
+    """
+    Devuelve una ejecución a partir de su diccionario o de su archivo JSON.
+    """
+    if isinstance(ejecucion, dict):
+        return ejecucion
+    with open(ejecucion, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def comparar_benchmarks(base, nuevo, umbral=0.10, umbral_memoria=0.25, min_ms=1.0,
+                        min_memoria_mb=5.0):
+    """
+    Compara dos ejecuciones del benchmark y marca las regresiones.
+    
+    Una medición es una regresión si su mediana crece más que `umbral`
+    (relativo) y más que `min_ms` (absoluto, para que el ruido de las
+    etapas muy rápidas no dispare falsas alarmas), o si su pico de memoria
+    crece más que `umbral_memoria` y más que `min_memoria_mb`.
+    
+    Args:
+        base: ejecución de referencia (ruta JSON o diccionario)
+        nuevo: ejecución a comparar (ruta JSON o diccionario)
+        umbral: aumento relativo de la mediana tolerado (0.10 = 10 %)
+        umbral_memoria: aumento relativo del pico de memoria tolerado
+        min_ms: aumento absoluto mínimo de la mediana para ser regresión
+        min_memoria_mb: aumento absoluto mínimo del pico para ser regresión
+    
+    Returns:
+        DataFrame con una fila por (etapa, entrada, resolucion): medianas,
+        p95 y picos de ambas ejecuciones, cambios relativos y estado
+        ('regresion', 'regresion_memoria', 'mejora', 'igual', 'nueva' o
+        'eliminada')
+    """
+    import pandas as pd
+    
+    base, nuevo = _cargar(base), _cargar(nuevo)
+    if base.get('entorno') != nuevo.get('entorno'):
+        print("⚠️ Las ejecuciones se hicieron en entornos distintos; "
+              "los tiempos pueden no ser comparables")
+    
+    clave = ['etapa', 'entrada', 'resolucion']
+    columnas = clave + ['mediana_ms', 'p95_ms', 'pico_rss_mb']
+    tabla = pd.merge(pd.DataFrame(base['resultados'], columns=columnas),
+                     pd.DataFrame(nuevo['resultados'], columns=columnas),
+                     on=clave, how='outer', suffixes=('_base', '_nuevo'))
+    
+    def cambio(columna):
+        return tabla[f'{columna}_nuevo'] / tabla[f'{columna}_base'] - 1
+    
+    tabla['cambio_mediana'] = cambio('mediana_ms')
+    tabla['cambio_p95'] = cambio('p95_ms')
+    tabla['cambio_pico_rss'] = cambio('pico_rss_mb')
+    
+    diferencia_ms = tabla['mediana_ms_nuevo'] - tabla['mediana_ms_base']
+    diferencia_mb = tabla['pico_rss_mb_nuevo'] - tabla['pico_rss_mb_base']
+    estado = np.select(
+        [tabla['mediana_ms_base'].isna(),
+         tabla['mediana_ms_nuevo'].isna(),
+         (tabla['cambio_mediana'] > umbral) & (diferencia_ms > min_ms),
+         (tabla['cambio_pico_rss'] > umbral_memoria) & (diferencia_mb > min_memoria_mb),
+         tabla['cambio_mediana'] < -umbral],
+        ['nueva', 'eliminada', 'regresion', 'regresion_memoria', 'mejora'],
+        default='igual'
+    )
+    tabla['estado'] = estado
+    return tabla.sort_values(clave, ignore_index=True)
+
+
+def imprimir_comparacion(tabla):
+    """
+    Imprime el resultado de `comparar_benchmarks`.
+    
+    Returns:
+        número de regresiones (de tiempo o de memoria)
+    """
+    simbolos = {'regresion': '✗', 'regresion_memoria': '✗', 'mejora': '✓', 'igual': '✓',
+                'nueva': '⚠️', 'eliminada': '⚠️'}
+    for fila in tabla.itertuples():
+        if fila.estado in ['nueva', 'eliminada']:
+            detalle = fila.estado
+        else:
+            detalle = (f"{fila.mediana_ms_base:9.2f} -> {fila.mediana_ms_nuevo:9.2f} ms "
+                       f"({fila.cambio_mediana:+.1%})")
+            if fila.estado == 'regresion_memoria':
+                detalle += (f", pico {fila.pico_rss_mb_base:.1f} -> {fila.pico_rss_mb_nuevo:.1f} MB "
+                            f"({fila.cambio_pico_rss:+.1%})")
+            elif fila.estado != 'igual':
+                detalle += f" {fila.estado}"
+        print(f"{simbolos[fila.estado]} {fila.etapa:<20} {fila.entrada:<40} {fila.resolucion:>10}: "
+              f"{detalle}")
+    
+    regresiones = int(tabla['estado'].isin(['regresion', 'regresion_memoria']).sum())
+    if regresiones:
+        print(f"✗ {regresiones} regresiones de {len(tabla)} mediciones")
+    else:
+        print(f"✓ Sin regresiones en {len(tabla)} mediciones")
+    return regresiones
+
+
+def main(argv=None):
+    """
+    Punto de entrada de la línea de comandos (subcomandos `run` y `compare`).
+    """
+    parser = argparse.ArgumentParser(prog='benchmark.py',
+                                     description='Benchmarks de rendimiento del registro')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+    
+    run = subparsers.add_parser('run', help='ejecutar el benchmark y guardarlo en el historial')
+    run.add_argument('--imagenes', default=os.path.join('data', 'original'),
+                     help='carpeta de imágenes reales')
+    run.add_argument('--escalas', type=float, nargs='+', default=[0.25, 0.5, 1.0])
+    run.add_argument('--tamanos', type=int, nargs='+', default=[256, 512, 1024],
+                     help='tamaños de los casos sintéticos')
+    run.add_argument('--metodo', default='orb', choices=['orb', 'sift', 'akaze'])
+    run.add_argument('--max-features', type=int, default=500)
+    run.add_argument('--repeticiones', type=int, default=5)
+    run.add_argument('--rapido', action='store_true',
+                     help='solo escala 0.25, tamaño 256 y 3 repeticiones')
+    run.add_argument('--salida', default=DIRECTORIO_HISTORIAL, help='carpeta del historial')
+    
+    compare = subparsers.add_parser('compare', help='comparar dos ejecuciones')
+    compare.add_argument('archivos', nargs='*',
+                         help='base.json nuevo.json (por defecto, las dos últimas del historial)')
+    compare.add_argument('--umbral', type=float, default=10.0,
+                         help='aumento de la mediana tolerado en %% (por defecto 10)')
+    compare.add_argument('--umbral-memoria', type=float, default=25.0,
+                         help='aumento del pico de memoria tolerado en %% (por defecto 25)')
+    compare.add_argument('--historial', default=DIRECTORIO_HISTORIAL, help='carpeta del historial')
+    args = parser.parse_args(argv)
+    
+    if args.comando == 'run':
+        if args.rapido:
+            args.escalas, args.tamanos, args.repeticiones = [0.25], [256], 3
+        ejecucion = ejecutar_benchmark(args.imagenes, args.escalas, args.tamanos, args.metodo,
+                                       args.max_features, args.repeticiones)
+        print(f"✓ Guardado en {guardar_benchmark(ejecucion, args.salida)}")
+        return 0
+    
+    archivos = args.archivos or cargar_historial(args.historial)[-2:]
+    if len(archivos) != 2:
+        print("✗ Se necesitan dos ejecuciones para comparar")
+        return 2
+    print(f"Base:  {archivos[0]}\nNuevo: {archivos[1]}")
+    tabla = comparar_benchmarks(archivos[0], archivos[1], args.umbral / 100, args.umbral_memoria / 100)
+    return 1 if imprimir_comparacion(tabla) > 0 else 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+Módulo de blending para la fusión de imágenes registradas.
+Incluye feathering por transformada de distancia y mezcla multibanda con
+pirámides laplacianas. Ambos acumulan sumas ponderadas y normalizan una sola
+vez al final, por lo que el resultado no depende del orden de las imágenes.
+"""
+
+import cv2
+import numpy as np
+
+
+def mascara_valida(imagen):
+    """
+    Máscara de los píxeles con contenido (distintos de cero en algún canal).
+    
+    Args:
+        imagen: imagen en gris o en color
+    
+    Returns:
+        máscara uint8 (255 = válido)
+    """
+    valida = imagen > 0 if imagen.ndim == 2 else np.any(imagen > 0, axis=2)
+    return valida.astype(np.uint8) * 255
+
+
+def pesos_distancia(mascara, max_distancia=None, bordes=(True, True, True, True)):
+    """
+    Pesos de feathering: distancia de cada píxel válido al borde de la zona
+    válida (o de la imagen), de modo que el peso cae a cero en los bordes.
+    
+    Args:
+        mascara: máscara uint8 de píxeles válidos
+        max_distancia: tope de los pesos (ancho de la transición; None = sin tope)
+        bordes: (arriba, abajo, izquierda, derecha) indica qué lados de la
+            máscara son borde de la imagen; los que no lo son (la máscara es
+            una ventana recortada) no cuentan como borde
+    
+    Returns:
+        mapa de pesos float32 del mismo tamaño
+    """
+    # Se añade un marco a cero en los bordes de la imagen para que también cuenten
+    con_marco = cv2.copyMakeBorder(mascara, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    arriba, abajo, izquierda, derecha = bordes
+    for lado, borde in ((con_marco[0], arriba), (con_marco[-1], abajo),
+                        (con_marco[:, 0], izquierda), (con_marco[:, -1], derecha)):
+        if not borde:
+            lado[:] = 255
+    distancia = cv2.distanceTransform(con_marco, cv2.DIST_L2, 3)[1:-1, 1:-1]
+    if max_distancia is not None:
+        np.minimum(distancia, max_distancia, out=distancia)
+    return distancia
+
+
+def _convertir(imagen, dtype):
+    """
+    Convierte el resultado float32 al tipo de salida (redondeando y
+    recortando si es entero).
+    """
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        imagen = np.clip(np.rint(imagen), info.min, info.max)
+    return imagen.astype(dtype)
+
+
+def mezclar_feathering(capas, forma, dtype=np.uint8):
+    """
+    Feathering: media ponderada por los pesos de distancia de cada imagen.
+    
+    Args:
+        capas: iterable de (imagen, peso, caja), con la imagen y su peso ya
+            transformados al tamaño de su caja (x0, y0, x1, y1) del canvas
+        forma: forma del canvas (alto, ancho) o (alto, ancho, canales)
+        dtype: tipo de la imagen de salida
+    
+    Returns:
+        imagen fusionada
+    """
+    acumulado = np.zeros(forma, dtype=np.float32)
+    suma_pesos = np.zeros(forma[:2], dtype=np.float32)
+    
+    for imagen, peso, (x0, y0, x1, y1) in capas:
+        peso = peso.astype(np.float32, copy=False)
+        region = acumulado[y0:y1, x0:x1]
+        region += imagen * (peso if imagen.ndim == 2 else peso[:, :, None])
+        suma_pesos[y0:y1, x0:x1] += peso
+    
+    # Normalización única al final
+    cubierto = suma_pesos > 0
+    if acumulado.ndim == 3:
+        acumulado[cubierto] /= suma_pesos[cubierto][:, None]
+    else:
+        acumulado[cubierto] /= suma_pesos[cubierto]
+    return _convertir(acumulado, dtype)
+
+
+def _normalizar_por_mascara(imagen, mascara):
+    """
+    Divide una imagen suavizada por su máscara suavizada igual, de modo que
+    los píxeles fuera de la zona válida no oscurecen los de dentro.
+    """
+    normalizada = np.zeros_like(imagen)
+    valido = mascara > 1e-3
+    if imagen.ndim == 3:
+        normalizada[valido] = imagen[valido] / mascara[valido][:, None]
+    else:
+        normalizada[valido] = imagen[valido] / mascara[valido]
+    return normalizada
+
+
+def piramide_laplaciana(imagen, niveles, mascara=None):
+    """
+    Construye la pirámide laplaciana de una imagen.
+    
+    Con máscara, cada nivel de la pirámide gaussiana se normaliza por la
+    pirámide gaussiana de la máscara (convolución normalizada): los niveles
+    gruesos cerca del borde de la zona válida promedian solo píxeles válidos
+    en lugar de mezclarlos con el cero de fuera.
+    
+    Args:
+        imagen: imagen float32
+        niveles: número de niveles (el último es la gaussiana residual)
+        mascara: máscara float32 de píxeles válidos (None = toda la imagen)
+    
+    Returns:
+        lista de niveles, del más fino al más grueso
+    """
+    gaussiana = [imagen]
+    if mascara is not None:
+        mascaras = [mascara]
+        ponderada = imagen * (mascara if imagen.ndim == 2 else mascara[:, :, None])
+        for _ in range(niveles - 1):
+            ponderada = cv2.pyrDown(ponderada)
+            mascaras.append(cv2.pyrDown(mascaras[-1]))
+            gaussiana.append(_normalizar_por_mascara(ponderada, mascaras[-1]))
+    else:
+        for _ in range(niveles - 1):
+            gaussiana.append(cv2.pyrDown(gaussiana[-1]))
+    
+    piramide = [actual - cv2.pyrUp(reducida, dstsize=(actual.shape[1], actual.shape[0]))
+                for actual, reducida in zip(gaussiana[:-1], gaussiana[1:])]
+    piramide.append(gaussiana[-1])
+    return piramide
+
+
+def reconstruir_laplaciana(piramide):
+    """
+    Reconstruye una imagen a partir de su pirámide laplaciana.
+    """
+    imagen = piramide[-1]
+    for nivel in reversed(piramide[:-1]):
+        imagen = cv2.pyrUp(imagen, dstsize=(nivel.shape[1], nivel.shape[0])) + nivel
+    return imagen
+
+
+def mezclar_multibanda(capas, forma, dtype=np.uint8, niveles=5):
+    """
+    Mezcla multibanda (Burt-Adelson): cada banda de frecuencia se mezcla con
+    la máscara de costura suavizada a su escala, de modo que las bajas
+    frecuencias se funden en una zona ancha y los detalles en una estrecha.
+    
+    La costura asigna cada píxel a la imagen con mayor peso de distancia; en
+    caso de empate gana la de menor índice (la referencia antes que las
+    demás) y los píxeles sin peso en ninguna imagen quedan fuera. Las
+    pirámides de cada imagen se normalizan por su máscara de píxeles válidos
+    suavizada, para que los bordes del panorama no se oscurezcan.
+    
+    Args:
+        capas: lista de (imagen, peso, caja), como en `mezclar_feathering`
+        forma: forma del canvas (alto, ancho) o (alto, ancho, canales)
+        dtype: tipo de la imagen de salida
+        niveles: número de niveles de la pirámide
+    
+    Returns:
+        imagen fusionada
+    """
+    if len(capas) == 0:
+        return np.zeros(forma, dtype=dtype)
+    
+    alto, ancho = forma[:2]
+    niveles = max(1, min(niveles, int(np.log2(max(min(alto, ancho), 1))) + 1))
+    
+    # Primera pasada: imagen con mayor peso en cada píxel (costura). argmax
+    # devuelve el primer máximo, así que los empates van a la de menor índice
+    pesos = np.zeros((len(capas), alto, ancho), dtype=np.float32)
+    for i, (_, peso, (x0, y0, x1, y1)) in enumerate(capas):
+        pesos[i, y0:y1, x0:x1] = peso
+    etiqueta = np.argmax(pesos, axis=0).astype(np.int32)
+    etiqueta[pesos.max(axis=0) <= 0] = -1
+    
+    # Segunda pasada: acumular bandas ponderadas por la máscara suavizada
+    acumulado = None
+    suma_mascaras = None
+    trabajo = np.zeros(forma, dtype=np.float32)
+    mascara = np.zeros((alto, ancho), dtype=np.float32)
+    for i, (imagen, _, (x0, y0, x1, y1)) in enumerate(capas):
+        trabajo.fill(0)
+        trabajo[y0:y1, x0:x1] = imagen
+        
+        bandas = piramide_laplaciana(trabajo, niveles, (pesos[i] > 0).astype(np.float32))
+        mascara[:] = etiqueta == i
+        mascaras = [mascara]
+        for _ in range(niveles - 1):
+            mascaras.append(cv2.pyrDown(mascaras[-1]))
+        
+        if acumulado is None:
+            acumulado = [np.zeros_like(b) for b in bandas]
+            suma_mascaras = [np.zeros_like(m) for m in mascaras]
+        for a, s, b, m in zip(acumulado, suma_mascaras, bandas, mascaras):
+            a += b * (m if b.ndim == 2 else m[:, :, None])
+            s += m
+    
+    for a, s in zip(acumulado, suma_mascaras):
+        cubierto = s > 1e-6
+        if a.ndim == 3:
+            a[cubierto] /= s[cubierto][:, None]
+        else:
+            a[cubierto] /= s[cubierto]
+    
+    resultado = reconstruir_laplaciana(acumulado)
+    resultado[etiqueta < 0] = 0
+    return _convertir(resultado, dtype)
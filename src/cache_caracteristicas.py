@@ -0,0 +1,186 @@
+"""
+Módulo con la caché de características (keypoints + descriptores).
+Evita recalcular la detección cuando la misma imagen se registra
+contra varias imágenes o cuando se vuelve a ejecutar el pipeline.
+"""
+
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CacheCaracteristicas:
+    """
+    Caché LRU en memoria con almacenamiento opcional en disco (.npz).
+    
+    Las entradas se indexan por el hash del contenido de la imagen más el
+    método de detección y sus parámetros. Si se indica un directorio, las
+    entradas que salen de memoria por la política LRU se vuelcan a disco, y
+    `volcar()` (o salir de un bloque `with`) escribe las que siguen en
+    memoria, de modo que otra ejecución (u otro proceso) puede recuperarlas
+    sin volver a detectar.
+    
+    Los arrays guardados son de solo lectura y `obtener` devuelve copias,
+    así que modificar un resultado no altera la caché.
+    """
+    
+    def __init__(self, capacidad=64, directorio=None):
+        """
+        Inicializa la caché.
+        
+        Args:
+            capacidad: número máximo de entradas que se mantienen en memoria
+            directorio: carpeta para persistir las entradas (None = solo memoria)
+        """
+        self.capacidad = capacidad
+        self.directorio = directorio
+        self._entradas = OrderedDict()
+        self._pendientes = set()        # claves en memoria aún no escritas a disco
+        self.aciertos = 0
+        self.fallos = 0
+        
+        if directorio is not None:
+            os.makedirs(directorio, exist_ok=True)
+    
+    @staticmethod
+    def clave(imagen, metodo, params=None):
+        """
+        Calcula la clave de una imagen para un método y parámetros dados.
+        
+        Args:
+            imagen: imagen (array de NumPy)
+            metodo: nombre del detector
+            params: diccionario con los parámetros del detector
+        
+        Returns:
+            cadena hexadecimal que identifica la entrada
+        """
+        imagen = np.ascontiguousarray(imagen)
+        h = hashlib.sha1()
+        h.update(str((imagen.shape, imagen.dtype.str)).encode())
+        h.update(memoryview(imagen).cast('B'))
+        h.update(metodo.encode())
+        h.update(repr(sorted((params or {}).items())).encode())
+        return h.hexdigest()
+    
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f'{clave}.npz')
+    
+    def obtener(self, clave):
+        """
+        Recupera una entrada de la caché.
+        
+        Args:
+            clave: clave calculada con `clave()`
+        
+        Returns:
+            (keypoints_array, descriptores) (copias) o None si no existe
+        """
+        if clave in self._entradas:
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return self._copia(self._entradas[clave])
+        
+        if self.directorio is not None and os.path.exists(self._ruta(clave)):
+            with np.load(self._ruta(clave)) as datos:
+                keypoints = datos['keypoints']
+                descriptores = datos['descriptores'] if bool(datos['tiene_descriptores']) else None
+            self._insertar(clave, self._solo_lectura(keypoints, descriptores))
+            self.aciertos += 1
+            return self._copia(self._entradas[clave])
+        
+        self.fallos += 1
+        return None
+    
+    @staticmethod
+    def _solo_lectura(keypoints, descriptores):
+        entrada = (np.array(keypoints), None if descriptores is None else np.array(descriptores))
+        for arr in entrada:
+            if arr is not None:
+                arr.setflags(write=False)
+        return entrada
+    
+    @staticmethod
+    def _copia(entrada):
+        keypoints, descriptores = entrada
+        return keypoints.copy(), None if descriptores is None else descriptores.copy()
+    
+    def guardar(self, clave, keypoints, descriptores):
+        """
+        Guarda una copia de una entrada en memoria. Si hay directorio, se
+        escribe a disco al salir de memoria o al llamar a `volcar()`.
+        
+        Args:
+            clave: clave calculada con `clave()`
+            keypoints: array estructurado de keypoints
+            descriptores: matriz de descriptores (o None)
+        """
+        if self.directorio is not None:
+            self._pendientes.add(clave)
+        self._insertar(clave, self._solo_lectura(keypoints, descriptores))
+    
+    def _escribir(self, clave, entrada):
+        keypoints, descriptores = entrada
+        # Escritura atómica: primero a un temporal y luego se renombra
+        fd, tmp = tempfile.mkstemp(suffix='.npz', dir=self.directorio)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(
+                f,
+                keypoints=keypoints,
+                descriptores=descriptores if descriptores is not None else np.empty(0, np.uint8),
+                tiene_descriptores=descriptores is not None
+            )
+        os.replace(tmp, self._ruta(clave))
+    
+    def _insertar(self, clave, entrada):
+        self._entradas[clave] = entrada
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.capacidad:
+            expulsada, entrada_expulsada = self._entradas.popitem(last=False)
+            if expulsada in self._pendientes:
+                self._pendientes.discard(expulsada)
+                self._escribir(expulsada, entrada_expulsada)
+    
+    def volcar(self):
+        """
+        Escribe a disco las entradas en memoria que aún no lo están.
+        """
+        for clave in list(self._pendientes):
+            self._escribir(clave, self._entradas[clave])
+        self._pendientes.clear()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *excepcion):
+        self.volcar()
+    
+    def limpiar(self, disco=False):
+        """
+        Vacía la caché en memoria (y opcionalmente los archivos en disco).
+        
+        Args:
+            disco: si True, borra también las entradas persistidas (y
+                descarta las pendientes); si False, las pendientes se
+                vuelcan antes de vaciar la memoria
+        """
+        if disco:
+            self._pendientes.clear()
+        else:
+            self.volcar()
+        self._entradas.clear()
+        if disco and self.directorio is not None:
+            for nombre in os.listdir(self.directorio):
+                if nombre.endswith('.npz'):
+                    os.remove(os.path.join(self.directorio, nombre))
+    
+    def __len__(self):
+        return len(self._entradas)
+    
+    def __contains__(self, clave):
+        return clave in self._entradas or (
+            self.directorio is not None and os.path.exists(self._ruta(clave))
+        )
@@ -0,0 +1,230 @@
+"""
+Módulo generador de conjuntos de datos sintéticos para validación y benchmarks.
+Cada caso (imagen fija, imagen móvil, matriz real y nivel de ruido) se
+obtiene de forma reproducible a partir de una semilla y de su índice, así
+que los casos se pueden generar en streaming, en cualquier orden o en
+procesos distintos, y guardar en lotes grandes en archivos .npy mapeados en
+memoria sin tenerlos todos en RAM.
+"""
+
+import csv
+import json
+import os
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from utils import anadir_ruido_gaussiano, crear_imagen_sintetica, matriz_transformacion
+
+TIPOS_IMAGEN = ('patron', 'cuadros', 'circulo', 'texto')
+TRANSFORMACIONES = ('traslacion', 'rotacion', 'rigida', 'afin')
+
+# Rangos (mínimo, máximo) de los parámetros de cada transformación
+RANGOS_POR_DEFECTO = {
+    'tx': (-20.0, 20.0),
+    'ty': (-20.0, 20.0),
+    'angulo': (-30.0, 30.0),
+    'escala': (0.85, 1.15),
+    'shear': (-0.1, 0.1)
+}
+
+PARAMETROS = {
+    'traslacion': ('tx', 'ty'),
+    'rotacion': ('angulo',),
+    'rigida': ('angulo', 'tx', 'ty'),
+    'afin': ('angulo', 'escala', 'tx', 'ty', 'shear')
+}
+
+
+@lru_cache(maxsize=32)
+def _imagen_base(tipo, size):
+    """
+    Imagen sintética base (se dibuja una sola vez por tipo y tamaño).
+    """
+    imagen = crear_imagen_sintetica(size, tipo)
+    imagen.setflags(write=False)
+    return imagen
+
+
+def generar_caso(indice, semilla=0, size=256, tipos=TIPOS_IMAGEN, transformaciones=TRANSFORMACIONES,
+                 sigmas=(0, 5, 10, 20), rangos=None, salida=None, trabajo=None):
+    """
+    Genera el caso `indice` del conjunto definido por la semilla.
+    
+    El generador aleatorio de cada caso se deriva de (semilla, indice), de
+    modo que el mismo caso sale igual aunque se genere solo o en otro orden.
+    
+    Args:
+        indice: número de caso
+        semilla: semilla del conjunto de datos
+        size: tamaño de las imágenes (size x size)
+        tipos: tipos de imagen sintética entre los que elegir
+        transformaciones: tipos de transformación entre los que elegir
+        sigmas: niveles de ruido gaussiano (aplicado a la imagen móvil)
+        rangos: diccionario que sustituye entradas de RANGOS_POR_DEFECTO
+        salida: array uint8 opcional (size x size) para la imagen móvil
+        trabajo: buffer float32 opcional (size x size) para el ruido
+    
+    Returns:
+        (fija, movil, M, sigma, info): la imagen fija es de solo lectura y
+        se comparte entre casos; la matriz 2x3 M lleva la fija a la móvil
+        (como `aplicar_transformacion`); info contiene el índice, el
+        tipo de imagen, la transformación y sus parámetros
+    """
+    rng = np.random.default_rng([semilla, indice])
+    rangos = {**RANGOS_POR_DEFECTO, **(rangos or {})}
+    
+    tipo = tipos[rng.integers(len(tipos))]
+    transformacion = transformaciones[rng.integers(len(transformaciones))]
+    sigma = sigmas[rng.integers(len(sigmas))]
+    params = {p: float(rng.uniform(*rangos[p])) for p in PARAMETROS[transformacion]}
+    
+    fija = _imagen_base(tipo, size)
+    M = matriz_transformacion(transformacion, params, fija.shape)
+    if salida is None:
+        salida = np.empty_like(fija)
+    cv2.warpAffine(fija, M, (size, size), dst=salida)
+    if sigma > 0:
+        anadir_ruido_gaussiano(salida, sigma, rng, salida=salida, trabajo=trabajo)
+    
+    info = {'indice': indice, 'tipo_imagen': tipo, 'transformacion': transformacion,
+            'params': params}
+    return fija, salida, M, sigma, info
+
+
+def generar_casos(num_casos, semilla=0, inicio=0, reutilizar_buffers=False, **kwargs):
+    """
+    Genera en streaming una serie de casos sintéticos reproducibles.
+    
+    Args:
+        num_casos: número de casos (None = sin fin)
+        semilla: semilla del conjunto de datos
+        inicio: índice del primer caso
+        reutilizar_buffers: escribir todas las imágenes móviles en el mismo
+            buffer (más rápido, pero cada caso deja de ser válido al pedir el
+            siguiente; copiarlo si hay que conservarlo)
+        **kwargs: parámetros de `generar_caso` (size, tipos, transformaciones,
+            sigmas, rangos)
+    
+    Yields:
+        (fija, movil, M, sigma, info) por caso (ver `generar_caso`)
+    """
+    size = kwargs.get('size', 256)
+    salida = np.empty((size, size), np.uint8) if reutilizar_buffers else None
+    trabajo = np.empty((size, size), np.float32)
+    
+    indice = inicio
+    while num_casos is None or indice < inicio + num_casos:
+        yield generar_caso(indice, semilla, salida=salida, trabajo=trabajo, **kwargs)
+        indice += 1
+
+
+def guardar_dataset(directorio, num_casos, semilla=0, tam_lote=256, verbose=True, **kwargs):
+    """
+    Genera un conjunto de datos y lo escribe en archivos .npy mapeados en
+    memoria, caso a caso, sin mantenerlo entero en RAM.
+    
+    Se crean: fija.npy y movil.npy (N, size, size) uint8, matrices.npy
+    (N, 2, 3), sigmas.npy (N,), casos.csv (tipo, transformación y
+    parámetros de cada caso) y config.json (para regenerar los casos).
+    
+    Args:
+        directorio: carpeta de salida
+        num_casos: número de casos
+        semilla: semilla del conjunto de datos
+        tam_lote: casos entre volcados a disco
+        verbose: imprimir el progreso
+        **kwargs: parámetros de `generar_caso`
+    
+    Returns:
+        ruta del directorio
+    """
+    os.makedirs(directorio, exist_ok=True)
+    size = kwargs.get('size', 256)
+    forma = (num_casos, size, size)
+    
+    abrir = np.lib.format.open_memmap
+    fijas = abrir(os.path.join(directorio, 'fija.npy'), mode='w+', dtype=np.uint8, shape=forma)
+    moviles = abrir(os.path.join(directorio, 'movil.npy'), mode='w+', dtype=np.uint8, shape=forma)
+    matrices = abrir(os.path.join(directorio, 'matrices.npy'), mode='w+', dtype=np.float64,
+                     shape=(num_casos, 2, 3))
+    sigmas = abrir(os.path.join(directorio, 'sigmas.npy'), mode='w+', dtype=np.float32,
+                   shape=(num_casos,))
+    
+    with open(os.path.join(directorio, 'casos.csv'), 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.writer(f)
+        escritor.writerow(['indice', 'tipo_imagen', 'transformacion', 'params'])
+        
+        trabajo = np.empty((size, size), np.float32)
+        for k in range(num_casos):
+            # La imagen móvil se escribe directamente en el archivo mapeado
+            fija, _, M, sigma, info = generar_caso(k, semilla, salida=moviles[k], trabajo=trabajo,
+                                                   **kwargs)
+            fijas[k] = fija
+            matrices[k] = M
+            sigmas[k] = sigma
+            escritor.writerow([k, info['tipo_imagen'], info['transformacion'],
+                               json.dumps(info['params'])])
+            
+            if (k + 1) % tam_lote == 0:
+                for arr in (fijas, moviles, matrices, sigmas):
+                    arr.flush()
+                if verbose:
+                    print(f"✓ {k + 1}/{num_casos} casos escritos")
+    
+    for arr in (fijas, moviles, matrices, sigmas):
+        arr.flush()
+    
+    config = {'num_casos': num_casos, 'semilla': semilla,
+              **{k: list(v) if isinstance(v, tuple) else v for k, v in kwargs.items()}}
+    with open(os.path.join(directorio, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    
+    if verbose:
+        print(f"✓ Dataset guardado: {num_casos} casos en {directorio}")
+    return directorio
+
+
+def cargar_dataset(directorio):
+    """
+    Abre un conjunto de datos guardado con `guardar_dataset` sin cargarlo
+    en memoria.
+    
+    Args:
+        directorio: carpeta del conjunto de datos
+    
+    Returns:
+        diccionario con 'fija', 'movil', 'matrices', 'sigmas' (np.memmap de
+        solo lectura), 'casos' (lista de info por caso) y 'config'
+    """
+    datos = {nombre: np.load(os.path.join(directorio, f'{nombre}.npy'), mmap_mode='r')
+             for nombre in ('fija', 'movil', 'matrices', 'sigmas')}
+    
+    with open(os.path.join(directorio, 'casos.csv'), newline='', encoding='utf-8') as f:
+        datos['casos'] = [
+            {'indice': int(fila['indice']), 'tipo_imagen': fila['tipo_imagen'],
+             'transformacion': fila['transformacion'], 'params': json.loads(fila['params'])}
+            for fila in csv.DictReader(f)
+        ]
+    with open(os.path.join(directorio, 'config.json'), encoding='utf-8') as f:
+        datos['config'] = json.load(f)
+    return datos
+
+
+def iterar_dataset(directorio, inicio=0, fin=None):
+    """
+    Recorre un conjunto de datos guardado, caso a caso.
+    
+    Args:
+        directorio: carpeta del conjunto de datos
+        inicio: primer caso
+        fin: caso final (excluido; None = hasta el final)
+    
+    Yields:
+        (fija, movil, M, sigma, info), como `generar_casos`
+    """
+    datos = cargar_dataset(directorio)
+    fin = len(datos['sigmas']) if fin is None else fin
+    for k in range(inicio, fin):
+        yield (datos['fija'][k], datos['movil'][k], np.array(datos['matrices'][k]),
+               float(datos['sigmas'][k]), datos['casos'][k])
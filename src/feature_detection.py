@@ -3,11 +3,124 @@ Módulo para detección de características en imágenes.
 Basado en los notebooks guía del curso de Visión por Computador.
 """
 
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
 
-def detectar_caracteristicas(imagen, metodo='orb', max_features=500):
+# Formato compacto de un keypoint (mismos campos que cv2.KeyPoint)
+DTYPE_KEYPOINT = np.dtype([
+    ('x', np.float32),
+    ('y', np.float32),
+    ('size', np.float32),
+    ('angle', np.float32),
+    ('response', np.float32),
+    ('octave', np.int32),
+    ('class_id', np.int32)
+])
+
+# Registro de detectores configurados. Es local a cada hilo porque los
+# objetos de OpenCV no deben usarse desde varios hilos a la vez.
+_registro_detectores = threading.local()
+
+
+def obtener_detector(metodo='orb', max_features=500):
+    """
+    Devuelve un detector configurado, reutilizándolo entre llamadas.
+    
+    Args:
+        metodo: 'orb', 'sift', 'akaze'
+        max_features: número máximo de características a detectar
+    
+    Returns:
+        detector de OpenCV
+    """
+    detectores = getattr(_registro_detectores, 'detectores', None)
+    if detectores is None:
+        detectores = _registro_detectores.detectores = {}
+    
+    clave = (metodo, max_features)
+    if clave not in detectores:
+        if metodo == 'orb':
+            detectores[clave] = cv2.ORB_create(max_features)
+        elif metodo == 'sift':
+            detectores[clave] = cv2.SIFT_create(max_features)
+        elif metodo == 'akaze':
+            detectores[clave] = cv2.AKAZE_create()
+        else:
+            raise ValueError(f"Método '{metodo}' no reconocido")
+    
+    return detectores[clave]
+
+
+def limpiar_detectores():
+    """
+    Elimina los detectores registrados en el hilo actual.
+    """
+    _registro_detectores.detectores = {}
+
+
+def keypoints_a_array(keypoints):
+    """
+    Convierte una lista de cv2.KeyPoint a un array estructurado.
+    
+    Args:
+        keypoints: lista de cv2.KeyPoint
+    
+    Returns:
+        array con dtype DTYPE_KEYPOINT
+    """
+    if isinstance(keypoints, np.ndarray):
+        return keypoints
+    
+    arr = np.empty(len(keypoints), dtype=DTYPE_KEYPOINT)
+    if len(keypoints) > 0:
+        arr[:] = [(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id)
+                  for kp in keypoints]
+    return arr
+
+
+def array_a_keypoints(arr):
+    """
+    Convierte un array estructurado de keypoints a una lista de cv2.KeyPoint.
+    
+    Args:
+        arr: array con dtype DTYPE_KEYPOINT
+    
+    Returns:
+        lista de cv2.KeyPoint
+    """
+    return [
+        cv2.KeyPoint(float(k['x']), float(k['y']), float(k['size']), float(k['angle']),
+                     float(k['response']), int(k['octave']), int(k['class_id']))
+        for k in arr
+    ]
+
+
+def coordenadas_keypoints(keypoints):
+    """
+    Devuelve las posiciones de unos keypoints como array (N, 2) float32.
+    
+    Args:
+        keypoints: array estructurado (DTYPE_KEYPOINT) o lista de cv2.KeyPoint
+    
+    Returns:
+        array (N, 2) con las coordenadas (x, y)
+    """
+    if isinstance(keypoints, np.ndarray):
+        return np.stack([keypoints['x'], keypoints['y']], axis=1)
+    return cv2.KeyPoint_convert(keypoints).reshape(-1, 2)
+
+
+def detectar_caracteristicas(imagen, metodo='orb', max_features=500, cache=None, bloques=None,
+                             compacto=False):
     """
     Detecta características (keypoints) y sus descriptores en una imagen.
     
@@ -15,36 +128,251 @@ def detectar_caracteristicas(imagen, metodo='orb', max_features=500):
         imagen: imagen en escala de grises
         metodo: 'orb', 'sift', 'akaze'
         max_features: número máximo de características a detectar
+        cache: CacheCaracteristicas opcional; si la imagen ya fue procesada
+            con el mismo método y parámetros se omite la detección
+        bloques: diccionario opcional con los parámetros de
+            `detectar_caracteristicas_por_bloques` (p. ej. {'tam_bloque': 1024});
+            si se indica, la detección se hace por bloques en paralelo
+        compacto: devolver los keypoints como array estructurado
+            (DTYPE_KEYPOINT) en lugar de una lista de cv2.KeyPoint
     
     Returns:
         (keypoints, descriptores)
     """
-    if metodo == 'orb':
-        detector = cv2.ORB_create(max_features)
-    elif metodo == 'sift':
-        detector = cv2.SIFT_create(max_features)
-    elif metodo == 'akaze':
-        detector = cv2.AKAZE_create()
+    if cache is not None:
+        params = {'max_features': max_features}
+        if bloques is not None:
+            params['bloques'] = tuple(sorted(bloques.items()))
+        clave = cache.clave(imagen, metodo, params)
+        entrada = cache.obtener(clave)
+        if entrada is not None:
+            keypoints, descriptores = entrada
+            return (keypoints if compacto else array_a_keypoints(keypoints)), descriptores
+    
+    if bloques is not None:
+        keypoints, descriptores = detectar_caracteristicas_por_bloques(
+            imagen, metodo, max_features, compacto=True, **bloques
+        )
     else:
-        raise ValueError(f"Método '{metodo}' no reconocido")
+        detector = obtener_detector(metodo, max_features)
+        keypoints, descriptores = detector.detectAndCompute(imagen, None)
+        if compacto or cache is not None:
+            keypoints = keypoints_a_array(keypoints)
+    
+    if cache is not None:
+        cache.guardar(clave, keypoints, descriptores)
     
-    keypoints, descriptores = detector.detectAndCompute(imagen, None)
+    if not compacto and isinstance(keypoints, np.ndarray):
+        keypoints = array_a_keypoints(keypoints)
     
     return keypoints, descriptores
 
 
+def _detectar_en_bloque(imagen, metodo, cuota, bloque, nucleo):
+    """
+    Detecta en un bloque (con solape) y conserva solo los keypoints cuyo
+    centro cae en el núcleo del bloque, para no duplicar puntos en las costuras.
+    """
+    x0, y0, x1, y1 = bloque
+    nx0, ny0, nx1, ny1 = nucleo
+    
+    detector = obtener_detector(metodo, cuota)
+    keypoints, descriptores = detector.detectAndCompute(imagen[y0:y1, x0:x1], None)
+    
+    if descriptores is None or len(keypoints) == 0:
+        return np.empty(0, dtype=DTYPE_KEYPOINT), None
+    
+    kps = keypoints_a_array(keypoints)
+    kps['x'] += x0
+    kps['y'] += y0
+    
+    dentro = (kps['x'] >= nx0) & (kps['x'] < nx1) & (kps['y'] >= ny0) & (kps['y'] < ny1)
+    return kps[dentro], descriptores[dentro]
+
+
+def _reparto_rejilla(kps, id_bloque, num_bloques, max_features):
+    """
+    Reparte el presupuesto global por igual entre bloques. El presupuesto que
+    un bloque no usa se asigna a los keypoints restantes de mayor respuesta.
+    """
+    cuota = max_features // num_bloques
+    
+    # Rango de cada keypoint dentro de su bloque (0 = mayor respuesta)
+    orden = np.lexsort((-kps['response'], id_bloque))
+    ids_ordenados = id_bloque[orden]
+    inicio_bloque = np.searchsorted(ids_ordenados, ids_ordenados, side='left')
+    rango = np.empty(len(kps), dtype=np.int64)
+    rango[orden] = np.arange(len(kps)) - inicio_bloque
+    
+    seleccion = rango < cuota
+    restante = max_features - np.count_nonzero(seleccion)
+    if restante > 0:
+        candidatos = np.flatnonzero(~seleccion)
+        mejores = candidatos[np.argsort(-kps['response'][candidatos], kind='stable')[:restante]]
+        seleccion[mejores] = True
+    
+    return np.flatnonzero(seleccion)
+
+
+def _reparto_anms(kps, max_features, robustez=0.9, max_candidatos=None):
+    """
+    Supresión de no-máximos adaptativa (ANMS): conserva los keypoints con
+    mayor radio de supresión respecto a puntos claramente más fuertes.
+    """
+    if max_candidatos is None:
+        max_candidatos = 3 * max_features
+    
+    candidatos = np.argsort(-kps['response'], kind='stable')[:max_candidatos]
+    xy = np.stack([kps['x'][candidatos], kps['y'][candidatos]], axis=1)
+    resp = kps['response'][candidatos]
+    
+    radios = np.full(len(candidatos), np.inf, dtype=np.float32)
+    # Por bloques de filas para acotar la memoria de la matriz de distancias
+    paso = 2048
+    for i in range(0, len(candidatos), paso):
+        d2 = ((xy[i:i+paso, None, :] - xy[None, :, :]) ** 2).sum(axis=2)
+        mas_fuertes = resp[i:i+paso, None] < robustez * resp[None, :]
+        d2[~mas_fuertes] = np.inf
+        radios[i:i+paso] = d2.min(axis=1)
+    
+    return candidatos[np.argsort(-radios, kind='stable')[:max_features]]
+
+
+def detectar_caracteristicas_por_bloques(imagen, metodo='orb', max_features=500,
+                                         tam_bloque=1024, solape=64,
+                                         num_hilos=None, reparto='rejilla', compacto=False):
+    """
+    Detecta características dividiendo la imagen en bloques con solape que se
+    procesan en paralelo (OpenCV libera el GIL durante la detección).
+    
+    Args:
+        imagen: imagen en escala de grises
+        metodo: 'orb', 'sift', 'akaze'
+        max_features: presupuesto global de características
+        tam_bloque: lado del núcleo de cada bloque en píxeles
+        solape: margen añadido a cada lado del bloque (contexto para descriptores)
+        num_hilos: número de hilos (None = número de CPUs)
+        reparto: 'rejilla' (cuota por bloque) o 'anms' (supresión adaptativa)
+        compacto: devolver los keypoints como array estructurado
+    
+    Returns:
+        (keypoints, descriptores)
+    """
+    if reparto not in ('rejilla', 'anms'):
+        raise ValueError(f"Reparto '{reparto}' no reconocido")
+    
+    h, w = imagen.shape[:2]
+    bloques = []
+    for ny0 in range(0, h, tam_bloque):
+        for nx0 in range(0, w, tam_bloque):
+            nx1, ny1 = min(nx0 + tam_bloque, w), min(ny0 + tam_bloque, h)
+            bloque = (max(nx0 - solape, 0), max(ny0 - solape, 0),
+                      min(nx1 + solape, w), min(ny1 + solape, h))
+            bloques.append((bloque, (nx0, ny0, nx1, ny1)))
+    
+    # Se sobremuestrea cada bloque para que el reparto global tenga margen
+    cuota = max(2 * math.ceil(max_features / len(bloques)), 32)
+    
+    num_hilos = num_hilos or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=min(num_hilos, len(bloques))) as ejecutor:
+        resultados = list(ejecutor.map(
+            lambda b: _detectar_en_bloque(imagen, metodo, cuota, b[0], b[1]), bloques
+        ))
+    
+    resultados = [(i, kps, des) for i, (kps, des) in enumerate(resultados) if des is not None]
+    if not resultados:
+        return (np.empty(0, dtype=DTYPE_KEYPOINT) if compacto else []), None
+    
+    kps = np.concatenate([r[1] for r in resultados])
+    descriptores = np.concatenate([r[2] for r in resultados])
+    id_bloque = np.concatenate([np.full(len(r[1]), r[0]) for r in resultados])
+    
+    if len(kps) > max_features:
+        if reparto == 'rejilla':
+            indices = _reparto_rejilla(kps, id_bloque, len(bloques), max_features)
+        else:
+            indices = _reparto_anms(kps, max_features)
+        kps, descriptores = kps[indices], descriptores[indices]
+    
+    return (kps if compacto else array_a_keypoints(kps)), descriptores
+
+
+def reducir_imagen(imagen, escala):
+    """
+    Reduce una imagen por un factor de escala (para el nivel grueso de la pirámide).
+    
+    Args:
+        imagen: imagen de entrada
+        escala: factor de escala (0-1)
+    
+    Returns:
+        imagen reducida
+    """
+    h, w = imagen.shape[:2]
+    tam = (max(int(round(w * escala)), 1), max(int(round(h * escala)), 1))
+    return cv2.resize(imagen, tam, interpolation=cv2.INTER_AREA)
+
+
+def detectar_caracteristicas_en_region(imagen, puntos, radio, metodo='orb', max_features=500,
+                                       compacto=False):
+    """
+    Detecta características solo en ventanas cuadradas alrededor de unos puntos.
+    
+    La detección se hace sobre el recorte que contiene todas las ventanas y
+    con una máscara, de modo que el coste depende del área de las ventanas y
+    no del tamaño de la imagen completa.
+    
+    Args:
+        imagen: imagen en escala de grises
+        puntos: array (N, 2) con las posiciones (x, y) de interés
+        radio: semilado de cada ventana en píxeles
+        metodo: 'orb', 'sift', 'akaze'
+        max_features: número máximo de características a detectar
+        compacto: devolver los keypoints como array estructurado
+    
+    Returns:
+        (keypoints, descriptores)
+    """
+    h, w = imagen.shape[:2]
+    puntos = np.round(np.asarray(puntos, dtype=np.float32).reshape(-1, 2)).astype(np.int64)
+    puntos = puntos[(puntos[:, 0] >= 0) & (puntos[:, 0] < w) & (puntos[:, 1] >= 0) & (puntos[:, 1] < h)]
+    if len(puntos) == 0:
+        return (np.empty(0, dtype=DTYPE_KEYPOINT) if compacto else []), None
+    
+    radio = int(math.ceil(radio))
+    x0, y0 = max(puntos[:, 0].min() - radio, 0), max(puntos[:, 1].min() - radio, 0)
+    x1, y1 = min(puntos[:, 0].max() + radio + 1, w), min(puntos[:, 1].max() + radio + 1, h)
+    
+    # Máscara: un píxel por punto dilatado a una ventana de lado 2*radio+1
+    mascara = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    mascara[puntos[:, 1] - y0, puntos[:, 0] - x0] = 255
+    mascara = cv2.dilate(mascara, np.ones((2 * radio + 1, 2 * radio + 1), np.uint8))
+    
+    detector = obtener_detector(metodo, max_features)
+    keypoints, descriptores = detector.detectAndCompute(imagen[y0:y1, x0:x1], mascara)
+    
+    kps = keypoints_a_array(keypoints)
+    kps['x'] += x0
+    kps['y'] += y0
+    
+    return (kps if compacto else array_a_keypoints(kps)), descriptores
+
+
 def visualizar_keypoints(imagen, keypoints, titulo='Keypoints Detectados'):
     """
     Visualiza los keypoints detectados sobre la imagen.
     
     Args:
         imagen: imagen original
-        keypoints: lista de keypoints detectados
+        keypoints: keypoints detectados (lista de cv2.KeyPoint o array estructurado)
         titulo: título de la figura
     
     Returns:
         imagen con keypoints dibujados
     """
+    if isinstance(keypoints, np.ndarray):
+        keypoints = array_a_keypoints(keypoints)
+    
     img_keypoints = cv2.drawKeypoints(
         imagen, keypoints, None, 
         color=(0, 255, 0), 
@@ -54,30 +382,136 @@ def visualizar_keypoints(imagen, keypoints, titulo='Keypoints Detectados'):
     return img_keypoints
 
 
-def comparar_detectores(imagen, detectores=['orb', 'sift', 'akaze']):
+def memoria_proceso_mb():
+    """
+    Devuelve (rss_actual, pico_rss) del proceso en MB, o (None, None) si la
+    plataforma no permite medirlo.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            campos = dict(linea.split(':', 1) for linea in f if ':' in linea)
+        return int(campos['VmRSS'].split()[0]) / 1024, int(campos['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        pass
+    
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pico = pico / 1024 ** 2 if sys.platform == 'darwin' else pico / 1024
+    return pico, pico
+
+
+def reiniciar_pico_memoria():
+    """
+    Reinicia el pico de memoria (VmHWM) del proceso al RSS actual, para
+    medir el pico de una sola operación. Solo tiene efecto en Linux.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _medir_detector(args):
+    """
+    Ejecuta un detector midiendo tiempo y memoria. Se usa como tarea de un
+    proceso trabajador, por eso devuelve los keypoints como array.
+    """
+    imagen, metodo, max_features = args
+    
+    reiniciar_pico_memoria()
+    try:
+        rss_inicial, _ = memoria_proceso_mb()
+        t = time.perf_counter()
+        kp, des = detectar_caracteristicas(imagen, metodo, max_features, compacto=True)
+        tiempo = time.perf_counter() - t
+        _, pico = memoria_proceso_mb()
+    except Exception as e:
+        return metodo, None, str(e)
+    
+    megapixeles = imagen.shape[0] * imagen.shape[1] / 1e6
+    return metodo, {
+        'keypoints': kp,
+        'descriptores': des,
+        'num_keypoints': len(kp),
+        'tiempo_s': tiempo,
+        'memoria_pico_mb': None if pico is None else max(pico - rss_inicial, 0.0),
+        'bytes_descriptores': 0 if des is None else int(des.nbytes),
+        'keypoints_por_mp': len(kp) / megapixeles
+    }, None
+
+
+def comparar_detectores(imagen, detectores=['orb', 'sift', 'akaze'], max_features=500,
+                        paralelo=True, num_procesos=None, verbose=True):
     """
     Compara diferentes detectores de características en la misma imagen.
     
+    Cada detector se ejecuta en su propio proceso trabajador (en paralelo si
+    `paralelo` es True), lo que permite medir su pico de memoria por separado.
+    
     Args:
         imagen: imagen en escala de grises
         detectores: lista de detectores a comparar
+        max_features: número máximo de características por detector
+        paralelo: ejecutar los detectores a la vez en un pool de procesos
+        num_procesos: tamaño del pool (None = un proceso por detector)
+        verbose: imprimir un resumen por detector
     
     Returns:
-        diccionario con resultados para cada detector
+        diccionario con resultados para cada detector: keypoints, descriptores,
+        num_keypoints, tiempo_s, memoria_pico_mb, bytes_descriptores y
+        keypoints_por_mp (ver `tabla_detectores`)
     """
-    resultados = {}
+    tareas = [(imagen, metodo, max_features) for metodo in detectores]
     
-    for metodo in detectores:
-        try:
-            kp, des = detectar_caracteristicas(imagen, metodo)
-            resultados[metodo] = {
-                'keypoints': kp,
-                'descriptores': des,
-                'num_keypoints': len(kp) if kp else 0
-            }
-            print(f"✓ {metodo.upper()}: {len(kp) if kp else 0} características detectadas")
-        except Exception as e:
-            print(f"✗ {metodo.upper()}: Error - {str(e)}")
+    if paralelo:
+        num_procesos = num_procesos or len(tareas)
+        # maxtasksperchild=1: un proceso nuevo por detector, memoria aislada
+        with multiprocessing.Pool(num_procesos, maxtasksperchild=1) as pool:
+            salidas = pool.map(_medir_detector, tareas, chunksize=1)
+    else:
+        salidas = [_medir_detector(tarea) for tarea in tareas]
+    
+    resultados = {}
+    for metodo, resultado, error in salidas:
+        if resultado is None:
+            if verbose:
+                print(f"✗ {metodo.upper()}: Error - {error}")
             resultados[metodo] = None
+            continue
+        
+        resultado['keypoints'] = array_a_keypoints(resultado['keypoints'])
+        resultados[metodo] = resultado
+        if verbose:
+            memoria = resultado['memoria_pico_mb']
+            memoria = 'n/d' if memoria is None else f"{memoria:.1f} MB"
+            print(f"✓ {metodo.upper()}: {resultado['num_keypoints']} características detectadas "
+                  f"en {resultado['tiempo_s']*1000:.1f} ms (memoria pico {memoria})")
     
     return resultados
+
+
+def tabla_detectores(resultados):
+    """
+    Resume el resultado de `comparar_detectores` en una tabla.
+    
+    Args:
+        resultados: diccionario devuelto por comparar_detectores
+    
+    Returns:
+        DataFrame con una fila por detector (usar `.to_dict('records')` para
+        obtener registros serializables en JSON)
+    """
+    import pandas as pd
+    
+    columnas = ['num_keypoints', 'tiempo_s', 'memoria_pico_mb', 'bytes_descriptores', 'keypoints_por_mp']
+    filas = []
+    for metodo, resultado in resultados.items():
+        fila = {'metodo': metodo}
+        fila.update({c: (resultado[c] if resultado is not None else None) for c in columnas})
+        filas.append(fila)
+    
+    return pd.DataFrame(filas, columns=['metodo'] + columnas)
@@ -0,0 +1,299 @@
+"""
+Módulo de registro por lotes desde la línea de comandos.
+Registra muchos pares de imágenes (de un manifiesto CSV o de un directorio)
+en un pool de procesos y va escribiendo las homografías y las estadísticas
+de inliers a un CSV a medida que terminan, de modo que una ejecución
+interrumpida puede reanudarse sin repetir los pares ya completados.
+
+Uso:
+    python src/registration.py batch --manifiesto pares.csv --salida results/registro/lote.csv
+    python src/registration.py batch --directorio data/original --referencia IMG02.jpg
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import time
+
+import numpy as np
+from panorama import cargar_imagen_gris, ejecutar_acotado
+from registration import registro_con_caracteristicas
+
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+COLUMNAS = (['id', 'fija', 'movil', 'estado', 'error', 'metodo', 'num_keypoints_fija',
+             'num_keypoints_movil', 'num_matches', 'num_inliers', 'ratio_inliers']
+            + [f'h{f}{c}' for f in range(3) for c in range(3)]
+            + ['tiempo_s'])
+
+
+def leer_manifiesto(ruta):
+    """
+    Lee un manifiesto CSV de pares de imágenes.
+    
+    El CSV debe tener las columnas `fija` y `movil` (rutas relativas al
+    propio manifiesto o absolutas) y, opcionalmente, `id`.
+    
+    Args:
+        ruta: ruta del manifiesto
+    
+    Returns:
+        lista de (id, ruta_fija, ruta_movil)
+    """
+    base = os.path.dirname(os.path.abspath(ruta))
+    pares = []
+    with open(ruta, newline='', encoding='utf-8') as f:
+        lector = csv.DictReader(f)
+        if lector.fieldnames is None or not {'fija', 'movil'} <= set(lector.fieldnames):
+            raise ValueError(f"El manifiesto '{ruta}' debe tener las columnas 'fija' y 'movil'")
+        for k, fila in enumerate(lector):
+            fija = os.path.join(base, fila['fija'])
+            movil = os.path.join(base, fila['movil'])
+            pares.append((fila.get('id') or str(k), fija, movil))
+    return pares
+
+
+def pares_directorio(directorio, referencia=None):
+    """
+    Genera los pares a registrar a partir de las imágenes de un directorio
+    (ordenadas por nombre).
+    
+    Args:
+        directorio: carpeta con las imágenes
+        referencia: nombre de la imagen fija común; si es None se registran
+            las imágenes consecutivas (cada una contra la anterior)
+    
+    Returns:
+        lista de (id, ruta_fija, ruta_movil)
+    """
+    nombres = sorted(n for n in os.listdir(directorio) if n.lower().endswith(EXTENSIONES_IMAGEN))
+    rutas = {n: os.path.join(directorio, n) for n in nombres}
+    
+    if referencia is not None:
+        if referencia not in rutas:
+            raise ValueError(f"La imagen de referencia '{referencia}' no está en '{directorio}'")
+        return [(f'{referencia}|{n}', rutas[referencia], rutas[n])
+                for n in nombres if n != referencia]
+    return [(f'{a}|{b}', rutas[a], rutas[b]) for a, b in zip(nombres[:-1], nombres[1:])]
+
+
+def truncar_linea_incompleta(ruta, bloque=65536):
+    """
+    Elimina la última línea de un CSV si quedó a medias (sin salto de línea
+    final), p. ej. porque la ejecución se interrumpió mientras se escribía.
+    
+    Args:
+        ruta: CSV de salida de una ejecución anterior
+        bloque: bytes que se leen cada vez buscando el último salto de línea
+    
+    Returns:
+        número de bytes eliminados
+    """
+    if not os.path.exists(ruta):
+        return 0
+    
+    with open(ruta, 'rb+') as f:
+        tamano = f.seek(0, os.SEEK_END)
+        fin = tamano
+        while fin > 0:
+            inicio = max(fin - bloque, 0)
+            f.seek(inicio)
+            datos = f.read(fin - inicio)
+            if fin == tamano and datos.endswith(b'\n'):
+                return 0
+            salto = datos.rfind(b'\n')
+            if salto >= 0:
+                fin = inicio + salto + 1
+                break
+            fin = inicio
+        f.truncate(fin)
+    return tamano - fin
+
+
+def leer_completados(ruta, reintentar_fallidos=False):
+    """
+    Identificadores de los pares ya registrados en un CSV de salida.
+    
+    Args:
+        ruta: CSV de salida de una ejecución anterior
+        reintentar_fallidos: no contar como completados los pares con error
+    
+    Returns:
+        conjunto de ids
+    """
+    if not os.path.exists(ruta):
+        return set()
+    
+    estados = {}
+    with open(ruta, newline='', encoding='utf-8') as f:
+        for fila in csv.DictReader(f):
+            estados[fila['id']] = fila['estado']     # la última fila de cada id prevalece
+    return {i for i, estado in estados.items() if estado == 'ok' or not reintentar_fallidos}
+
+
+def _registrar_entrada(args):
+    """
+    Registra un par del lote (tarea de un proceso trabajador). Nunca lanza
+    excepciones: los errores se devuelven en la fila.
+    """
+    identificador, fija, movil, metodo, max_features, reproj_thresh, opciones = args
+    fila = dict.fromkeys(COLUMNAS, '')
+    fila.update(id=identificador, fija=fija, movil=movil, metodo=metodo)
+    
+    t = time.perf_counter()
+    try:
+        img_fija = cargar_imagen_gris(fija)
+        img_movil = cargar_imagen_gris(movil)
+        with contextlib.redirect_stdout(io.StringIO()):
+            H, _, info = registro_con_caracteristicas(img_fija, img_movil, metodo, max_features,
+                                                      reproj_thresh=reproj_thresh, **opciones)
+    except Exception as e:
+        H, info = None, None
+        # En una sola línea, para que cada fila del CSV ocupe una línea
+        fila['error'] = ' '.join(f'{type(e).__name__}: {e}'.split())
+    fila['tiempo_s'] = round(time.perf_counter() - t, 4)
+    
+    if H is None:
+        fila['estado'] = 'error'
+        fila['error'] = fila['error'] or 'registro fallido'
+        return fila
+    
+    num_matches = len(info['matches'])
+    fila.update(
+        estado='ok',
+        num_keypoints_fija=len(info['keypoints1']),
+        num_keypoints_movil=len(info['keypoints2']),
+        num_matches=num_matches,
+        num_inliers=info['num_inliers'],
+        ratio_inliers=round(info['num_inliers'] / max(num_matches, 1), 4)
+    )
+    H = H / H[2, 2]
+    for f in range(3):
+        for c in range(3):
+            fila[f'h{f}{c}'] = repr(float(H[f, c]))
+    return fila
+
+
+def homografia_fila(fila):
+    """
+    Reconstruye la homografía 3x3 de una fila del CSV de salida.
+    """
+    return np.array([[float(fila[f'h{f}{c}']) for c in range(3)] for f in range(3)])
+
+
+def registrar_lote(pares, ruta_salida, metodo='orb', max_features=500, reproj_thresh=5.0,
+                   num_procesos=None, max_pendientes=None, reanudar=True,
+                   reintentar_fallidos=False, opciones_registro=None, verbose=True):
+    """
+    Registra una lista de pares en un pool de procesos y escribe cada
+    resultado al CSV de salida en cuanto termina.
+    
+    Args:
+        pares: lista de (id, ruta_fija, ruta_movil)
+        ruta_salida: CSV de salida (o .parquet: se escribe el CSV junto a
+            él y se convierte al terminar; requiere pyarrow)
+        metodo: 'orb', 'sift', 'akaze'
+        max_features: número máximo de características
+        reproj_thresh: umbral de reproyección de RANSAC
+        num_procesos: tamaño del pool (None = número de CPUs; 1 = sin pool)
+        max_pendientes: pares en vuelo como máximo (None = 2 por proceso)
+        reanudar: omitir los pares que ya están en el CSV de salida (antes se
+            descarta la última fila si quedó a medias)
+        reintentar_fallidos: al reanudar, volver a registrar los pares con error
+        opciones_registro: argumentos extra para `registro_con_caracteristicas`
+        verbose: imprimir el progreso
+    
+    Returns:
+        diccionario con el número de pares ok, con error y omitidos, y el tiempo
+    """
+    parquet = ruta_salida.endswith('.parquet')
+    ruta_csv = os.path.splitext(ruta_salida)[0] + '.csv' if parquet else ruta_salida
+    directorio = os.path.dirname(ruta_csv)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    
+    completados = set()
+    if reanudar:
+        if truncar_linea_incompleta(ruta_csv) and verbose:
+            print(f"⚠️ Se descarta la última fila incompleta de {ruta_csv}")
+        completados = leer_completados(ruta_csv, reintentar_fallidos)
+    pendientes = [p for p in pares if p[0] not in completados]
+    if verbose:
+        print(f"✓ Pares: {len(pares)} ({len(pares) - len(pendientes)} ya completados, "
+              f"{len(pendientes)} pendientes)")
+    
+    nuevo = not reanudar or not os.path.exists(ruta_csv) or os.path.getsize(ruta_csv) == 0
+    tareas = ((i, fija, movil, metodo, max_features, reproj_thresh, opciones_registro or {})
+              for i, fija, movil in pendientes)
+    resumen = {'ok': 0, 'error': 0, 'omitidos': len(pares) - len(pendientes)}
+    t0 = time.perf_counter()
+    
+    with open(ruta_csv, 'w' if nuevo else 'a', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=COLUMNAS)
+        if nuevo:
+            escritor.writeheader()
+        for k, fila in enumerate(ejecutar_acotado(_registrar_entrada, tareas, num_procesos,
+                                                  max_pendientes), 1):
+            escritor.writerow(fila)
+            f.flush()
+            resumen[fila['estado']] += 1
+            if verbose:
+                if fila['estado'] == 'ok':
+                    print(f"✓ [{k}/{len(pendientes)}] {fila['id']}: {fila['num_inliers']} inliers "
+                          f"({fila['tiempo_s']:.2f} s)")
+                else:
+                    print(f"✗ [{k}/{len(pendientes)}] {fila['id']}: {fila['error']}")
+    
+    resumen['tiempo_s'] = time.perf_counter() - t0
+    
+    if parquet:
+        try:
+            import pandas as pd
+            pd.read_csv(ruta_csv).to_parquet(ruta_salida, index=False)
+        except ImportError:
+            print("⚠️ pyarrow no está instalado; los resultados quedan solo en CSV")
+    
+    if verbose:
+        print(f"✓ Lote terminado: {resumen['ok']} ok, {resumen['error']} con error, "
+              f"{resumen['omitidos']} omitidos en {resumen['tiempo_s']:.2f} s -> {ruta_csv}")
+    return resumen
+
+
+def main(argv=None):
+    """
+    Punto de entrada del subcomando `batch`.
+    """
+    parser = argparse.ArgumentParser(
+        prog='registration.py batch',
+        description='Registro por lotes de pares de imágenes'
+    )
+    entrada = parser.add_mutually_exclusive_group(required=True)
+    entrada.add_argument('--manifiesto', help="CSV con columnas 'fija', 'movil' (e 'id' opcional)")
+    entrada.add_argument('--directorio', help='carpeta de imágenes')
+    parser.add_argument('--referencia', help='con --directorio: imagen fija común '
+                                             '(por defecto, imágenes consecutivas)')
+    parser.add_argument('--salida', default=os.path.join('results', 'registro', 'lote.csv'),
+                        help='CSV (o .parquet) de salida')
+    parser.add_argument('--metodo', default='orb', choices=['orb', 'sift', 'akaze'])
+    parser.add_argument('--max-features', type=int, default=500)
+    parser.add_argument('--reproj-thresh', type=float, default=5.0)
+    parser.add_argument('--procesos', type=int, default=None, help='tamaño del pool de procesos')
+    parser.add_argument('--max-pendientes', type=int, default=None,
+                        help='pares en vuelo como máximo')
+    parser.add_argument('--sin-reanudar', action='store_true',
+                        help='sobrescribir la salida en lugar de reanudar')
+    parser.add_argument('--reintentar-fallidos', action='store_true',
+                        help='al reanudar, repetir los pares con error')
+    args = parser.parse_args(argv)
+    
+    if args.manifiesto is not None:
+        pares = leer_manifiesto(args.manifiesto)
+    else:
+        pares = pares_directorio(args.directorio, args.referencia)
+    
+    resumen = registrar_lote(pares, args.salida, args.metodo, args.max_features, args.reproj_thresh,
+                             args.procesos, args.max_pendientes, reanudar=not args.sin_reanudar,
+                             reintentar_fallidos=args.reintentar_fallidos)
+    return 1 if resumen['error'] > 0 and resumen['ok'] == 0 else 0
@@ -5,9 +5,243 @@ Basado en los notebooks guía del curso de Visión por Computador.
 
 import cv2
 import numpy as np
+from feature_detection import array_a_keypoints, coordenadas_keypoints
 
 
-def emparejar_caracteristicas(des1, des2, metodo='orb', ratio_test=0.75):
+# Formato compacto de un match (mismos campos que cv2.DMatch)
+DTYPE_MATCH = np.dtype([
+    ('queryIdx', np.int32),
+    ('trainIdx', np.int32),
+    ('distance', np.float32)
+])
+
+
+def matches_a_array(matches):
+    """
+    Convierte una lista de cv2.DMatch a un array estructurado.
+    
+    Args:
+        matches: lista de cv2.DMatch
+    
+    Returns:
+        array con dtype DTYPE_MATCH
+    """
+    if isinstance(matches, np.ndarray):
+        return matches
+    
+    arr = np.empty(len(matches), dtype=DTYPE_MATCH)
+    if len(matches) > 0:
+        arr[:] = [(m.queryIdx, m.trainIdx, m.distance) for m in matches]
+    return arr
+
+
+def array_a_matches(arr):
+    """
+    Convierte un array estructurado de matches a una lista de cv2.DMatch.
+    
+    Args:
+        arr: array con dtype DTYPE_MATCH
+    
+    Returns:
+        lista de cv2.DMatch
+    """
+    return [cv2.DMatch(int(m['queryIdx']), int(m['trainIdx']), float(m['distance'])) for m in arr]
+
+
+def _tipo_norma(metodo):
+    """
+    Norma de distancia según el tipo de descriptor.
+    """
+    return cv2.NORM_HAMMING if metodo in ['orb', 'akaze'] else cv2.NORM_L2
+
+
+def aplicar_ratio_test(distancias, indices, ratio_test=0.75):
+    """
+    Ratio test de Lowe vectorizado sobre el resultado de una búsqueda KNN (k=2).
+    
+    Args:
+        distancias: array (N, 2) con las distancias al 1er y 2º vecino
+        indices: array (N, 2) con los índices del 1er y 2º vecino (-1 = ausente)
+        ratio_test: umbral para el ratio test
+    
+    Returns:
+        máscara booleana (N,) de consultas que superan el test
+    """
+    return (indices[:, 1] >= 0) & (distancias[:, 0] < ratio_test * distancias[:, 1])
+
+
+def verificacion_mutua(indices_12, indices_21):
+    """
+    Comprueba la consistencia mutua (cross-check) de forma vectorizada: el
+    vecino de i en la imagen 2 debe tener a i como vecino en la imagen 1.
+    
+    Args:
+        indices_12: array (N, k) de vecinos de cada consulta en la imagen 2
+        indices_21: array (M, k) de vecinos de cada descriptor de la imagen 2 en la 1
+    
+    Returns:
+        máscara booleana (N,)
+    """
+    vecino = indices_12[:, 0]
+    valido = (vecino >= 0) & (vecino < len(indices_21))
+    mutuo = np.zeros(len(vecino), dtype=bool)
+    mutuo[valido] = indices_21[vecino[valido], 0] == np.flatnonzero(valido)
+    return mutuo
+
+
+def construir_matches(distancias, indices, seleccion=None):
+    """
+    Construye el array de matches (DTYPE_MATCH) a partir de un resultado KNN.
+    
+    Args:
+        distancias: array (N, k) de distancias
+        indices: array (N, k) de índices de vecinos
+        seleccion: máscara booleana (N,) de consultas a conservar (None = todas)
+    
+    Returns:
+        array estructurado con dtype DTYPE_MATCH
+    """
+    consultas = np.arange(len(indices)) if seleccion is None else np.flatnonzero(seleccion)
+    matches = np.empty(len(consultas), dtype=DTYPE_MATCH)
+    matches['queryIdx'] = consultas
+    matches['trainIdx'] = indices[consultas, 0]
+    matches['distance'] = distancias[consultas, 0]
+    return matches
+
+
+# Identificadores de algoritmo de FLANN
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+
+
+class IndiceDescriptores:
+    """
+    Índice sobre los descriptores de entrenamiento (segunda imagen) que se
+    construye una sola vez y se reutiliza para muchas consultas.
+    
+    Backends:
+        'bf': fuerza bruta exacta (cv2.batchDistance)
+        'flann': aproximado; KD-tree para SIFT y LSH multi-probe para
+            descriptores binarios (ORB, AKAZE)
+    """
+    
+    def __init__(self, descriptores, metodo='orb', backend='flann', arboles=5, checks=50,
+                 tablas_lsh=6, tam_clave=12, nivel_multiprobe=1):
+        """
+        Construye el índice.
+        
+        Args:
+            descriptores: descriptores de entrenamiento
+            metodo: 'orb', 'sift', 'akaze' (determina el tipo de distancia)
+            backend: 'bf' o 'flann'
+            arboles: número de árboles del KD-tree (SIFT)
+            checks: hojas a revisar por consulta (más = mejor recall, más lento)
+            tablas_lsh: número de tablas hash LSH (binarios)
+            tam_clave: bits de la clave hash LSH
+            nivel_multiprobe: cubetas vecinas revisadas en LSH
+        """
+        if backend not in ('bf', 'flann'):
+            raise ValueError(f"Backend '{backend}' no reconocido")
+        
+        self.metodo = metodo
+        self.backend = backend
+        self.params = dict(arboles=arboles, checks=checks, tablas_lsh=tablas_lsh,
+                           tam_clave=tam_clave, nivel_multiprobe=nivel_multiprobe)
+        self.norma = _tipo_norma(metodo)
+        self.params_busqueda = {'checks': checks}
+        
+        if backend == 'flann' and self.norma == cv2.NORM_L2:
+            descriptores = np.ascontiguousarray(descriptores, dtype=np.float32)
+        self.descriptores = descriptores
+        
+        if backend == 'flann':
+            if self.norma == cv2.NORM_HAMMING:
+                params = dict(algorithm=FLANN_INDEX_LSH, table_number=tablas_lsh,
+                              key_size=tam_clave, multi_probe_level=nivel_multiprobe)
+            else:
+                params = dict(algorithm=FLANN_INDEX_KDTREE, trees=arboles)
+            self.indice = cv2.flann_Index(descriptores, params)
+    
+    def __len__(self):
+        return len(self.descriptores)
+    
+    def knn(self, des_consulta, k=2):
+        """
+        Busca los k vecinos más cercanos de cada descriptor de consulta.
+        
+        Args:
+            des_consulta: descriptores de consulta
+            k: número de vecinos
+        
+        Returns:
+            (distancias, indices): arrays (N, k) float32 / int32; los vecinos
+            que el índice no encuentra tienen distancia inf e índice -1
+        """
+        if self.backend == 'bf':
+            tipo = cv2.CV_32S if self.norma == cv2.NORM_HAMMING else cv2.CV_32F
+            distancias, indices = cv2.batchDistance(des_consulta, self.descriptores, tipo,
+                                                    normType=self.norma, K=k)
+            return distancias.astype(np.float32, copy=False), indices
+        
+        if self.norma == cv2.NORM_L2:
+            des_consulta = np.ascontiguousarray(des_consulta, dtype=np.float32)
+        indices, distancias = self.indice.knnSearch(des_consulta, k, params=self.params_busqueda)
+        distancias = distancias.astype(np.float32, copy=False)
+        if self.norma == cv2.NORM_L2:
+            # El KD-tree de FLANN devuelve distancias euclídeas al cuadrado
+            distancias = np.sqrt(distancias)
+        distancias[indices < 0] = np.inf
+        return distancias, indices
+    
+    def emparejar(self, des_consulta, ratio_test=0.75, mutuo=False):
+        """
+        Empareja descriptores de consulta contra el índice con el ratio test.
+        
+        Args:
+            des_consulta: descriptores de la primera imagen
+            ratio_test: umbral para el ratio test (None = sin ratio test)
+            mutuo: exigir además consistencia mutua (cross-check)
+        
+        Returns:
+            array estructurado (DTYPE_MATCH) de buenos matches
+        """
+        if des_consulta is None or len(des_consulta) == 0 or len(self) < 2:
+            return np.empty(0, dtype=DTYPE_MATCH)
+        
+        distancias, indices = self.knn(des_consulta, k=2)
+        seleccion = np.ones(len(indices), dtype=bool)
+        if ratio_test is not None:
+            seleccion &= aplicar_ratio_test(distancias, indices, ratio_test)
+        if mutuo:
+            inverso = IndiceDescriptores(des_consulta, self.metodo, self.backend, **self.params)
+            seleccion &= verificacion_mutua(indices, inverso.knn(self.descriptores, k=1)[1])
+        
+        return construir_matches(distancias, indices, seleccion)
+
+
+def knn_descriptores(des1, des2, metodo='orb', k=2, backend='bf', indice=None):
+    """
+    Búsqueda KNN que devuelve directamente arrays de NumPy.
+    
+    Args:
+        des1: descriptores de consulta
+        des2: descriptores de entrenamiento
+        metodo: 'orb', 'sift', 'akaze'
+        k: número de vecinos
+        backend: 'bf' o 'flann'
+        indice: IndiceDescriptores ya construido sobre des2 (opcional)
+    
+    Returns:
+        (distancias, indices): arrays (N, k) con los k vecinos de cada
+        descriptor de des1, ordenados de más cercano a más lejano
+    """
+    if indice is None:
+        indice = IndiceDescriptores(des2, metodo, backend)
+    return indice.knn(des1, k)
+
+
+def emparejar_caracteristicas(des1, des2, metodo='orb', ratio_test=0.75, compacto=False,
+                              backend='bf', indice=None, mutuo=False):
     """
     Empareja descriptores entre dos imágenes usando el ratio test de Lowe.
     
@@ -16,18 +250,27 @@ def emparejar_caracteristicas(des1, des2, metodo='orb', ratio_test=0.75):
         des2: descriptores de la segunda imagen
         metodo: 'orb', 'sift', 'akaze' (determina el tipo de distancia)
         ratio_test: umbral para el ratio test (típicamente 0.75)
+        compacto: devolver un array estructurado (DTYPE_MATCH) en lugar de
+            una lista de cv2.DMatch; el KNN se calcula sin crear objetos
+        backend: 'bf' (fuerza bruta) o 'flann' (aproximado, ver IndiceDescriptores)
+        indice: IndiceDescriptores ya construido sobre des2 para reutilizarlo
+            entre consultas (si se indica, des2 y backend se ignoran)
+        mutuo: conservar solo matches mutuamente consistentes (cross-check)
     
     Returns:
         lista de buenos matches
     """
-    if des1 is None or des2 is None:
-        return []
+    if indice is None and (des1 is None or des2 is None):
+        return np.empty(0, dtype=DTYPE_MATCH) if compacto else []
+    
+    if compacto or backend != 'bf' or indice is not None or mutuo:
+        if indice is None:
+            indice = IndiceDescriptores(des2, metodo, backend)
+        matches = indice.emparejar(des1, ratio_test, mutuo)
+        return matches if compacto else array_a_matches(matches)
     
     # Seleccionar matcher según el tipo de descriptor
-    if metodo in ['orb', 'akaze']:
-        matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
-    else:
-        matcher = cv2.BFMatcher(cv2.NORM_L2, crossCheck=False)
+    matcher = cv2.BFMatcher(_tipo_norma(metodo), crossCheck=False)
     
     # Emparejar usando KNN (k=2 para ratio test)
     matches = matcher.knnMatch(des1, des2, k=2)
@@ -43,30 +286,494 @@ def emparejar_caracteristicas(des1, des2, metodo='orb', ratio_test=0.75):
     return buenos_matches
 
 
-def filtrar_matches_ransac(kp1, kp2, matches, reproj_thresh=5.0):
+def benchmark_emparejadores(des1, des2, metodo='orb', ratio_test=0.75, repeticiones=3,
+                            params_flann=None):
+    """
+    Compara el emparejador aproximado (FLANN/LSH) con la fuerza bruta.
+    
+    Args:
+        des1: descriptores de consulta
+        des2: descriptores de entrenamiento
+        metodo: 'orb', 'sift', 'akaze'
+        ratio_test: umbral para el ratio test
+        repeticiones: número de consultas cronometradas (se toma la mediana)
+        params_flann: parámetros adicionales para IndiceDescriptores
+    
+    Returns:
+        DataFrame con tiempo de construcción del índice, tiempo por consulta,
+        número de matches y recall respecto a la fuerza bruta
+    """
+    import time
+    import pandas as pd
+    
+    filas = []
+    referencia = None
+    for backend in ('bf', 'flann'):
+        params = (params_flann or {}) if backend == 'flann' else {}
+        
+        t = time.perf_counter()
+        indice = IndiceDescriptores(des2, metodo, backend, **params)
+        tiempo_indice = time.perf_counter() - t
+        
+        tiempos = []
+        for _ in range(repeticiones):
+            t = time.perf_counter()
+            matches = indice.emparejar(des1, ratio_test)
+            tiempos.append(time.perf_counter() - t)
+        
+        if referencia is None:
+            referencia = matches
+        comunes = np.intersect1d(
+            referencia['queryIdx'].astype(np.int64) * len(des2) + referencia['trainIdx'],
+            matches['queryIdx'].astype(np.int64) * len(des2) + matches['trainIdx']
+        )
+        
+        filas.append({
+            'backend': backend,
+            'tiempo_indice_s': tiempo_indice,
+            'tiempo_consulta_s': float(np.median(tiempos)),
+            'num_matches': len(matches),
+            'recall': len(comunes) / len(referencia) if len(referencia) > 0 else 1.0
+        })
+    
+    return pd.DataFrame(filas)
+
+
+def puntos_emparejados(kp1, kp2, matches):
+    """
+    Extrae las coordenadas de los puntos correspondientes de unos matches.
+    
+    Args:
+        kp1: keypoints de la primera imagen (lista o array estructurado)
+        kp2: keypoints de la segunda imagen (lista o array estructurado)
+        matches: lista de cv2.DMatch o array estructurado (DTYPE_MATCH)
+    
+    Returns:
+        (pts1, pts2) arrays (N, 2) float32
+    """
+    matches = matches_a_array(matches)
+    pts1 = coordenadas_keypoints(kp1)[matches['queryIdx']]
+    pts2 = coordenadas_keypoints(kp2)[matches['trainIdx']]
+    return pts1, pts2
+
+
+def _votos_rejilla(pts1, pts2, forma1, forma2, tam_rejilla, desplazamiento):
+    """
+    Cuenta, para cada match, cuántos matches van de la vecindad 3x3 de su
+    celda en la imagen 1 a la vecindad correspondiente en la imagen 2, y
+    calcula el umbral de GMS para su celda.
+    """
+    G = tam_rejilla
+    
+    def celdas(pts, forma):
+        h, w = forma[:2]
+        cx = np.clip(((pts[:, 0] / w) * G + desplazamiento).astype(np.int64), 0, G - 1)
+        cy = np.clip(((pts[:, 1] / h) * G + desplazamiento).astype(np.int64), 0, G - 1)
+        return cx, cy
+    
+    cx1, cy1 = celdas(pts1, forma1)
+    cx2, cy2 = celdas(pts2, forma2)
+    
+    # Matriz densa de conteos (celda en img1, celda en img2) y matches por celda de img1
+    conteo_pares = np.bincount((cy1 * G + cx1) * G * G + (cy2 * G + cx2), minlength=G ** 4)
+    conteo_celdas = np.bincount(cy1 * G + cx1, minlength=G * G)
+    
+    votos = np.zeros(len(pts1), dtype=np.int64)
+    vecinos = np.zeros(len(pts1), dtype=np.int64)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            nx1, ny1, nx2, ny2 = cx1 + dx, cy1 + dy, cx2 + dx, cy2 + dy
+            valido1 = (nx1 >= 0) & (nx1 < G) & (ny1 >= 0) & (ny1 < G)
+            valido2 = valido1 & (nx2 >= 0) & (nx2 < G) & (ny2 >= 0) & (ny2 < G)
+            c1 = ny1 * G + nx1
+            votos[valido2] += conteo_pares[c1[valido2] * G * G + (ny2 * G + nx2)[valido2]]
+            vecinos[valido1] += conteo_celdas[c1[valido1]]
+    
+    # El propio match no cuenta como apoyo
+    return votos - 1, vecinos
+
+
+def prefiltro_gms(kp1, kp2, matches, forma1, forma2, tam_rejilla=None, alfa=1.0):
+    """
+    Prefiltro geométrico por estadística de movimiento en rejilla (GMS).
+    
+    Un match correcto suele estar rodeado de otros matches que se mueven de
+    forma coherente: se divide cada imagen en una rejilla y se conservan los
+    matches cuya vecindad 3x3 tiene suficientes matches que caen en la vecindad
+    correspondiente de la otra imagen. Se evalúa con dos rejillas desplazadas
+    media celda para no penalizar los matches cercanos a los bordes de celda.
+    
+    Args:
+        kp1: keypoints de la primera imagen
+        kp2: keypoints de la segunda imagen
+        matches: matches a filtrar (lista o array estructurado)
+        forma1: shape de la primera imagen
+        forma2: shape de la segunda imagen
+        tam_rejilla: celdas por lado (None = según el número de matches)
+        alfa: factor del umbral (votos > alfa * sqrt(matches_vecindad / 9));
+            valores bajos priorizan no perder inliers, ya que después se
+            aplica RANSAC
+    
+    Returns:
+        máscara booleana de matches conservados
+    """
+    pts1, pts2 = puntos_emparejados(kp1, kp2, matches)
+    if len(pts1) == 0:
+        return np.zeros(0, dtype=bool)
+    
+    if tam_rejilla is None:
+        # Unos 5 matches por celda de media, entre 4x4 y 20x20 celdas
+        tam_rejilla = int(np.clip(np.sqrt(len(pts1) / 5), 4, 20))
+    
+    conservar = np.zeros(len(pts1), dtype=bool)
+    for desplazamiento in (0.0, 0.5):
+        votos, vecinos = _votos_rejilla(pts1, pts2, forma1, forma2, tam_rejilla, desplazamiento)
+        conservar |= votos > alfa * np.sqrt(vecinos / 9.0)
+    
+    return conservar
+
+
+def prefiltro_geometrico(kp1, kp2, matches, forma1, forma2, metodo='gms', **kwargs):
+    """
+    Aplica un prefiltro geométrico barato antes de la estimación robusta.
+    
+    Args:
+        kp1: keypoints de la primera imagen
+        kp2: keypoints de la segunda imagen
+        matches: matches a filtrar (lista o array estructurado)
+        forma1: shape de la primera imagen
+        forma2: shape de la segunda imagen
+        metodo: 'gms'
+        **kwargs: parámetros del prefiltro (ver prefiltro_gms)
+    
+    Returns:
+        (matches_filtrados, info) con info = {'eliminados', 'tiempo_s'}
+    """
+    import time
+    
+    if metodo != 'gms':
+        raise ValueError(f"Prefiltro '{metodo}' no reconocido")
+    
+    t = time.perf_counter()
+    conservar = prefiltro_gms(kp1, kp2, matches, forma1, forma2, **kwargs)
+    if isinstance(matches, np.ndarray):
+        filtrados = matches[conservar]
+    else:
+        filtrados = [m for m, ok in zip(matches, conservar) if ok]
+    
+    info = {
+        'eliminados': int(len(conservar) - np.count_nonzero(conservar)),
+        'tiempo_s': time.perf_counter() - t
+    }
+    return filtrados, info
+
+
+# Estimadores robustos disponibles (banderas de OpenCV)
+ESTIMADORES = {
+    'ransac': cv2.RANSAC,
+    'lmeds': cv2.LMEDS,
+    'rho': cv2.RHO,
+    'usac': cv2.USAC_DEFAULT,
+    'usac_rapido': cv2.USAC_FAST,
+    'usac_preciso': cv2.USAC_ACCURATE,
+    'prosac': cv2.USAC_PROSAC,
+    'magsac': cv2.USAC_MAGSAC
+}
+
+# Puntos mínimos por modelo y estimadores que OpenCV admite para cada uno
+MUESTRA_MINIMA = {'homografia': 4, 'afin': 3, 'similitud': 2}
+_ESTIMADORES_MODELO = {
+    'homografia': set(ESTIMADORES),
+    'afin': set(ESTIMADORES) - {'rho'},
+    'similitud': {'ransac', 'lmeds'}
+}
+
+
+def filtrar_matches_ransac(kp1, kp2, matches, reproj_thresh=5.0, estimador='ransac',
+                           modelo='homografia', confianza=0.995, max_iter=2000,
+                           devolver_info=False):
     """
     Filtra matches usando RANSAC para encontrar homografía.
     
     Args:
         kp1: keypoints de la primera imagen
         kp2: keypoints de la segunda imagen
-        matches: lista de matches
+        matches: lista de matches (o array estructurado DTYPE_MATCH)
         reproj_thresh: umbral de error de reproyección para RANSAC
+        estimador: 'ransac', 'lmeds', 'rho', 'usac', 'usac_rapido',
+            'usac_preciso', 'prosac' (ordena por distancia del match) o 'magsac'
+        modelo: 'homografia', 'afin' o 'similitud' (rotación + escala +
+            traslación); los modelos afines se devuelven también como 3x3
+        confianza: confianza deseada para el criterio de parada
+        max_iter: número máximo de iteraciones
+        devolver_info: devolver además un diccionario con estadísticas
     
     Returns:
-        (homografía, mask de inliers)
+        (homografía, mask de inliers) o (homografía, mask, info) si
+        devolver_info es True. info contiene num_inliers, ratio_inliers,
+        iteraciones_estimadas (las que el criterio adaptativo necesita para
+        la proporción de inliers obtenida, limitadas por max_iter, ya que
+        OpenCV no expone el contador real) y tiempo_s
     """
-    if len(matches) < 4:
-        return None, None
+    import time
+    
+    if modelo not in MUESTRA_MINIMA:
+        raise ValueError(f"Modelo '{modelo}' no reconocido")
+    if estimador not in _ESTIMADORES_MODELO[modelo]:
+        raise ValueError(f"Estimador '{estimador}' no disponible para el modelo '{modelo}'")
+    
+    if len(matches) < MUESTRA_MINIMA[modelo]:
+        return (None, None, None) if devolver_info else (None, None)
     
     # Extraer puntos correspondientes
-    pts1 = np.float32([kp1[m.queryIdx].pt for m in matches])
-    pts2 = np.float32([kp2[m.trainIdx].pt for m in matches])
+    pts1, pts2 = puntos_emparejados(kp1, kp2, matches)
     
-    # Calcular homografía con RANSAC
-    H, mask = cv2.findHomography(pts2, pts1, cv2.RANSAC, reproj_thresh)
+    # PROSAC muestrea primero los matches de mejor calidad (menor distancia)
+    orden = None
+    if estimador == 'prosac':
+        orden = np.argsort(matches_a_array(matches)['distance'], kind='stable')
+        pts1, pts2 = pts1[orden], pts2[orden]
     
-    return H, mask
+    t = time.perf_counter()
+    metodo = ESTIMADORES[estimador]
+    if modelo == 'homografia':
+        H, mask = cv2.findHomography(pts2, pts1, metodo, reproj_thresh,
+                                     maxIters=max_iter, confidence=confianza)
+    else:
+        estimar = cv2.estimateAffine2D if modelo == 'afin' else cv2.estimateAffinePartial2D
+        A, mask = estimar(pts2, pts1, method=metodo, ransacReprojThreshold=reproj_thresh,
+                          maxIters=max_iter, confidence=confianza)
+        H = None if A is None else np.vstack([A, [0, 0, 1]])
+    tiempo = time.perf_counter() - t
+    
+    if H is None or mask is None:
+        return (None, None, None) if devolver_info else (None, None)
+    
+    if orden is not None:
+        mask_original = np.empty_like(mask)
+        mask_original[orden] = mask
+        mask = mask_original
+    
+    if not devolver_info:
+        return H, mask
+    
+    num_inliers = int(np.count_nonzero(mask))
+    ratio = num_inliers / len(mask)
+    muestra = MUESTRA_MINIMA[modelo]
+    if ratio >= 1.0:
+        iteraciones = 1
+    elif ratio <= 0.0:
+        iteraciones = max_iter
+    else:
+        iteraciones = np.log(1 - confianza) / np.log(1 - ratio ** muestra)
+        iteraciones = int(min(np.ceil(iteraciones), max_iter))
+    
+    info = {
+        'estimador': estimador,
+        'modelo': modelo,
+        'num_inliers': num_inliers,
+        'ratio_inliers': ratio,
+        'iteraciones_estimadas': iteraciones,
+        'tiempo_s': tiempo
+    }
+    return H, mask, info
+
+
+def comparar_estimadores(kp1, kp2, matches, estimadores=None, modelo='homografia',
+                         reproj_thresh=5.0, H_real=None, puntos_control=None):
+    """
+    Ejecuta varios estimadores robustos sobre los mismos matches.
+    
+    Args:
+        kp1: keypoints de la primera imagen
+        kp2: keypoints de la segunda imagen
+        matches: matches a filtrar
+        estimadores: lista de estimadores (None = todos los disponibles para el modelo)
+        modelo: 'homografia', 'afin' o 'similitud'
+        reproj_thresh: umbral de error de reproyección
+        H_real: homografía real (de imagen 2 a imagen 1), si se conoce
+        puntos_control: array (N, 2) de puntos de la imagen 2 sobre los que
+            medir el error respecto a H_real (por defecto, los puntos emparejados)
+    
+    Returns:
+        DataFrame con una fila por estimador (tiempo, inliers, iteraciones y,
+        si se da H_real, error medio de reproyección en píxeles)
+    """
+    import pandas as pd
+    
+    if estimadores is None:
+        estimadores = [e for e in ESTIMADORES if e in _ESTIMADORES_MODELO[modelo]]
+    if H_real is not None and puntos_control is None:
+        puntos_control = puntos_emparejados(kp1, kp2, matches)[1]
+    
+    filas = []
+    for estimador in estimadores:
+        H, mask, info = filtrar_matches_ransac(kp1, kp2, matches, reproj_thresh, estimador,
+                                               modelo, devolver_info=True)
+        fila = info if info is not None else {'estimador': estimador, 'modelo': modelo}
+        if H_real is not None and H is not None:
+            pc = np.asarray(puntos_control, np.float32).reshape(-1, 1, 2)
+            error = cv2.perspectiveTransform(pc, H) - cv2.perspectiveTransform(pc, np.asarray(H_real, np.float64))
+            fila['error_px'] = float(np.linalg.norm(error.reshape(-1, 2), axis=1).mean())
+        filas.append(fila)
+    
+    return pd.DataFrame(filas)
+
+
+class RejillaEspacial:
+    """
+    Índice espacial de rejilla uniforme sobre puntos 2D. Los puntos se ordenan
+    por celda, de modo que cada celda es un rango contiguo del array.
+    """
+    
+    def __init__(self, puntos, tam_celda):
+        """
+        Construye el índice.
+        
+        Args:
+            puntos: array (N, 2) de coordenadas (x, y)
+            tam_celda: lado de cada celda en píxeles
+        """
+        self.puntos = np.asarray(puntos, dtype=np.float32).reshape(-1, 2)
+        self.tam_celda = float(tam_celda)
+        
+        if len(self.puntos) > 0:
+            self.origen = self.puntos.min(axis=0)
+            extension = self.puntos.max(axis=0) - self.origen
+        else:
+            self.origen = np.zeros(2, np.float32)
+            extension = np.zeros(2, np.float32)
+        self.nx, self.ny = (np.floor(extension / self.tam_celda).astype(np.int64) + 1)
+        
+        celdas = self._celdas(self.puntos)[0]
+        self.orden = np.argsort(celdas, kind='stable')
+        self.inicio = np.searchsorted(celdas[self.orden], np.arange(self.nx * self.ny + 1))
+    
+    def _celdas(self, puntos):
+        c = np.floor((puntos - self.origen) / self.tam_celda).astype(np.int64)
+        return c[:, 1] * self.nx + c[:, 0], c[:, 0], c[:, 1]
+    
+    def vecinos(self, consultas, radio):
+        """
+        Busca todos los puntos a distancia <= radio de cada consulta.
+        
+        Args:
+            consultas: array (M, 2) de coordenadas (x, y)
+            radio: radio de búsqueda (debe ser <= tam_celda)
+        
+        Returns:
+            (idx_consulta, idx_punto): arrays con todos los pares encontrados
+        """
+        consultas = np.asarray(consultas, dtype=np.float32).reshape(-1, 2)
+        _, cx, cy = self._celdas(consultas)
+        
+        idx_consulta, idx_punto = [], []
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                nx, ny = cx + dx, cy + dy
+                validas = np.flatnonzero((nx >= 0) & (nx < self.nx) & (ny >= 0) & (ny < self.ny))
+                celda = ny[validas] * self.nx + nx[validas]
+                inicio, fin = self.inicio[celda], self.inicio[celda + 1]
+                cuantos = fin - inicio
+                # Expandir cada rango [inicio, fin) sin bucles de Python
+                desplazamiento = np.arange(cuantos.sum()) - np.repeat(np.cumsum(cuantos) - cuantos, cuantos)
+                idx_consulta.append(np.repeat(validas, cuantos))
+                idx_punto.append(self.orden[np.repeat(inicio, cuantos) + desplazamiento])
+        
+        idx_consulta = np.concatenate(idx_consulta)
+        idx_punto = np.concatenate(idx_punto)
+        d2 = ((consultas[idx_consulta] - self.puntos[idx_punto]) ** 2).sum(axis=1)
+        dentro = d2 <= radio ** 2
+        return idx_consulta[dentro], idx_punto[dentro]
+
+
+# Número de bits a 1 de cada byte (distancia de Hamming por tabla)
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.int32)
+
+
+def _distancias_pares(des1, des2, idx1, idx2, metodo):
+    """
+    Distancia entre los descriptores de unos pares (idx1[k], idx2[k]).
+    """
+    if _tipo_norma(metodo) == cv2.NORM_HAMMING:
+        return _POPCOUNT[np.bitwise_xor(des1[idx1], des2[idx2])].sum(axis=1).astype(np.float32)
+    diferencia = des1[idx1].astype(np.float32) - des2[idx2].astype(np.float32)
+    return np.sqrt(np.einsum('ij,ij->i', diferencia, diferencia))
+
+
+def emparejamiento_guiado(kp1, des1, kp2, des2, H, metodo='orb', radio=8.0, ratio_test=0.75,
+                          reestimar=True, reproj_thresh=5.0, estimador='ransac', modelo='homografia',
+                          devolver_info=False):
+    """
+    Emparejamiento guiado por una homografía conocida.
+    
+    Los keypoints de la imagen 1 se proyectan en la imagen 2 con H^-1 y sus
+    descriptores solo se comparan con los keypoints de la imagen 2 que están
+    a menos de `radio` píxeles (rejilla espacial), en lugar de con todos.
+    
+    Args:
+        kp1: keypoints de la primera imagen
+        des1: descriptores de la primera imagen
+        kp2: keypoints de la segunda imagen
+        des2: descriptores de la segunda imagen
+        H: homografía de la imagen 2 a la imagen 1 (como filtrar_matches_ransac)
+        metodo: 'orb', 'sift', 'akaze' (determina el tipo de distancia)
+        radio: radio de búsqueda en píxeles alrededor de la posición predicha
+        ratio_test: umbral del ratio test entre los candidatos del radio
+            (si solo hay un candidato, se acepta)
+        reestimar: volver a estimar H con los nuevos matches
+        reproj_thresh: umbral de RANSAC para la reestimación
+        estimador: estimador robusto de la reestimación (ver `filtrar_matches_ransac`)
+        modelo: modelo de la reestimación ('homografia', 'afin' o 'similitud')
+        devolver_info: devolver además la info de `filtrar_matches_ransac`
+            de la reestimación (None si no se reestima)
+    
+    Returns:
+        (matches, H, mask): array estructurado de matches, homografía
+        (reestimada o la original) y máscara de inliers (None si no se
+        reestima); (matches, H, mask, info) si devolver_info es True
+    """
+    pts1 = coordenadas_keypoints(kp1)
+    pts2 = coordenadas_keypoints(kp2)
+    if len(pts1) == 0 or len(pts2) == 0:
+        resultado = (np.empty(0, dtype=DTYPE_MATCH), H, None)
+        return resultado + (None,) if devolver_info else resultado
+    
+    predichos = cv2.perspectiveTransform(pts1.reshape(-1, 1, 2), np.linalg.inv(H)).reshape(-1, 2)
+    idx1, idx2 = RejillaEspacial(pts2, radio).vecinos(predichos, radio)
+    distancias = _distancias_pares(des1, des2, idx1, idx2, metodo)
+    
+    # Mejor y segundo mejor candidato de cada keypoint de la imagen 1
+    orden = np.lexsort((distancias, idx1))
+    idx1, idx2, distancias = idx1[orden], idx2[orden], distancias[orden]
+    primero = np.ones(len(idx1), dtype=bool)
+    primero[1:] = idx1[1:] != idx1[:-1]
+    posiciones = np.flatnonzero(primero)
+    
+    segunda = np.full(len(posiciones), np.inf, dtype=np.float32)
+    tiene_segundo = (posiciones + 1 < len(idx1))
+    tiene_segundo[tiene_segundo] = idx1[posiciones[tiene_segundo] + 1] == idx1[posiciones[tiene_segundo]]
+    segunda[tiene_segundo] = distancias[posiciones[tiene_segundo] + 1]
+    
+    posiciones = posiciones[distancias[posiciones] < ratio_test * segunda]
+    
+    # Cada keypoint de la imagen 2 se queda con su match más cercano
+    posiciones = posiciones[np.argsort(distancias[posiciones], kind='stable')]
+    _, unicos = np.unique(idx2[posiciones], return_index=True)
+    posiciones = np.sort(posiciones[unicos])
+    
+    matches = np.empty(len(posiciones), dtype=DTYPE_MATCH)
+    matches['queryIdx'] = idx1[posiciones]
+    matches['trainIdx'] = idx2[posiciones]
+    matches['distance'] = distancias[posiciones]
+    
+    info = None
+    if reestimar:
+        H_nueva, mask, info = filtrar_matches_ransac(kp1, kp2, matches, reproj_thresh, estimador, modelo,
+                                                     devolver_info=True)
+    if not reestimar or H_nueva is None:
+        return (matches, H, None, None) if devolver_info else (matches, H, None)
+    return (matches, H_nueva, mask, info) if devolver_info else (matches, H_nueva, mask)
 
 
 def visualizar_matches(img1, kp1, img2, kp2, matches, mask=None, titulo='Matches'):
@@ -78,13 +785,21 @@ def visualizar_matches(img1, kp1, img2, kp2, matches, mask=None, titulo='Matches
         kp1: keypoints de la primera imagen
         img2: segunda imagen
         kp2: keypoints de la segunda imagen
-        matches: lista de matches
+        matches: lista de matches (o array estructurado DTYPE_MATCH)
         mask: máscara de inliers (opcional)
         titulo: título de la visualización
     
     Returns:
         imagen con matches dibujados
     """
+    # Los arrays compactos se convierten a objetos de OpenCV solo para dibujar
+    if isinstance(kp1, np.ndarray):
+        kp1 = array_a_keypoints(kp1)
+    if isinstance(kp2, np.ndarray):
+        kp2 = array_a_keypoints(kp2)
+    if isinstance(matches, np.ndarray):
+        matches = array_a_matches(matches)
+    
     if mask is not None:
         matchesMask = mask.ravel().tolist()
     else:
@@ -104,7 +819,7 @@ def calcular_estadisticas_matches(matches, mask=None):
     Calcula estadísticas sobre los matches.
     
     Args:
-        matches: lista de matches
+        matches: lista de matches (o array estructurado DTYPE_MATCH)
         mask: máscara de inliers (opcional)
     
     Returns:
@@ -113,20 +828,21 @@ def calcular_estadisticas_matches(matches, mask=None):
     num_matches = len(matches)
     
     if mask is not None:
-        inliers = mask.ravel().tolist()
-        num_inliers = sum(inliers)
+        num_inliers = int(np.count_nonzero(mask))
         porcentaje_inliers = (num_inliers / num_matches * 100) if num_matches > 0 else 0
     else:
         num_inliers = num_matches
         porcentaje_inliers = 100.0
     
     # Calcular distancias de los matches
-    distancias = [m.distance for m in matches]
+    distancias = matches_a_array(matches)['distance']
+    distancias_inliers = distancias if mask is None else distancias[np.asarray(mask).ravel() != 0]
     
     return {
         'num_matches': num_matches,
         'num_inliers': num_inliers,
         'porcentaje_inliers': porcentaje_inliers,
-        'distancia_media': np.mean(distancias) if distancias else 0,
-        'distancia_std': np.std(distancias) if distancias else 0
+        'distancia_media': float(distancias.mean()) if num_matches > 0 else 0,
+        'distancia_std': float(distancias.std()) if num_matches > 0 else 0,
+        'distancia_media_inliers': float(distancias_inliers.mean()) if num_inliers > 0 else 0
     }
@@ -0,0 +1,257 @@
+"""
+Módulo de evaluación Monte-Carlo de la precisión del registro.
+Recorre la rejilla (método x ruido x transformación x ensayo) con casos
+sintéticos reproducibles, reparte el trabajo en un pool de procesos y
+acumula las estadísticas de error y de latencia en streaming, sin guardar
+cada ensayo en memoria.
+"""
+
+import contextlib
+import io
+import time
+
+import numpy as np
+from dataset_sintetico import TIPOS_IMAGEN, TRANSFORMACIONES, generar_caso
+from panorama import ejecutar_acotado
+from utils import calcular_errores_transformacion, matriz_homogenea
+
+METODOS = ('orb', 'sift', 'akaze', 'exhaustiva', 'fourier_mellin')
+
+# Intervalos (en segundos, escala logarítmica) del histograma de latencias
+BORDES_LATENCIA = np.logspace(-4, 2, 121)
+
+
+class AcumuladorEstadisticas:
+    """
+    Media, desviación, mínimo y máximo en streaming (Welford), combinando
+    bloques de valores con la fórmula de Chan et al., de modo que no hace
+    falta guardar los valores.
+    """
+    
+    def __init__(self):
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.minimo = np.inf
+        self.maximo = -np.inf
+    
+    def agregar(self, valores):
+        """
+        Añade un bloque de valores (se ignoran los NaN).
+        
+        Args:
+            valores: array de valores
+        """
+        valores = np.asarray(valores, dtype=np.float64)
+        valores = valores[np.isfinite(valores)]
+        n_b = len(valores)
+        if n_b == 0:
+            return
+        
+        media_b = float(valores.mean())
+        m2_b = float(((valores - media_b) ** 2).sum())
+        n = self.n + n_b
+        delta = media_b - self.media
+        self.media += delta * n_b / n
+        self.m2 += m2_b + delta ** 2 * self.n * n_b / n
+        self.n = n
+        self.minimo = min(self.minimo, float(valores.min()))
+        self.maximo = max(self.maximo, float(valores.max()))
+    
+    def resumen(self):
+        """
+        Returns:
+            diccionario con n, media, std (muestral), min y max
+        """
+        return {
+            'n': self.n,
+            'media': self.media if self.n else np.nan,
+            'std': float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.nan,
+            'min': self.minimo if self.n else np.nan,
+            'max': self.maximo if self.n else np.nan
+        }
+
+
+def percentil_histograma(cuentas, bordes, q):
+    """
+    Percentil aproximado a partir de un histograma (interpolación
+    logarítmica dentro del intervalo).
+    
+    Args:
+        cuentas: cuentas de cada intervalo
+        bordes: bordes de los intervalos (len(cuentas) + 1)
+        q: percentil (0-100)
+    
+    Returns:
+        valor aproximado del percentil (NaN si el histograma está vacío)
+    """
+    total = cuentas.sum()
+    if total == 0:
+        return np.nan
+    acumulado = np.cumsum(cuentas)
+    objetivo = q / 100 * total
+    k = int(np.searchsorted(acumulado, objetivo))
+    k = min(k, len(cuentas) - 1)
+    anterior = acumulado[k - 1] if k > 0 else 0
+    fraccion = (objetivo - anterior) / cuentas[k] if cuentas[k] > 0 else 0.0
+    return float(bordes[k] * (bordes[k + 1] / bordes[k]) ** fraccion)
+
+
+def _estimar(metodo, fija, movil):
+    """
+    Ejecuta un método de registro y devuelve la matriz que lleva la imagen
+    móvil a la fija (None si falla).
+    """
+    from registration import (registro_busqueda_exhaustiva, registro_con_caracteristicas,
+                              registro_fourier_mellin)
+    
+    if metodo in ['orb', 'sift', 'akaze']:
+        H, _, _ = registro_con_caracteristicas(fija, movil, metodo)
+        return H
+    elif metodo == 'exhaustiva':
+        M, _, _ = registro_busqueda_exhaustiva(fija, movil)
+        return M
+    elif metodo == 'fourier_mellin':
+        M, _ = registro_fourier_mellin(fija, movil)
+        return M
+    raise ValueError(f"Método '{metodo}' no reconocido")
+
+
+def _ejecutar_bloque(args):
+    """
+    Ejecuta un bloque de ensayos de una celda de la rejilla (tarea de un
+    proceso trabajador).
+    
+    Returns:
+        (clave, reales, estimadas, tiempos): matrices (n, 3, 3) que llevan
+        la imagen móvil a la fija (NaN en los fallos) y latencias (n,)
+    """
+    metodo, transformacion, sigma, indices, semilla, size, tipos_imagen = args
+    n = len(indices)
+    reales = np.empty((n, 3, 3))
+    estimadas = np.full((n, 3, 3), np.nan)
+    tiempos = np.full(n, np.nan)
+    
+    for k, indice in enumerate(indices):
+        fija, movil, M, _, _ = generar_caso(indice, semilla, size, tipos_imagen, (transformacion,),
+                                            (sigma,))
+        reales[k] = np.linalg.inv(matriz_homogenea(M))
+        
+        t = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                estimada = _estimar(metodo, fija, movil)
+        except Exception:
+            estimada = None
+        tiempos[k] = time.perf_counter() - t
+        if estimada is not None:
+            estimadas[k] = matriz_homogenea(estimada)
+    
+    return (metodo, transformacion, sigma), reales, estimadas, tiempos
+
+
+def ejecutar_montecarlo(metodos=('orb', 'sift', 'akaze'), sigmas=(0, 5, 10, 20),
+                        transformaciones=TRANSFORMACIONES, num_ensayos=20, semilla=0, size=256,
+                        tipos_imagen=TIPOS_IMAGEN, num_procesos=None, ensayos_por_tarea=10,
+                        umbral_exito=2.0, verbose=True):
+    """
+    Evaluación Monte-Carlo de la precisión del registro.
+    
+    Para cada (transformación, sigma, ensayo) se genera un caso sintético
+    reproducible; todos los métodos se evalúan sobre los mismos casos. Los
+    errores se calculan vectorizados sobre pilas (N, 3, 3) con
+    `calcular_errores_transformacion` (en la dirección móvil -> fija) y se
+    acumulan en streaming por celda de la rejilla.
+    
+    Args:
+        metodos: métodos a evaluar ('orb', 'sift', 'akaze', 'exhaustiva',
+            'fourier_mellin')
+        sigmas: niveles de ruido gaussiano
+        transformaciones: tipos de transformación
+        num_ensayos: ensayos por celda (transformación, sigma)
+        semilla: semilla de los casos sintéticos
+        size: tamaño de las imágenes
+        tipos_imagen: tipos de imagen sintética entre los que se elige
+        num_procesos: tamaño del pool (None = número de CPUs; 1 = sin pool)
+        ensayos_por_tarea: ensayos que procesa cada tarea del pool
+        umbral_exito: error medio de esquinas (píxeles) por debajo del cual
+            un ensayo se considera un éxito
+        verbose: imprimir el progreso
+    
+    Returns:
+        (tabla, latencias): DataFrame ordenado con una fila por (metodo,
+        transformacion, sigma, metrica) y columnas n, media, std, min, max,
+        fallos y tasa_exito; DataFrame con la distribución de latencias por
+        método (media, p50, p90, p95, p99, max) y los histogramas en
+        latencias.attrs['histogramas']
+    """
+    import pandas as pd
+    
+    # Mismos índices de caso para todos los métodos (comparación pareada)
+    def indices_celda(it, isig):
+        base = (it * len(sigmas) + isig) * num_ensayos
+        return list(range(base, base + num_ensayos))
+    
+    tareas = []
+    for metodo in metodos:
+        for it, transformacion in enumerate(transformaciones):
+            for isig, sigma in enumerate(sigmas):
+                indices = indices_celda(it, isig)
+                for k in range(0, num_ensayos, ensayos_por_tarea):
+                    tareas.append((metodo, transformacion, sigma, indices[k:k + ensayos_por_tarea],
+                                   semilla, size, tipos_imagen))
+    
+    errores = {}
+    contadores = {}
+    latencia = {m: AcumuladorEstadisticas() for m in metodos}
+    histogramas = {m: np.zeros(len(BORDES_LATENCIA) - 1, dtype=np.int64) for m in metodos}
+    
+    t0 = time.perf_counter()
+    for k, (clave, reales, estimadas, tiempos) in enumerate(
+            ejecutar_acotado(_ejecutar_bloque, tareas, num_procesos), 1):
+        bloque = calcular_errores_transformacion(reales, estimadas, (size, size))
+        for metrica, valores in bloque.items():
+            errores.setdefault(clave + (metrica,), AcumuladorEstadisticas()).agregar(valores)
+        
+        fallos = int(np.count_nonzero(np.isnan(estimadas[:, 0, 0])))
+        exitos = int(np.count_nonzero(bloque['error_esquinas'] < umbral_exito))
+        total, fallos_previos, exitos_previos = contadores.get(clave, (0, 0, 0))
+        contadores[clave] = (total + len(tiempos), fallos_previos + fallos, exitos_previos + exitos)
+        
+        metodo = clave[0]
+        latencia[metodo].agregar(tiempos)
+        histogramas[metodo] += np.histogram(np.clip(tiempos, BORDES_LATENCIA[0], BORDES_LATENCIA[-1]),
+                                            BORDES_LATENCIA)[0]
+        
+        if verbose and (k % max(len(tareas) // 10, 1) == 0 or k == len(tareas)):
+            print(f"✓ {k}/{len(tareas)} tareas ({time.perf_counter() - t0:.1f} s)")
+    
+    filas = []
+    for (metodo, transformacion, sigma, metrica), acumulador in errores.items():
+        total, fallos, exitos = contadores[(metodo, transformacion, sigma)]
+        filas.append({
+            'metodo': metodo, 'transformacion': transformacion, 'sigma': sigma,
+            'metrica': metrica, **acumulador.resumen(),
+            'fallos': fallos, 'tasa_exito': exitos / total
+        })
+    tabla = pd.DataFrame(filas).sort_values(['metodo', 'transformacion', 'sigma', 'metrica'],
+                                            ignore_index=True)
+    
+    latencias = pd.DataFrame([
+        {
+            'metodo': metodo, 'n': latencia[metodo].n,
+            'media_ms': latencia[metodo].media * 1000,
+            **{f'p{q}_ms': float(np.clip(percentil_histograma(histogramas[metodo], BORDES_LATENCIA, q),
+                                         latencia[metodo].minimo, latencia[metodo].maximo)) * 1000
+               for q in (50, 90, 95, 99)},
+            'max_ms': latencia[metodo].maximo * 1000
+        }
+        for metodo in metodos
+    ])
+    latencias.attrs['histogramas'] = {'bordes_s': BORDES_LATENCIA, **histogramas}
+    
+    if verbose:
+        print(f"✓ Monte-Carlo: {len(metodos)} métodos x {len(transformaciones)} transformaciones x "
+              f"{len(sigmas)} niveles de ruido x {num_ensayos} ensayos en "
+              f"{time.perf_counter() - t0:.1f} s")
+    return tabla, latencias
@@ -0,0 +1,407 @@
+"""
+Módulo de alineación global de múltiples imágenes.
+Registra en paralelo los pares candidatos, construye el grafo de
+correspondencias y encadena las homografías hasta una imagen de referencia
+a través del árbol de expansión máximo (opcionalmente con un ajuste global
+por mínimos cuadrados).
+"""
+
+import contextlib
+import heapq
+import io
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+from cache_caracteristicas import CacheCaracteristicas
+from matching import puntos_emparejados
+from registration import registro_con_caracteristicas
+
+
+def cargar_imagen_gris(imagen):
+    """
+    Devuelve una imagen en escala de grises a partir de un array o una ruta.
+    
+    Args:
+        imagen: array (gris o BGR) o ruta a un archivo de imagen
+    
+    Returns:
+        imagen en escala de grises
+    """
+    if isinstance(imagen, (str, os.PathLike)):
+        img = cv2.imread(str(imagen), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise IOError(f"No se pudo leer la imagen '{imagen}'")
+        return img
+    return imagen if imagen.ndim == 2 else cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY)
+
+
+def ejecutar_acotado(funcion, tareas, num_procesos=None, max_pendientes=None):
+    """
+    Ejecuta `funcion` sobre las tareas en un pool de procesos, manteniendo
+    como mucho `max_pendientes` tareas enviadas a la vez (la cola no crece
+    con el número de tareas). Los resultados se devuelven según terminan.
+    
+    Args:
+        funcion: función de nivel de módulo (debe poder serializarse)
+        tareas: iterable de argumentos (uno por tarea)
+        num_procesos: tamaño del pool (None = número de CPUs; 1 = sin pool)
+        max_pendientes: tareas en vuelo (None = 2 por proceso)
+    
+    Yields:
+        resultado de cada tarea
+    """
+    num_procesos = num_procesos or os.cpu_count() or 1
+    if num_procesos == 1:
+        for tarea in tareas:
+            yield funcion(tarea)
+        return
+    
+    max_pendientes = max_pendientes or 2 * num_procesos
+    tareas = iter(tareas)
+    with ProcessPoolExecutor(max_workers=num_procesos) as ejecutor:
+        pendientes = set()
+        for tarea in tareas:
+            pendientes.add(ejecutor.submit(funcion, tarea))
+            if len(pendientes) >= max_pendientes:
+                terminadas, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+                for futuro in terminadas:
+                    yield futuro.result()
+        
+        while pendientes:
+            terminadas, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in terminadas:
+                yield futuro.result()
+
+
+def _abrir_cache(directorio_cache):
+    """
+    Caché de características sobre un directorio (o un contexto vacío si es None).
+    """
+    if directorio_cache is None:
+        return contextlib.nullcontext()
+    return CacheCaracteristicas(directorio=directorio_cache)
+
+
+def _registrar_par(args):
+    """
+    Registra un par de imágenes (tarea de un proceso trabajador). Devuelve
+    la homografía de j a i, el número de inliers y una muestra de las
+    correspondencias inliers para el ajuste global.
+    """
+    i, j, imagen_i, imagen_j, metodo, max_features, directorio_cache, opciones, max_puntos = args
+    
+    try:
+        img_i = cargar_imagen_gris(imagen_i)
+        img_j = cargar_imagen_gris(imagen_j)
+        
+        t = time.perf_counter()
+        # Al salir del bloque la caché vuelca sus detecciones al directorio compartido
+        with _abrir_cache(directorio_cache) as cache, contextlib.redirect_stdout(io.StringIO()):
+            H, _, info = registro_con_caracteristicas(img_i, img_j, metodo, max_features, cache=cache,
+                                                      **opciones)
+        tiempo = time.perf_counter() - t
+    except Exception as e:
+        return i, j, None, str(e)
+    
+    if H is None:
+        return i, j, None, 'registro fallido'
+    
+    inliers = info['matches'][info['mask'].ravel().astype(bool)]
+    pts_i, pts_j = puntos_emparejados(info['keypoints1'], info['keypoints2'], inliers)
+    if len(pts_i) > max_puntos:
+        seleccion = np.random.default_rng(0).choice(len(pts_i), max_puntos, replace=False)
+        pts_i, pts_j = pts_i[seleccion], pts_j[seleccion]
+    
+    return i, j, {
+        'H': H,
+        'num_inliers': info['num_inliers'],
+        'puntos_i': pts_i,
+        'puntos_j': pts_j,
+        'tiempo_s': tiempo
+    }, None
+
+
+def _pares_bovw(imagenes, metodo, max_features, k_vecinos, directorio_cache):
+    """
+    Pares candidatos según la base de datos de bolsa de palabras visuales.
+    Las imágenes se cargan de una en una.
+    """
+    from base_datos_imagenes import BaseDatosImagenes
+    
+    bd = BaseDatosImagenes(metodo)
+    with _abrir_cache(directorio_cache) as cache:
+        for i, imagen in enumerate(imagenes):
+            bd.agregar_imagen(i, cargar_imagen_gris(imagen), max_features, cache)
+    bd.construir_vocabulario()
+    return [(min(i, j), max(i, j)) for i, j, _ in bd.pares_candidatos(k_vecinos)]
+
+
+def arbol_expansion_maximo(num_nodos, aristas, referencia):
+    """
+    Árbol de expansión máximo (Prim) desde la referencia.
+    
+    Args:
+        num_nodos: número de imágenes
+        aristas: diccionario {(i, j): peso}
+        referencia: nodo raíz
+    
+    Returns:
+        diccionario {hijo: padre} con los nodos alcanzables (sin la raíz)
+    """
+    vecinos = {n: [] for n in range(num_nodos)}
+    for (i, j), peso in aristas.items():
+        vecinos[i].append((peso, j))
+        vecinos[j].append((peso, i))
+    
+    padres = {}
+    visitados = {referencia}
+    cola = [(-peso, referencia, j) for peso, j in vecinos[referencia]]
+    heapq.heapify(cola)
+    while cola:
+        _, padre, hijo = heapq.heappop(cola)
+        if hijo in visitados:
+            continue
+        visitados.add(hijo)
+        padres[hijo] = padre
+        for peso, siguiente in vecinos[hijo]:
+            if siguiente not in visitados:
+                heapq.heappush(cola, (-peso, hijo, siguiente))
+    
+    return padres
+
+
+def _homografia_arista(resultados, desde, hacia):
+    """
+    Homografía que lleva la imagen `desde` a la imagen `hacia`.
+    """
+    if (hacia, desde) in resultados:
+        return resultados[(hacia, desde)]['H']
+    H = np.linalg.inv(resultados[(desde, hacia)]['H'])
+    return H / H[2, 2]
+
+
+def _encadenar(padres, resultados, referencia, num_nodos):
+    """
+    Compone las homografías a lo largo del árbol hasta la referencia.
+    """
+    homografias = [None] * num_nodos
+    homografias[referencia] = np.eye(3)
+    
+    for nodo in padres:
+        # Subir hasta un antepasado ya resuelto y bajar componiendo (sin
+        # recursión, para que las cadenas largas no agoten la pila)
+        camino = []
+        while homografias[nodo] is None:
+            camino.append(nodo)
+            nodo = padres[nodo]
+        for hijo in reversed(camino):
+            H = homografias[padres[hijo]] @ _homografia_arista(resultados, hijo, padres[hijo])
+            homografias[hijo] = H / H[2, 2]
+    return homografias
+
+
+def refinar_global(homografias, resultados, referencia, max_iter=100):
+    """
+    Ajuste global por mínimos cuadrados: reparte la deriva acumulada en el
+    árbol minimizando, para todas las aristas del grafo (no solo las del
+    árbol), la distancia entre las correspondencias inliers proyectadas a
+    la referencia. Requiere scipy.
+    
+    Args:
+        homografias: homografías iniciales de cada imagen a la referencia
+        resultados: diccionario {(i, j): resultado de `_registrar_par`}
+        referencia: índice de la imagen de referencia (queda fija)
+        max_iter: evaluaciones máximas de la función de coste
+    
+    Returns:
+        (homografias_refinadas, info) con el error RMS antes y después
+    """
+    from scipy.optimize import least_squares
+    from scipy.sparse import lil_matrix
+    
+    libres = [n for n, H in enumerate(homografias) if H is not None and n != referencia]
+    posicion = {n: k for k, n in enumerate(libres)}
+    aristas = [(i, j, r) for (i, j), r in resultados.items()
+               if homografias[i] is not None and homografias[j] is not None]
+    
+    def desempaquetar(x):
+        Hs = {referencia: np.eye(3)}
+        for n, k in posicion.items():
+            Hs[n] = np.append(x[8 * k:8 * k + 8], 1.0).reshape(3, 3)
+        return Hs
+    
+    def proyectar(H, puntos):
+        p = puntos @ H[:, :2].T + H[:, 2]
+        return p[:, :2] / p[:, 2:3]
+    
+    def residuos(x):
+        Hs = desempaquetar(x)
+        return np.concatenate([
+            (proyectar(Hs[i], r['puntos_i']) - proyectar(Hs[j], r['puntos_j'])).ravel()
+            for i, j, r in aristas
+        ])
+    
+    # Patrón de dispersión del jacobiano: cada residuo depende de dos imágenes
+    num_residuos = sum(2 * len(r['puntos_i']) for _, _, r in aristas)
+    patron = lil_matrix((num_residuos, 8 * len(libres)), dtype=np.uint8)
+    fila = 0
+    for i, j, r in aristas:
+        n = 2 * len(r['puntos_i'])
+        for nodo in (i, j):
+            if nodo in posicion:
+                k = posicion[nodo]
+                patron[fila:fila + n, 8 * k:8 * k + 8] = 1
+        fila += n
+    
+    x0 = np.concatenate([(homografias[n] / homografias[n][2, 2]).ravel()[:8] for n in libres])
+    rms_inicial = float(np.sqrt(np.mean(residuos(x0) ** 2)))
+    solucion = least_squares(residuos, x0, jac_sparsity=patron, x_scale='jac', loss='huber',
+                             f_scale=3.0, max_nfev=max_iter)
+    
+    refinadas = list(homografias)
+    for n, H in desempaquetar(solucion.x).items():
+        refinadas[n] = H
+    
+    info = {
+        'rms_inicial': rms_inicial,
+        'rms_final': float(np.sqrt(np.mean(solucion.fun ** 2))),
+        'evaluaciones': int(solucion.nfev)
+    }
+    return refinadas, info
+
+
+def registrar_conjunto(imagenes, metodo='orb', max_features=2000, pares=None, seleccion='todos',
+                       k_vecinos=3, referencia=None, min_inliers=20, refinar=False,
+                       num_procesos=None, directorio_cache=None, opciones_registro=None,
+                       max_puntos_arista=200, verbose=True):
+    """
+    Registra un conjunto de imágenes respecto a una referencia común.
+    
+    1. Registra los pares candidatos en un pool de procesos (con un número
+       acotado de tareas en vuelo; las imágenes pueden ser rutas, así cada
+       proceso solo carga las dos que necesita).
+    2. Construye el grafo de correspondencias (peso = número de inliers).
+    3. Encadena las homografías por el árbol de expansión máximo hasta la
+       referencia.
+    4. Opcionalmente, ajuste global por mínimos cuadrados (`refinar_global`).
+    
+    Args:
+        imagenes: lista de imágenes (arrays) o rutas
+        metodo: 'orb', 'sift', 'akaze'
+        max_features: número máximo de características
+        pares: lista de pares (i, j) a registrar (None = según `seleccion`)
+        seleccion: 'todos' (todos los pares) o 'bovw' (k vecinos más
+            parecidos según `BaseDatosImagenes`, para conjuntos grandes)
+        k_vecinos: vecinos por imagen con seleccion='bovw'
+        referencia: índice de la imagen de referencia (None = la de mayor
+            peso total en el grafo)
+        min_inliers: inliers mínimos para aceptar una arista
+        refinar: ejecutar el ajuste global por mínimos cuadrados
+        num_procesos: tamaño del pool (None = número de CPUs; 1 = sin pool)
+        directorio_cache: carpeta de una CacheCaracteristicas en disco
+            compartida por los procesos (cada imagen se detecta una vez)
+        opciones_registro: argumentos extra para `registro_con_caracteristicas`
+        max_puntos_arista: correspondencias por arista guardadas para el ajuste
+        verbose: imprimir el progreso
+    
+    Returns:
+        (homografias, info): homografias[k] lleva la imagen k a la
+        referencia (None si no está conectada); info con la referencia,
+        las aristas, el árbol, las imágenes no conectadas y los tiempos
+    """
+    n = len(imagenes)
+    tiempos = {}
+    t0 = time.perf_counter()
+    
+    if pares is None:
+        if seleccion == 'todos':
+            pares = [(i, j) for i in range(n) for j in range(i + 1, n)]
+        elif seleccion == 'bovw':
+            pares = _pares_bovw(imagenes, metodo, max_features, k_vecinos, directorio_cache)
+        else:
+            raise ValueError(f"Selección '{seleccion}' no reconocida")
+        tiempos['seleccion'] = time.perf_counter() - t0
+    
+    # Registro de pares en paralelo
+    t = time.perf_counter()
+    tareas = ((i, j, imagenes[i], imagenes[j], metodo, max_features, directorio_cache,
+               opciones_registro or {}, max_puntos_arista) for i, j in pares)
+    resultados, fallidos = {}, []
+    for i, j, resultado, error in ejecutar_acotado(_registrar_par, tareas, num_procesos):
+        if resultado is None or resultado['num_inliers'] < min_inliers:
+            fallidos.append((i, j, error or f"{resultado['num_inliers']} inliers"))
+            continue
+        resultados[(i, j)] = resultado
+    tiempos['pares'] = time.perf_counter() - t
+    
+    if verbose:
+        print(f"✓ Pares registrados: {len(resultados)}/{len(pares)} "
+              f"en {tiempos['pares']:.2f} s")
+        for i, j, error in fallidos:
+            print(f"⚠️ Par ({i}, {j}) descartado: {error}")
+    
+    # Grafo y árbol de expansión máximo
+    aristas = {par: r['num_inliers'] for par, r in resultados.items()}
+    if referencia is None:
+        grado = np.zeros(n)
+        for (i, j), peso in aristas.items():
+            grado[i] += peso
+            grado[j] += peso
+        referencia = int(np.argmax(grado))
+    
+    padres = arbol_expansion_maximo(n, aristas, referencia)
+    homografias = _encadenar(padres, resultados, referencia, n)
+    no_conectadas = [k for k in range(n) if homografias[k] is None]
+    
+    if verbose:
+        print(f"✓ Referencia: imagen {referencia}; {n - len(no_conectadas)}/{n} imágenes conectadas")
+        if no_conectadas:
+            print(f"⚠️ Imágenes sin conectar: {no_conectadas}")
+    
+    info_refinamiento = None
+    if refinar and len(resultados) > 0:
+        try:
+            t = time.perf_counter()
+            homografias, info_refinamiento = refinar_global(homografias, resultados, referencia)
+            tiempos['refinamiento'] = time.perf_counter() - t
+            if verbose:
+                print(f"✓ Ajuste global: error RMS {info_refinamiento['rms_inicial']:.2f} -> "
+                      f"{info_refinamiento['rms_final']:.2f} px")
+        except ImportError:
+            print("⚠️ scipy no está instalado; se omite el ajuste global")
+    
+    tiempos['total'] = time.perf_counter() - t0
+    info = {
+        'referencia': referencia,
+        'aristas': aristas,
+        'arbol': padres,
+        'fallidos': fallidos,
+        'no_conectadas': no_conectadas,
+        'refinamiento': info_refinamiento,
+        'tiempos': tiempos
+    }
+    return homografias, info
+
+
+def preparar_fusion(imagenes, homografias, referencia):
+    """
+    Reordena el resultado de `registrar_conjunto` al formato de
+    `fusionar_imagenes` (referencia primero y homografías del resto).
+    
+    Args:
+        imagenes: lista de imágenes (arrays o rutas, se cargan en color)
+        homografias: homografías de cada imagen a la referencia
+        referencia: índice de la imagen de referencia
+    
+    Returns:
+        (imagenes_ordenadas, homografias_resto)
+    """
+    def cargar(imagen):
+        return cv2.imread(str(imagen)) if isinstance(imagen, (str, os.PathLike)) else imagen
+    
+    resto = [k for k in range(len(imagenes)) if k != referencia and homografias[k] is not None]
+    return [cargar(imagenes[referencia])] + [cargar(imagenes[k]) for k in resto], \
+        [homografias[k] for k in resto]
@@ -3,13 +3,25 @@ Módulo para registro de imágenes usando diferentes métodos.
 Basado en los notebooks guía del curso de Visión por Computador.
 """
 
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
-from feature_detection import detectar_caracteristicas
-from matching import emparejar_caracteristicas, filtrar_matches_ransac
+from blending import mascara_valida, mezclar_feathering, mezclar_multibanda, pesos_distancia
+from feature_detection import (detectar_caracteristicas, detectar_caracteristicas_en_region,
+                               reducir_imagen)
+from matching import (MUESTRA_MINIMA, emparejamiento_guiado, emparejar_caracteristicas,
+                      filtrar_matches_ransac, prefiltro_geometrico, puntos_emparejados)
 
 
-def registro_con_caracteristicas(img_fija, img_movil, metodo='orb', max_features=500):
+def registro_con_caracteristicas(img_fija, img_movil, metodo='orb', max_features=500, cache=None,
+                                 bloques=None, escala_piramide=None, medir_ahorro=False,
+                                 backend='bf', prefiltro=None, reproj_thresh=5.0, estimador='ransac',
+                                 modelo='homografia', guiado=False, radio_guiado=8.0,
+                                 max_features_guiado=None, refinar=False, opciones_refinamiento=None):
     """
     Registra dos imágenes usando detección y emparejamiento de características.
     
@@ -18,13 +30,47 @@ def registro_con_caracteristicas(img_fija, img_movil, metodo='orb', max_features
         img_movil: imagen a registrar
         metodo: 'orb', 'sift', 'akaze'
         max_features: número máximo de características
+        cache: CacheCaracteristicas opcional para reutilizar detecciones
+        bloques: parámetros de detección por bloques (ver
+            `detectar_caracteristicas_por_bloques`); None = imagen completa
+        escala_piramide: si se indica (p. ej. 0.25), se usa el registro
+            grueso-a-fino de `registro_piramidal` con ese factor de escala
+        medir_ahorro: en modo pirámide, ejecuta también el camino a resolución
+            completa para informar del tiempo ahorrado
+        backend: emparejador, 'bf' (fuerza bruta) o 'flann' (aproximado)
+        prefiltro: prefiltro geométrico antes de RANSAC ('gms' o None)
+        reproj_thresh: umbral de error de reproyección del estimador robusto
+        estimador: estimador robusto (ver `filtrar_matches_ransac`)
+        modelo: 'homografia', 'afin' o 'similitud'
+        guiado: tras RANSAC, buscar más correspondencias con
+            `emparejamiento_guiado` y reestimar la homografía
+        radio_guiado: radio de búsqueda (píxeles) del emparejamiento guiado
+        max_features_guiado: si se indica, el emparejamiento guiado usa una
+            nueva detección con este número de características
+        refinar: refinar la homografía con ECC multiescala (`refinar_ecc`)
+        opciones_refinamiento: diccionario de argumentos para `refinar_ecc`
+            (niveles, nivel_final, max_iter, eps, tiempo_max, modelo; por
+            defecto el modelo de ECC es afín si `modelo` no es 'homografia')
     
     Returns:
         (homografía, imagen_registrada, info)
     """
+    if escala_piramide is not None:
+        return registro_piramidal(img_fija, img_movil, metodo, max_features,
+                                  escala=escala_piramide, cache=cache, medir_ahorro=medir_ahorro,
+                                  backend=backend, bloques=bloques, prefiltro=prefiltro,
+                                  reproj_thresh=reproj_thresh, estimador=estimador, modelo=modelo,
+                                  guiado=guiado, radio_guiado=radio_guiado,
+                                  max_features_guiado=max_features_guiado, refinar=refinar,
+                                  opciones_refinamiento=opciones_refinamiento)
+    
+    tiempos = {}
+    t0 = time.perf_counter()
+    
     # Detectar características
-    kp1, des1 = detectar_caracteristicas(img_fija, metodo, max_features)
-    kp2, des2 = detectar_caracteristicas(img_movil, metodo, max_features)
+    kp1, des1 = detectar_caracteristicas(img_fija, metodo, max_features, cache, bloques, compacto=True)
+    kp2, des2 = detectar_caracteristicas(img_movil, metodo, max_features, cache, bloques, compacto=True)
+    tiempos['deteccion'] = time.perf_counter() - t0
     
     if des1 is None or des2 is None:
         print("⚠️ No se detectaron suficientes características")
@@ -33,89 +79,856 @@ def registro_con_caracteristicas(img_fija, img_movil, metodo='orb', max_features
     print(f"✓ Características detectadas: {len(kp1)} en img1, {len(kp2)} en img2")
     
     # Emparejar características
-    matches = emparejar_caracteristicas(des1, des2, metodo)
+    t = time.perf_counter()
+    matches = emparejar_caracteristicas(des1, des2, metodo, compacto=True, backend=backend)
+    tiempos['emparejamiento'] = time.perf_counter() - t
     print(f"✓ Matches encontrados: {len(matches)}")
     
-    if len(matches) < 4:
-        print("⚠️ Insuficientes matches para calcular homografía")
+    info_prefiltro = None
+    if prefiltro is not None:
+        matches, info_prefiltro = prefiltro_geometrico(kp1, kp2, matches, img_fija.shape,
+                                                       img_movil.shape, prefiltro)
+        tiempos['prefiltro'] = info_prefiltro['tiempo_s']
+        print(f"✓ Prefiltro {prefiltro.upper()}: {info_prefiltro['eliminados']} matches eliminados "
+              f"en {info_prefiltro['tiempo_s']*1000:.1f} ms")
+    
+    if len(matches) < MUESTRA_MINIMA.get(modelo, 4):
+        print("⚠️ Insuficientes matches para calcular la transformación")
         return None, None, None
     
     # Filtrar con RANSAC
-    H, mask = filtrar_matches_ransac(kp1, kp2, matches)
+    t = time.perf_counter()
+    H, mask, info_ransac = filtrar_matches_ransac(kp1, kp2, matches, reproj_thresh, estimador, modelo,
+                                                  devolver_info=True)
+    tiempos['ransac'] = time.perf_counter() - t
     
     if H is None:
         print("⚠️ No se pudo calcular la homografía")
         return None, None, None
     
-    inliers = mask.ravel().tolist()
-    print(f"✓ Inliers (RANSAC): {sum(inliers)}/{len(inliers)}")
-    
-    # Aplicar transformación
-    h, w = img_fija.shape[:2]
-    img_registrada = cv2.warpPerspective(img_movil, H, (w, h))
+    num_inliers = int(np.count_nonzero(mask))
+    print(f"✓ Inliers (RANSAC): {num_inliers}/{len(mask)}")
     
     info = {
         'keypoints1': kp1,
         'keypoints2': kp2,
         'matches': matches,
         'mask': mask,
-        'num_inliers': sum(inliers)
+        'num_inliers': num_inliers,
+        'prefiltro': info_prefiltro,
+        'ransac': info_ransac,
+        'tiempos': tiempos
+    }
+    H = _guiado_y_refinamiento(img_fija, img_movil, H, info, des1, des2, metodo, cache, bloques,
+                               reproj_thresh, estimador, modelo, guiado, radio_guiado,
+                               max_features_guiado, refinar, opciones_refinamiento)
+    tiempos['total'] = time.perf_counter() - t0
+    
+    # Aplicar transformación
+    h, w = img_fija.shape[:2]
+    img_registrada = cv2.warpPerspective(img_movil, H, (w, h))
+    
+    return H, img_registrada, info
+
+
+def _guiado_y_refinamiento(img_fija, img_movil, H, info, des1, des2, metodo, cache, bloques,
+                           reproj_thresh, estimador, modelo, guiado, radio_guiado,
+                           max_features_guiado, refinar, opciones_refinamiento):
+    """
+    Etapas finales comunes al registro directo y al piramidal: emparejamiento
+    guiado (sus keypoints, matches, máscara y estadísticas de RANSAC
+    sustituyen a los de info solo si obtiene más inliers) y refinamiento ECC. Añade a info las claves
+    'guiado' y 'refinamiento' y sus tiempos.
+    
+    Returns:
+        homografía final
+    """
+    tiempos = info['tiempos']
+    info['guiado'] = None
+    if guiado:
+        t = time.perf_counter()
+        # La nueva detección solo sustituye a la original si el guiado gana
+        kpg1, desg1, kpg2, desg2 = info['keypoints1'], des1, info['keypoints2'], des2
+        if max_features_guiado is not None:
+            kpg1, desg1 = detectar_caracteristicas(img_fija, metodo, max_features_guiado, cache, bloques,
+                                                   compacto=True)
+            kpg2, desg2 = detectar_caracteristicas(img_movil, metodo, max_features_guiado, cache, bloques,
+                                                   compacto=True)
+        matches_guiados, H_guiada, mask_guiada, ransac_guiado = emparejamiento_guiado(
+            kpg1, desg1, kpg2, desg2, H, metodo, radio_guiado, reproj_thresh=reproj_thresh,
+            estimador=estimador, modelo=modelo, devolver_info=True
+        )
+        tiempos['guiado'] = time.perf_counter() - t
+        
+        inliers_guiados = 0 if mask_guiada is None else int(np.count_nonzero(mask_guiada))
+        info['guiado'] = {'num_matches': len(matches_guiados), 'num_inliers': inliers_guiados,
+                          'tiempo_s': tiempos['guiado']}
+        if inliers_guiados > info['num_inliers']:
+            H = H_guiada
+            info.update(keypoints1=kpg1, keypoints2=kpg2, matches=matches_guiados, mask=mask_guiada,
+                        num_inliers=inliers_guiados, ransac=ransac_guiado)
+        print(f"✓ Emparejamiento guiado: {inliers_guiados}/{len(matches_guiados)} inliers "
+              f"en {tiempos['guiado']*1000:.1f} ms")
+    
+    info['refinamiento'] = None
+    if refinar:
+        # Por defecto ECC conserva el modelo del registro (la similitud se refina como afín)
+        opciones = {'modelo': 'homografia' if modelo == 'homografia' else 'afin',
+                    **(opciones_refinamiento or {})}
+        H, info['refinamiento'] = refinar_ecc(img_fija, img_movil, H, **opciones)
+        tiempos['refinamiento'] = info['refinamiento']['tiempo_s']
+        print(f"✓ Refinamiento ECC: coeficiente {info['refinamiento']['ecc']} "
+              f"en {tiempos['refinamiento']*1000:.1f} ms")
+    
+    return H
+
+
+def refinar_ecc(img_fija, img_movil, H, niveles=3, nivel_final=0, max_iter=50, eps=1e-5,
+                tiempo_max=None, modelo='homografia'):
+    """
+    Refina una homografía maximizando el coeficiente de correlación
+    mejorado (ECC) de forma multiescala, empezando en el nivel más reducido
+    de la pirámide. No se pasa máscara: `cv2.findTransformECC` ya descarta
+    en cada iteración los píxeles que la transformación actual lleva fuera
+    de la imagen móvil, así que solo cuenta la zona de solapamiento.
+    
+    Args:
+        img_fija: imagen de referencia
+        img_movil: imagen a registrar
+        H: homografía inicial de la imagen móvil a la fija (p. ej. la de
+            `registro_con_caracteristicas`)
+        niveles: número de niveles de la pirámide (reducción x2 por nivel)
+        nivel_final: último nivel que se refina (0 = resolución completa;
+            1 = mitad de resolución, más barato)
+        max_iter: iteraciones máximas de ECC por nivel
+        eps: umbral de mejora del coeficiente para detenerse
+        tiempo_max: presupuesto de tiempo en segundos; si se agota no se
+            refinan más niveles (None = sin límite)
+        modelo: 'homografia', 'afin' o 'traslacion'
+    
+    Returns:
+        (homografía_refinada, info): info con el coeficiente ECC y el tiempo
+        de cada nivel y el tiempo total
+    """
+    tipos = {
+        'homografia': cv2.MOTION_HOMOGRAPHY,
+        'afin': cv2.MOTION_AFFINE,
+        'traslacion': cv2.MOTION_TRANSLATION
+    }
+    if modelo not in tipos:
+        raise ValueError(f"Modelo '{modelo}' no reconocido")
+    
+    t0 = time.perf_counter()
+    fija = img_fija if img_fija.ndim == 2 else cv2.cvtColor(img_fija, cv2.COLOR_BGR2GRAY)
+    movil = img_movil if img_movil.ndim == 2 else cv2.cvtColor(img_movil, cv2.COLOR_BGR2GRAY)
+    piramide = [(fija.astype(np.float32), movil.astype(np.float32))]
+    for _ in range(niveles - 1):
+        piramide.append((cv2.pyrDown(piramide[-1][0]), cv2.pyrDown(piramide[-1][1])))
+    
+    # ECC estima la transformación de la imagen fija a la móvil (la inversa de H)
+    W = np.linalg.inv(H)
+    W /= W[2, 2]
+    criterio = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, max_iter, eps)
+    
+    etapas = []
+    for nivel in range(niveles - 1, nivel_final - 1, -1):
+        if tiempo_max is not None and time.perf_counter() - t0 > tiempo_max:
+            print(f"⚠️ Presupuesto de tiempo agotado; refinamiento detenido en el nivel {nivel + 1}")
+            break
+        
+        t = time.perf_counter()
+        fija_n, movil_n = piramide[nivel]
+        S = np.diag([0.5 ** nivel, 0.5 ** nivel, 1.0])
+        W_n = S @ W @ np.linalg.inv(S)
+        W_n = (W_n if modelo == 'homografia' else W_n[:2]).astype(np.float32)
+        
+        try:
+            coeficiente, W_n = cv2.findTransformECC(fija_n, movil_n, W_n, tipos[modelo], criterio,
+                                                    None, 5)
+        except cv2.error:
+            # ECC no converge (p. ej. sin textura en el solape): se mantiene la estimación
+            etapas.append({'nivel': nivel, 'ecc': None, 'tiempo_s': time.perf_counter() - t})
+            continue
+        
+        W_n = W_n.astype(np.float64)
+        if modelo != 'homografia':
+            W_n = np.vstack([W_n, [0, 0, 1]])
+        W = np.linalg.inv(S) @ W_n @ S
+        etapas.append({'nivel': nivel, 'ecc': float(coeficiente), 'tiempo_s': time.perf_counter() - t})
+    
+    H_refinada = np.linalg.inv(W)
+    H_refinada /= H_refinada[2, 2]
+    
+    info = {
+        'etapas': etapas,
+        'ecc': next((e['ecc'] for e in reversed(etapas) if e['ecc'] is not None), None),
+        'tiempo_s': time.perf_counter() - t0
+    }
+    return H_refinada, info
+
+
+def _proyectar_puntos(puntos, H):
+    """
+    Aplica una homografía a un array (N, 2) de puntos.
+    """
+    return cv2.perspectiveTransform(np.asarray(puntos, np.float32).reshape(-1, 1, 2), H).reshape(-1, 2)
+
+
+def registro_piramidal(img_fija, img_movil, metodo='orb', max_features=500, escala=0.25,
+                       radio=None, cache=None, medir_ahorro=False, backend='bf', bloques=None,
+                       prefiltro=None, reproj_thresh=5.0, estimador='ransac', modelo='homografia',
+                       guiado=False, radio_guiado=8.0, max_features_guiado=None, refinar=False,
+                       opciones_refinamiento=None):
+    """
+    Registro grueso-a-fino: estima una homografía inicial sobre copias
+    reducidas y la refina con keypoints a resolución completa detectados
+    solo cerca de las posiciones predichas.
+    
+    Args:
+        img_fija: imagen de referencia
+        img_movil: imagen a registrar
+        metodo: 'orb', 'sift', 'akaze'
+        max_features: número máximo de características (en cada nivel)
+        escala: factor de reducción del nivel grueso (0-1)
+        radio: semilado en píxeles (resolución completa) de las ventanas de
+            refinamiento y tolerancia respecto a la predicción (None = 4 px
+            del nivel grueso)
+        cache: CacheCaracteristicas opcional para el nivel grueso
+        medir_ahorro: ejecuta también el registro a resolución completa y
+            añade a info el tiempo ahorrado
+        backend: emparejador, 'bf' (fuerza bruta) o 'flann' (aproximado)
+        bloques: parámetros de detección por bloques del nivel grueso
+        prefiltro: prefiltro geométrico de los matches del nivel grueso
+        reproj_thresh: umbral del estimador robusto (en píxeles de cada nivel)
+        estimador: estimador robusto de ambos niveles (ver `filtrar_matches_ransac`)
+        modelo: 'homografia', 'afin' o 'similitud'
+        guiado, radio_guiado, max_features_guiado, refinar,
+            opciones_refinamiento: como en `registro_con_caracteristicas`,
+            aplicados a resolución completa tras el nivel fino
+    
+    Returns:
+        (homografía, imagen_registrada, info): info tiene las mismas claves
+        que en `registro_con_caracteristicas` más 'H_grueso' (y 'ahorro_s',
+        'ahorro_pct' si se mide el ahorro); 'ransac' describe el nivel fino
+    """
+    if radio is None:
+        radio = 4.0 / escala
+    
+    tiempos = {}
+    t0 = time.perf_counter()
+    
+    # Nivel grueso: detección, emparejamiento y RANSAC sobre imágenes reducidas
+    pequena_fija = reducir_imagen(img_fija, escala)
+    pequena_movil = reducir_imagen(img_movil, escala)
+    kp1, des1 = detectar_caracteristicas(pequena_fija, metodo, max_features, cache, bloques,
+                                         compacto=True)
+    kp2, des2 = detectar_caracteristicas(pequena_movil, metodo, max_features, cache, bloques,
+                                         compacto=True)
+    
+    if des1 is None or des2 is None:
+        print("⚠️ No se detectaron suficientes características (nivel grueso)")
+        return None, None, None
+    
+    matches = emparejar_caracteristicas(des1, des2, metodo, compacto=True, backend=backend)
+    info_prefiltro = None
+    if prefiltro is not None:
+        matches, info_prefiltro = prefiltro_geometrico(kp1, kp2, matches, pequena_fija.shape,
+                                                       pequena_movil.shape, prefiltro)
+    H_pequena, mask, info_ransac = filtrar_matches_ransac(kp1, kp2, matches, reproj_thresh, estimador,
+                                                          modelo, devolver_info=True)
+    
+    if H_pequena is None:
+        print("⚠️ No se pudo calcular la homografía en el nivel grueso")
+        return None, None, None
+    
+    # Llevar la homografía a resolución completa: H = S^-1 · H_pequena · S
+    S = np.diag([escala, escala, 1.0])
+    H_grueso = np.linalg.inv(S) @ H_pequena @ S
+    
+    inliers_gruesos = matches[mask.ravel().astype(bool)]
+    pts1 = puntos_emparejados(kp1, kp2, inliers_gruesos)[0] / escala
+    tiempos['grueso'] = time.perf_counter() - t0
+    print(f"✓ Nivel grueso (escala {escala}): {len(inliers_gruesos)} inliers")
+    
+    # Nivel fino: keypoints a resolución completa cerca de las posiciones
+    # predichas (en la imagen móvil se proyectan con la inversa de H_grueso)
+    t = time.perf_counter()
+    pts2_predichos = _proyectar_puntos(pts1, np.linalg.inv(H_grueso))
+    kpf1, desf1 = detectar_caracteristicas_en_region(img_fija, pts1, radio, metodo, max_features,
+                                                     compacto=True)
+    kpf2, desf2 = detectar_caracteristicas_en_region(img_movil, pts2_predichos, radio, metodo,
+                                                     max_features, compacto=True)
+    
+    H, mask_fina, matches_finos = None, None, None
+    info_ransac_fino = None
+    if desf1 is not None and desf2 is not None:
+        matches_finos = emparejar_caracteristicas(desf1, desf2, metodo, compacto=True, backend=backend)
+        
+        # Solo se aceptan matches coherentes con la homografía gruesa
+        if len(matches_finos) > 0:
+            p1, p2 = puntos_emparejados(kpf1, kpf2, matches_finos)
+            error = np.linalg.norm(_proyectar_puntos(p2, H_grueso) - p1, axis=1)
+            matches_finos = matches_finos[error < radio]
+        
+        H, mask_fina, info_ransac_fino = filtrar_matches_ransac(kpf1, kpf2, matches_finos, reproj_thresh,
+                                                                estimador, modelo, devolver_info=True)
+    tiempos['fino'] = time.perf_counter() - t
+    
+    if H is None:
+        print("⚠️ El refinamiento falló; se usa la homografía del nivel grueso")
+        H = H_grueso
+        info_ransac_fino = info_ransac
+        desf1, desf2 = des1, des2
+        # Keypoints del nivel grueso llevados a coordenadas de resolución completa
+        kpf1, kpf2, matches_finos = kp1.copy(), kp2.copy(), inliers_gruesos
+        for kps in (kpf1, kpf2):
+            kps['x'] /= escala
+            kps['y'] /= escala
+            kps['size'] /= escala
+        mask_fina = np.ones((len(inliers_gruesos), 1), dtype=np.uint8)
+    
+    num_inliers = int(mask_fina.sum())
+    print(f"✓ Nivel fino: {num_inliers}/{len(matches_finos)} inliers")
+    
+    info = {
+        'keypoints1': kpf1,
+        'keypoints2': kpf2,
+        'matches': matches_finos,
+        'mask': mask_fina,
+        'num_inliers': num_inliers,
+        'prefiltro': info_prefiltro,
+        'ransac': info_ransac_fino,
+        'H_grueso': H_grueso,
+        'tiempos': tiempos
     }
+    H = _guiado_y_refinamiento(img_fija, img_movil, H, info, desf1, desf2, metodo, cache, bloques,
+                               reproj_thresh, estimador, modelo, guiado, radio_guiado,
+                               max_features_guiado, refinar, opciones_refinamiento)
+    tiempos['total'] = time.perf_counter() - t0
+    
+    h, w = img_fija.shape[:2]
+    img_registrada = cv2.warpPerspective(img_movil, H, (w, h))
+    
+    if medir_ahorro:
+        t = time.perf_counter()
+        registro_con_caracteristicas(img_fija, img_movil, metodo, max_features, backend=backend,
+                                     bloques=bloques, prefiltro=prefiltro,
+                                     reproj_thresh=reproj_thresh, estimador=estimador, modelo=modelo,
+                                     guiado=guiado, radio_guiado=radio_guiado,
+                                     max_features_guiado=max_features_guiado, refinar=refinar,
+                                     opciones_refinamiento=opciones_refinamiento)
+        tiempos['completo'] = time.perf_counter() - t
+        info['ahorro_s'] = tiempos['completo'] - tiempos['total']
+        info['ahorro_pct'] = 100 * info['ahorro_s'] / tiempos['completo']
+        print(f"✓ Tiempo: {tiempos['total']:.2f}s vs {tiempos['completo']:.2f}s "
+              f"a resolución completa ({info['ahorro_pct']:.0f}% de ahorro)")
     
     return H, img_registrada, info
 
 
+def _sumas_ventana(integral, tx, ty, h, w):
+    """
+    Suma de los píxeles de la imagen móvil que siguen dentro del lienzo tras
+    desplazarla (tx, ty), a partir de su imagen integral. Vectorizado sobre
+    arrays de desplazamientos.
+    """
+    y0 = np.clip(-ty, 0, h)
+    y1 = np.clip(h - ty, 0, h)
+    x0 = np.clip(-tx, 0, w)
+    x1 = np.clip(w - tx, 0, w)
+    return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+
+
+def _metrica_desde_sumas(cruzado, suma_t, suma_t2, suma_f, suma_f2, n, metrica):
+    """
+    MSE o NCC entre la imagen fija y la móvil desplazada (con borde a cero,
+    como `aplicar_transformacion`) a partir de sumas: es el mismo valor que
+    devolvería `calcular_similitud` sobre las imágenes completas.
+    """
+    if metrica == 'mse':
+        return (suma_f2 + suma_t2 - 2 * cruzado) / n
+    
+    media_f, media_t = suma_f / n, suma_t / n
+    std_f = np.sqrt(max(suma_f2 / n - media_f ** 2, 0))
+    std_t = np.sqrt(np.maximum(suma_t2 / n - media_t ** 2, 0))
+    return (cruzado / n - media_f * media_t) / ((std_f + 1e-8) * (std_t + 1e-8))
+
+
+def _superficie_fft(img_fija, img_movil, txs, tys, metrica):
+    """
+    Superficie de similitud para todos los desplazamientos de la rejilla
+    (tys x txs) con una única correlación cruzada por FFT.
+    
+    El término cruzado sum(F(x) * M(x - t)) sale de la correlación con
+    relleno de ceros (sin solapamiento circular) y las sumas de M y M^2 de la
+    zona que sigue dentro del lienzo salen de imágenes integrales.
+    """
+    fija = img_fija.astype(np.float64).reshape(img_fija.shape[0], img_fija.shape[1], -1)
+    movil = img_movil.astype(np.float64).reshape(fija.shape)
+    h, w = fija.shape[:2]
+    
+    alto = cv2.getOptimalDFTSize(h + min(int(np.abs(tys).max()), h))
+    ancho = cv2.getOptimalDFTSize(w + min(int(np.abs(txs).max()), w))
+    espectro = np.fft.rfft2(fija, s=(alto, ancho), axes=(0, 1)) * \
+        np.conj(np.fft.rfft2(movil, s=(alto, ancho), axes=(0, 1)))
+    espectro = espectro.sum(axis=2)
+    
+    if metrica == 'fase':
+        espectro /= np.maximum(np.abs(espectro), 1e-12)
+    correlacion = np.fft.irfft2(espectro, s=(alto, ancho))
+    
+    # Índices circulares: el desplazamiento negativo -t está en tamaño - t
+    cruzado = correlacion[np.ix_(tys % alto, txs % ancho)]
+    if metrica == 'fase':
+        return cruzado
+    
+    TX, TY = np.meshgrid(txs, tys)
+    n = fija.size
+    suma_t = _sumas_ventana(cv2.integral(movil.sum(axis=2)), TX, TY, h, w)
+    suma_t2 = _sumas_ventana(cv2.integral((movil ** 2).sum(axis=2)), TX, TY, h, w)
+    return _metrica_desde_sumas(cruzado, suma_t, suma_t2, fija.sum(), (fija ** 2).sum(), n, metrica)
+
+
+def _similitud_desplazamientos(img_fija, img_movil, desplazamientos, metrica):
+    """
+    Similitud exacta para una lista corta de desplazamientos (tx, ty),
+    usando solo la zona de solapamiento de cada uno.
+    """
+    fija = img_fija.astype(np.float64)
+    movil = img_movil.astype(np.float64)
+    h, w = fija.shape[:2]
+    suma_f, suma_f2 = fija.sum(), (fija ** 2).sum()
+    
+    valores = []
+    for tx, ty in desplazamientos:
+        y0, y1 = max(0, ty), min(h, h + ty)
+        x0, x1 = max(0, tx), min(w, w + tx)
+        if y1 <= y0 or x1 <= x0:
+            cruzado, suma_t, suma_t2 = 0.0, 0.0, 0.0
+        else:
+            zona = movil[y0 - ty:y1 - ty, x0 - tx:x1 - tx]
+            cruzado = (fija[y0:y1, x0:x1] * zona).sum()
+            suma_t, suma_t2 = zona.sum(), (zona ** 2).sum()
+        valores.append(_metrica_desde_sumas(cruzado, suma_t, suma_t2, suma_f, suma_f2, fija.size,
+                                            metrica))
+    return np.array(valores, dtype=np.float64)
+
+
+def _pico_subpixel(superficie, iy, ix):
+    """
+    Ajuste parabólico del pico en cada eje. Devuelve el desplazamiento
+    (dy, dx) en unidades de la rejilla, en [-0.5, 0.5].
+    """
+    desplazamiento = []
+    for vecinos in (superficie[iy-1:iy+2, ix] if 0 < iy < superficie.shape[0] - 1 else None,
+                    superficie[iy, ix-1:ix+2] if 0 < ix < superficie.shape[1] - 1 else None):
+        if vecinos is None or not np.all(np.isfinite(vecinos)):
+            desplazamiento.append(0.0)
+            continue
+        izquierda, centro, derecha = vecinos
+        denominador = izquierda - 2 * centro + derecha
+        d = 0.5 * (izquierda - derecha) / denominador if denominador != 0 else 0.0
+        desplazamiento.append(float(np.clip(d, -0.5, 0.5)))
+    return desplazamiento
+
+
 def registro_busqueda_exhaustiva(img_fija, img_movil, 
                                  rango_tx=(-20, 20), 
                                  rango_ty=(-20, 20),
                                  paso=1,
-                                 metrica='mse'):
+                                 metrica='mse',
+                                 motor='fft',
+                                 niveles=1,
+                                 subpixel=True):
     """
     Registro por búsqueda exhaustiva de traslación.
     
+    Con motor='fft' la superficie de similitud completa se calcula de una vez
+    con una correlación cruzada por FFT (mismos valores de MSE/NCC que el
+    bucle de fuerza bruta, con borde a cero). Con niveles > 1 se busca en una
+    pirámide: superficie completa en el nivel más reducido y refinamiento
+    local en los niveles siguientes, de modo que los rangos grandes siguen
+    siendo baratos.
+    
     Args:
         img_fija: imagen de referencia
         img_movil: imagen a registrar
         rango_tx: rango de traslación en x
         rango_ty: rango de traslación en y
         paso: paso de búsqueda
-        metrica: métrica de similitud ('mse', 'ncc')
+        metrica: métrica de similitud ('mse', 'ncc'; 'fase' para correlación
+            de fase con motor='fft' y niveles=1; 'mi' solo con
+            motor='fuerza_bruta')
+        motor: 'fft' o 'fuerza_bruta' (warpAffine + EvaluadorSimilitud por
+            cada desplazamiento)
+        niveles: niveles de pirámide del motor FFT (1 = sin pirámide)
+        subpixel: refinar el pico con un ajuste parabólico
     
     Returns:
-        (matriz_transformacion, similitud, historial)
+        (matriz_transformacion, similitud, historial): historial es un array
+        2D [iy, ix] con la similitud para cada (ty, tx) de la rejilla (NaN en
+        los desplazamientos no evaluados por la pirámide)
     """
-    from utils import aplicar_transformacion, calcular_similitud
+    txs = np.arange(rango_tx[0], rango_tx[1] + 1, paso)
+    tys = np.arange(rango_ty[0], rango_ty[1] + 1, paso)
+    minimizar = metrica == 'mse'
     
-    mejor_similitud = float('inf') if metrica == 'mse' else float('-inf')
-    mejor_tx, mejor_ty = 0, 0
-    historia = []
+    if motor == 'fuerza_bruta':
+        from utils import EvaluadorSimilitud
+        
+        # Estadísticas de la imagen fija y buffers reutilizados en todas las evaluaciones
+        evaluador = EvaluadorSimilitud(img_fija, metrica)
+        h, w = img_movil.shape[:2]
+        img_trans = np.empty_like(img_movil)
+        historial = np.empty((len(tys), len(txs)), dtype=np.float64)
+        for ix, tx in enumerate(txs):
+            for iy, ty in enumerate(tys):
+                M = np.float32([[1, 0, int(tx)], [0, 1, int(ty)]])
+                cv2.warpAffine(img_movil, M, (w, h), dst=img_trans)
+                historial[iy, ix] = evaluador(img_trans)
     
-    for tx in range(rango_tx[0], rango_tx[1] + 1, paso):
-        for ty in range(rango_ty[0], rango_ty[1] + 1, paso):
-            img_trans, _ = aplicar_transformacion(img_movil, 'traslacion', {'tx': tx, 'ty': ty})
-            sim = calcular_similitud(img_fija, img_trans, metrica)
-            historia.append((tx, ty, sim))
-            
-            if metrica == 'mse':
-                if sim < mejor_similitud:
-                    mejor_similitud = sim
-                    mejor_tx, mejor_ty = tx, ty
-            else:
-                if sim > mejor_similitud:
-                    mejor_similitud = sim
-                    mejor_tx, mejor_ty = tx, ty
+    elif motor == 'fft':
+        if metrica not in ['mse', 'ncc', 'fase']:
+            raise ValueError(f"Métrica '{metrica}' no soportada por el motor FFT")
+        if metrica == 'fase' and niveles > 1:
+            # Los niveles finos se evalúan con sumas locales, que no admiten la fase
+            raise ValueError("La métrica 'fase' no admite búsqueda piramidal (niveles > 1)")
+        
+        if niveles <= 1:
+            historial = _superficie_fft(img_fija, img_movil, txs, tys, metrica)
+        else:
+            historial = _busqueda_piramidal(img_fija, img_movil, txs, tys, metrica, niveles)
+    
+    else:
+        raise ValueError(f"Motor '{motor}' no reconocido")
+    
+    superficie = historial if minimizar else -historial
+    iy, ix = np.unravel_index(np.nanargmin(superficie), superficie.shape)
+    mejor_similitud = float(historial[iy, ix])
+    
+    mejor_tx, mejor_ty = float(txs[ix]), float(tys[iy])
+    if subpixel:
+        dy, dx = _pico_subpixel(superficie, iy, ix)
+        mejor_tx += dx * paso
+        mejor_ty += dy * paso
     
     M_optima = np.float32([[1, 0, mejor_tx], [0, 1, mejor_ty]])
-    return M_optima, mejor_similitud, historia
+    return M_optima, mejor_similitud, historial
+
+
+def _busqueda_piramidal(img_fija, img_movil, txs, tys, metrica, niveles, radio=1):
+    """
+    Búsqueda grueso-a-fino del motor FFT. Devuelve la superficie sobre la
+    rejilla (tys x txs) con NaN donde no se ha evaluado.
+    """
+    minimizar = metrica == 'mse'
+    piramide = [(img_fija, img_movil)]
+    for _ in range(niveles - 1):
+        piramide.append((cv2.pyrDown(piramide[-1][0]), cv2.pyrDown(piramide[-1][1])))
+    
+    # Nivel más reducido: superficie completa por FFT
+    factor = 2 ** (niveles - 1)
+    txs_g = np.arange(int(np.floor(txs[0] / factor)), int(np.ceil(txs[-1] / factor)) + 1)
+    tys_g = np.arange(int(np.floor(tys[0] / factor)), int(np.ceil(tys[-1] / factor)) + 1)
+    superficie = _superficie_fft(*piramide[-1], txs_g, tys_g, metrica)
+    iy, ix = np.unravel_index(np.argmin(superficie if minimizar else -superficie), superficie.shape)
+    centro = np.array([txs_g[ix], tys_g[iy]])
+    
+    # Niveles intermedios: refinamiento local alrededor del doble del pico
+    for nivel in range(niveles - 2, 0, -1):
+        centro = 2 * centro
+        candidatos = [(centro[0] + dx, centro[1] + dy)
+                      for dy in range(-radio, radio + 1) for dx in range(-radio, radio + 1)]
+        valores = _similitud_desplazamientos(*piramide[nivel], candidatos, metrica)
+        centro = np.array(candidatos[np.argmin(valores) if minimizar else np.argmax(valores)])
+    
+    # Resolución completa: puntos de la rejilla original cerca de la predicción
+    centro = 2 * centro
+    paso = max(int(np.diff(txs[:2]).sum()), int(np.diff(tys[:2]).sum()), 1)
+    cerca_x = np.flatnonzero(np.abs(txs - centro[0]) <= max(radio, paso))
+    cerca_y = np.flatnonzero(np.abs(tys - centro[1]) <= max(radio, paso))
+    if len(cerca_x) == 0:
+        cerca_x = np.array([np.argmin(np.abs(txs - centro[0]))])
+    if len(cerca_y) == 0:
+        cerca_y = np.array([np.argmin(np.abs(tys - centro[1]))])
+    
+    historial = np.full((len(tys), len(txs)), np.nan)
+    
+    def evaluar(indices):
+        valores = _similitud_desplazamientos(img_fija, img_movil,
+                                             [(int(txs[ix]), int(tys[iy])) for iy, ix in indices], metrica)
+        for (iy, ix), valor in zip(indices, valores):
+            historial[iy, ix] = valor
+    
+    evaluar([(iy, ix) for iy in cerca_y for ix in cerca_x])
+    
+    # Vecinos del pico que falten, para el ajuste subpíxel
+    iy, ix = np.unravel_index(np.nanargmin(historial if minimizar else -historial), historial.shape)
+    vecinos = [(iy + dy, ix + dx) for dy, dx in [(-1, 0), (1, 0), (0, -1), (0, 1)]]
+    evaluar([(y, x) for y, x in vecinos
+             if 0 <= y < len(tys) and 0 <= x < len(txs) and np.isnan(historial[y, x])])
+    return historial
+
+
+def _espectro_log_polar(imagen, ventana):
+    """
+    Magnitud logarítmica del espectro (centrada, con filtro paso alto)
+    remuestreada en coordenadas log-polares: filas = ángulo (360° en h
+    filas), columnas = log(radio). Se descartan los radios muy pequeños,
+    dominados por la componente continua y la ventana.
+    """
+    h, w = imagen.shape
+    espectro = np.abs(np.fft.fftshift(np.fft.fft2((imagen - imagen.mean()) * ventana)))
+    
+    fy = np.cos(np.pi * (np.arange(h) / h - 0.5))
+    fx = np.cos(np.pi * (np.arange(w) / w - 0.5))
+    X = np.outer(fy, fx)
+    espectro = np.log1p(espectro * (1 - X) * (2 - X))
+    
+    radio_max = min(h, w) / 2
+    log_polar = cv2.warpPolar(espectro.astype(np.float32), (w, h), (w / 2, h / 2), radio_max,
+                              cv2.INTER_LINEAR + cv2.WARP_POLAR_LOG)
+    columna_min = int(w * np.log(0.02 * radio_max) / np.log(radio_max))
+    return np.ascontiguousarray(log_polar[:, columna_min:]), radio_max
+
+
+def _picos_correlacion_fase(a, b, num_picos):
+    """
+    Los `num_picos` máximos locales más altos de la correlación de fase
+    circular entre a y b, con ajuste subpíxel. Mismo convenio de signo que
+    cv2.phaseCorrelate(a, b), que no se usa porque en algunas versiones de
+    OpenCV devuelve resultados distintos en llamadas repetidas.
+    
+    Returns:
+        lista de (dx, dy, valor)
+    """
+    espectro = np.fft.fft2(b) * np.conj(np.fft.fft2(a))
+    correlacion = np.real(np.fft.ifft2(espectro / np.maximum(np.abs(espectro), 1e-12))).astype(np.float32)
+    h, w = correlacion.shape
+    
+    maximos = correlacion >= cv2.dilate(correlacion, np.ones((5, 5), np.uint8))
+    ys, xs = np.nonzero(maximos)
+    orden = np.argsort(-correlacion[ys, xs])[:num_picos]
+    
+    picos = []
+    for y, x in zip(ys[orden], xs[orden]):
+        vecinos_y = correlacion[[(y - 1) % h, y, (y + 1) % h], x]
+        vecinos_x = correlacion[y, [(x - 1) % w, x, (x + 1) % w]]
+        dy, dx = _pico_subpixel(vecinos_y[:, None], 1, 0)[0], _pico_subpixel(vecinos_x[None, :], 0, 1)[1]
+        # Los picos de la mitad superior corresponden a desplazamientos negativos
+        py, px = y + dy, x + dx
+        picos.append((px - w if px > w / 2 else px, py - h if py > h / 2 else py, float(correlacion[y, x])))
+    return picos
+
+
+def registro_fourier_mellin(img_fija, img_movil, num_candidatos=5, devolver_info=False):
+    """
+    Registro de rotación, escala y traslación por Fourier-Mellin.
+    
+    La magnitud del espectro no depende de la traslación, y en coordenadas
+    log-polares la rotación y la escala se convierten en desplazamientos, que
+    se recuperan con correlación de fase. Después se deshace la rotación y la
+    escala y se recupera la traslación con otra correlación de fase. En total
+    son unas pocas FFT, frente al bucle de la búsqueda exhaustiva.
+    
+    Como el espectro tiene simetría de 180° y la correlación log-polar puede
+    tener varios picos parecidos, se prueban los `num_candidatos` mejores
+    picos con ambos ángulos y se elige el que da mayor NCC con la imagen fija.
+    
+    Args:
+        img_fija: imagen de referencia
+        img_movil: imagen a registrar (mismo tamaño)
+        num_candidatos: número de picos log-polares a verificar
+        devolver_info: devolver también un diccionario con ángulo, escala,
+            traslación, NCC y tiempo
+    
+    Returns:
+        (matriz_transformacion, imagen_registrada) o
+        (matriz_transformacion, imagen_registrada, info). La matriz 2x3
+        lleva la imagen móvil a la fija, como en `registro_busqueda_exhaustiva`
+    """
+    from utils import EvaluadorSimilitud
+    
+    t0 = time.perf_counter()
+    fija = img_fija if img_fija.ndim == 2 else cv2.cvtColor(img_fija, cv2.COLOR_BGR2GRAY)
+    movil = img_movil if img_movil.ndim == 2 else cv2.cvtColor(img_movil, cv2.COLOR_BGR2GRAY)
+    fija = fija.astype(np.float32)
+    movil = movil.astype(np.float32)
+    h, w = fija.shape
+    centro = (w / 2, h / 2)
+    ventana = cv2.createHanningWindow((w, h), cv2.CV_32F)
+    
+    # Rotación y escala: desplazamiento entre los espectros log-polares
+    polar_fija, radio_max = _espectro_log_polar(fija, ventana)
+    polar_movil, _ = _espectro_log_polar(movil, ventana)
+    
+    evaluador = EvaluadorSimilitud(fija, 'ncc')
+    mejor = None
+    for d_radio, d_angulo, _ in _picos_correlacion_fase(polar_fija, polar_movil, num_candidatos):
+        angulo = 360.0 * d_angulo / h
+        escala = float(np.exp(d_radio * np.log(radio_max) / w))
+        
+        for candidato in (angulo, angulo + 180.0):
+            M = cv2.getRotationMatrix2D(centro, candidato, escala)
+            tx, ty, _ = _picos_correlacion_fase(cv2.warpAffine(movil, M, (w, h)) * ventana,
+                                                fija * ventana, 1)[0]
+            M[0, 2] += tx
+            M[1, 2] += ty
+            
+            # NCC sobre la imagen completa (borde a cero): penaliza también
+            # los candidatos con poco solape
+            ncc = evaluador(cv2.warpAffine(movil, M, (w, h)))
+            if mejor is None or ncc > mejor[0]:
+                mejor = (ncc, M, (candidato + 180.0) % 360.0 - 180.0, escala)
+    
+    ncc, M, angulo, escala = mejor
+    img_registrada = cv2.warpAffine(img_movil, M, (w, h))
+    tiempo = time.perf_counter() - t0
+    
+    if not devolver_info:
+        return M, img_registrada
+    
+    info = {
+        'angulo': angulo,
+        'escala': escala,
+        'tx': float(M[0, 2]),
+        'ty': float(M[1, 2]),
+        'ncc': ncc,
+        'tiempo_s': tiempo
+    }
+    return M, img_registrada, info
+
+
+def validar_fourier_mellin(casos=None, size=256, tipo='texto', rango_busqueda=(-20, 20),
+                           motor_busqueda='fft', verbose=True):
+    """
+    Valida `registro_fourier_mellin` sobre casos sintéticos
+    (crear_imagen_sintetica + aplicar_transformacion('afin')) y compara
+    error y tiempo con la búsqueda exhaustiva de traslación.
+    
+    Args:
+        casos: lista de diccionarios de parámetros de 'afin' (angulo, escala,
+            tx, ty); None = conjunto por defecto
+        size: tamaño de la imagen sintética
+        tipo: tipo de imagen sintética
+        rango_busqueda: rango (en x e y) de la búsqueda exhaustiva
+        motor_busqueda: motor de la búsqueda exhaustiva ('fft' o 'fuerza_bruta')
+        verbose: imprimir el resumen
+    
+    Returns:
+        DataFrame con una fila por caso y método (errores de
+        `calcular_error_transformacion` y tiempo)
+    """
+    import pandas as pd
+    from utils import aplicar_transformacion, calcular_error_transformacion, crear_imagen_sintetica
+    
+    if casos is None:
+        casos = [
+            {'tx': 8, 'ty': -5},
+            {'angulo': 10, 'tx': 4, 'ty': 3},
+            {'angulo': -25, 'escala': 1.0},
+            {'angulo': 15, 'escala': 1.15, 'tx': -6, 'ty': 2},
+            {'angulo': 40, 'escala': 0.85, 'tx': 5, 'ty': 5},
+        ]
+    
+    img_fija = crear_imagen_sintetica(size, tipo)
+    filas = []
+    for i, params in enumerate(casos):
+        img_movil, M_real = aplicar_transformacion(img_fija, 'afin', params)
+        
+        # Ambos métodos devuelven la transformación móvil -> fija; se invierte
+        # para compararla con la matriz de aplicar_transformacion (fija -> móvil)
+        t = time.perf_counter()
+        M_fm, _ = registro_fourier_mellin(img_fija, img_movil)
+        tiempo_fm = time.perf_counter() - t
+        
+        t = time.perf_counter()
+        M_ex, _, _ = registro_busqueda_exhaustiva(img_fija, img_movil, rango_busqueda, rango_busqueda,
+                                                  motor=motor_busqueda)
+        tiempo_ex = time.perf_counter() - t
+        
+        for metodo, M, tiempo in [('fourier_mellin', M_fm, tiempo_fm), ('exhaustiva', M_ex, tiempo_ex)]:
+            error = calcular_error_transformacion(M_real, cv2.invertAffineTransform(M))
+            filas.append({'caso': i, **params, 'metodo': metodo, **error, 'tiempo_s': tiempo})
+    
+    tabla = pd.DataFrame(filas)
+    if verbose:
+        print(tabla.groupby('metodo')[['tx_error', 'ty_error', 'rmse', 'tiempo_s']].mean())
+    return tabla
+
+
+def _limites_canvas(imagenes, homografias):
+    """
+    Calcula el canvas ajustado a las esquinas proyectadas de todas las
+    imágenes (la primera es la referencia, con homografía identidad).
+    
+    Returns:
+        (T, ancho, alto, cajas): T es la traslación de coordenadas de la
+        referencia a coordenadas del canvas y cajas la caja (x0, y0, x1, y1)
+        de cada imagen en el canvas (None si su homografía es None)
+    """
+    transformaciones = [np.eye(3)] + [None if H is None else np.asarray(H, np.float64)
+                                      for H in homografias]
+    
+    esquinas = []
+    for img, H in zip(imagenes, transformaciones):
+        if H is None:
+            esquinas.append(None)
+            continue
+        h, w = img.shape[:2]
+        puntos = H @ np.array([[0, w, w, 0], [0, 0, h, h], [1, 1, 1, 1]], dtype=np.float64)
+        if np.any(puntos[2] <= 0):
+            raise ValueError("Homografía degenerada: una esquina se proyecta al infinito")
+        esquinas.append((puntos[:2] / puntos[2]).T)
+    
+    todas = np.vstack([e for e in esquinas if e is not None])
+    x_min, y_min = np.floor(todas.min(axis=0))
+    x_max, y_max = np.ceil(todas.max(axis=0))
+    T = np.array([[1, 0, -x_min], [0, 1, -y_min], [0, 0, 1]], dtype=np.float64)
+    ancho, alto = int(x_max - x_min), int(y_max - y_min)
+    
+    cajas = []
+    for e in esquinas:
+        if e is None:
+            cajas.append(None)
+            continue
+        x0, y0 = np.floor(e.min(axis=0) - [x_min, y_min]).astype(int)
+        x1, y1 = np.ceil(e.max(axis=0) - [x_min, y_min]).astype(int)
+        cajas.append((max(x0, 0), max(y0, 0), min(x1, ancho), min(y1, alto)))
+    
+    return T, ancho, alto, cajas
+
+
+def _homografia_caja(H, T, caja):
+    """
+    Homografía de una imagen a las coordenadas locales de su caja del canvas.
+    """
+    x0, y0 = caja[:2]
+    return np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64) @ T @ H
 
 
-def fusionar_imagenes(imagenes, homografias):
+def fusionar_imagenes(imagenes, homografias, tam_bloque=None, ruta_salida=None, num_hilos=None,
+                      metodo_blending='feathering', niveles_blending=5, ancho_feathering=None):
     """
     Fusiona múltiples imágenes usando las homografías calculadas.
     
+    El canvas se ajusta a las esquinas proyectadas de todas las imágenes y
+    cada imagen se transforma solo dentro de su caja envolvente, escribiendo
+    en una sub-vista del canvas. Admite imágenes en gris o en color.
+    
     Args:
         imagenes: lista de imágenes a fusionar
         homografias: lista de homografías (desde cada imagen a la referencia)
+        tam_bloque: si se indica, se compone por bloques en disco con
+            `fusionar_imagenes_por_bloques` (para panoramas grandes)
+        ruta_salida: archivo .npy de salida del modo por bloques
+        num_hilos: hilos del modo por bloques
+        metodo_blending: 'feathering' (pesos por distancia al borde),
+            'multibanda' (pirámides laplacianas, no disponible por bloques) o
+            'promedio' (promedio con lo ya fusionado, depende del orden)
+        niveles_blending: niveles de pirámide de la mezcla multibanda
+        ancho_feathering: tope de los pesos de distancia del feathering, en
+            píxeles (None = sin tope; por bloques, el tamaño de bloque)
     
     Returns:
         imagen fusionada
@@ -123,51 +936,240 @@ def fusionar_imagenes(imagenes, homografias):
     if len(imagenes) == 0:
         return None
     
+    if tam_bloque is not None:
+        return fusionar_imagenes_por_bloques(imagenes, homografias, ruta_salida, tam_bloque, num_hilos,
+                                             metodo_blending, ancho_feathering)
+    
     # Usar la primera imagen como referencia
     img_ref = imagenes[0]
-    h, w = img_ref.shape[:2]
+    T, ancho, alto, cajas = _limites_canvas(imagenes, homografias)
+    forma = (alto, ancho) + img_ref.shape[2:]
     
-    # Calcular dimensiones del canvas final
-    # Para simplicidad, usamos un canvas más grande
-    canvas_h = h * 2
-    canvas_w = w * 3
-    offset_x = w // 2
-    offset_y = h // 2
+    if metodo_blending in ['feathering', 'multibanda']:
+        ancho = ancho_feathering if metodo_blending == 'feathering' else None
+        capas = _capas_blending(imagenes, [np.eye(3)] + list(homografias), T, cajas, ancho)
+        if metodo_blending == 'feathering':
+            return mezclar_feathering(capas, forma, img_ref.dtype)
+        return mezclar_multibanda(list(capas), forma, img_ref.dtype, niveles_blending)
+    elif metodo_blending != 'promedio':
+        raise ValueError(f"Método de blending '{metodo_blending}' no reconocido")
     
     # Crear canvas
-    canvas = np.zeros((canvas_h, canvas_w), dtype=img_ref.dtype)
+    canvas = np.zeros(forma, dtype=img_ref.dtype)
     
-    # Colocar imagen de referencia en el centro
-    canvas[offset_y:offset_y+h, offset_x:offset_x+w] = img_ref
+    # Colocar imagen de referencia
+    x0, y0, x1, y1 = cajas[0]
+    canvas[y0:y1, x0:x1] = img_ref
     
     # Transformar y fusionar otras imágenes
-    for i, (img, H) in enumerate(zip(imagenes[1:], homografias)):
-        if H is not None:
-            # Ajustar homografía para el offset
-            H_offset = H.copy()
-            H_offset[0, 2] += offset_x
-            H_offset[1, 2] += offset_y
-            
-            # Transformar imagen
-            img_warped = cv2.warpPerspective(img, H_offset, (canvas_w, canvas_h))
-            
-            # Fusionar (promedio simple donde ambas tienen contenido)
-            mask = img_warped > 0
-            canvas[mask] = (canvas[mask].astype(float) + img_warped[mask].astype(float)) / 2
+    for img, H, caja in zip(imagenes[1:], homografias, cajas[1:]):
+        if H is None:
+            continue
+        x0, y0, x1, y1 = caja
+        if x1 <= x0 or y1 <= y0:
+            continue
+        
+        # Transformar solo la caja de la imagen, con la homografía trasladada
+        img_warped = cv2.warpPerspective(img, _homografia_caja(H, T, caja), (x1 - x0, y1 - y0))
+        region = canvas[y0:y1, x0:x1]
+        
+        # Fusionar (promedio simple donde ambas tienen contenido)
+        mask = img_warped > 0
+        region[mask] = (region[mask].astype(np.float32) + img_warped[mask]) / 2
     
     return canvas
 
 
-def aplicar_blending(img1, img2, alpha=0.5):
+def _capas_blending(imagenes, homografias, T, cajas, ancho=None):
+    """
+    Genera, para cada imagen, su versión transformada dentro de su caja del
+    canvas junto con sus pesos de distancia (con tope `ancho`) transformados igual.
+    """
+    for img, H, caja in zip(imagenes, homografias, cajas):
+        if H is None or caja[2] <= caja[0] or caja[3] <= caja[1]:
+            continue
+        x0, y0, x1, y1 = caja
+        H_caja = _homografia_caja(H, T, caja)
+        img_warped = cv2.warpPerspective(img, H_caja, (x1 - x0, y1 - y0))
+        peso = cv2.warpPerspective(pesos_distancia(mascara_valida(img), ancho), H_caja, (x1 - x0, y1 - y0))
+        yield img_warped, peso, caja
+
+
+def _ventana_fuente(H, forma_img, tam, margen):
+    """
+    Ventana (x0, y0, x1, y1) de la imagen fuente que se proyecta en un bloque
+    de tamaño `tam` con la homografía H (fuente -> bloque), ampliada en
+    `margen` píxeles y recortada a la imagen. Si el bloque cruza el horizonte
+    de la homografía se devuelve la imagen completa.
+    """
+    h, w = forma_img[:2]
+    esquinas = np.linalg.inv(H) @ np.array([[0, tam[0], tam[0], 0], [0, 0, tam[1], tam[1]],
+                                            [1, 1, 1, 1]], dtype=np.float64)
+    if np.any(esquinas[2] <= 0):
+        return 0, 0, w, h
+    puntos = esquinas[:2] / esquinas[2]
+    x0, y0 = np.floor(puntos.min(axis=1)).astype(int) - margen
+    x1, y1 = np.ceil(puntos.max(axis=1)).astype(int) + margen
+    return max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)
+
+
+def _componer_bloque(imagenes, transformaciones, cajas, bloque, forma, dtype, ancho=None):
+    """
+    Compone un bloque (x0, y0, x1, y1) del canvas con las imágenes cuya
+    caja lo intersecta, con la misma regla de fusión que `fusionar_imagenes`
+    (feathering con pesos de distancia de tope `ancho` si se indica, promedio si no).
+    
+    De cada imagen solo se usa la ventana que se proyecta en el bloque. Con el
+    tope, los pesos de la ventana ampliada en algo más de `ancho` píxeles son
+    los mismos que los de la imagen completa (la distancia que calcula
+    cv2.distanceTransform es al menos 0.955 veces la distancia en píxeles).
+    """
+    x0, y0, x1, y1 = bloque
+    tam = (x1 - x0, y1 - y0)
+    desplazamiento = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+    intersectan = [i for i, c in enumerate(cajas)
+                   if c is not None and c[0] < x1 and c[2] > x0 and c[1] < y1 and c[3] > y0]
+    margen = 2 if ancho is None else int(np.ceil(ancho / 0.955)) + 2
+    
+    def ventanas():
+        for i in intersectan:
+            img, H = imagenes[i], desplazamiento @ transformaciones[i]
+            vx0, vy0, vx1, vy1 = _ventana_fuente(H, img.shape, tam, margen)
+            if vx1 <= vx0 or vy1 <= vy0:
+                continue
+            h, w = img.shape[:2]
+            bordes = (vy0 == 0, vy1 == h, vx0 == 0, vx1 == w)
+            H_ventana = H @ np.array([[1, 0, vx0], [0, 1, vy0], [0, 0, 1]], dtype=np.float64)
+            yield i, np.asarray(img[vy0:vy1, vx0:vx1]), H_ventana, bordes
+    
+    if ancho is not None:
+        capas = ((cv2.warpPerspective(ventana, H, tam),
+                  cv2.warpPerspective(pesos_distancia(mascara_valida(ventana), ancho, bordes), H, tam),
+                  (0, 0) + tam)
+                 for _, ventana, H, bordes in ventanas())
+        return mezclar_feathering(capas, (tam[1], tam[0]) + forma, dtype)
+    
+    resultado = np.zeros((tam[1], tam[0]) + forma, dtype=dtype)
+    for i, ventana, H, _ in ventanas():
+        warped = cv2.warpPerspective(ventana, H, tam)
+        if i == 0:
+            # La referencia se copia (su transformación es una traslación entera)
+            mask = cv2.warpPerspective(np.ones(ventana.shape[:2], np.uint8), H, tam) > 0
+            resultado[mask] = warped[mask]
+        else:
+            mask = warped > 0
+            resultado[mask] = (resultado[mask].astype(np.float32) + warped[mask]) / 2
+    
+    return resultado
+
+
+def fusionar_imagenes_por_bloques(imagenes, homografias, ruta_salida=None, tam_bloque=1024,
+                                  num_hilos=None, metodo_blending='feathering', ancho_feathering=None):
     """
-    Aplica blending simple entre dos imágenes.
+    Fusiona múltiples imágenes escribiendo el resultado bloque a bloque en un
+    array en disco (np.memmap en formato .npy), de modo que la memoria
+    necesaria depende del tamaño de bloque y no del tamaño del panorama.
+    
+    Para cada bloque solo se transforma la ventana de cada imagen que lo
+    intersecta, y los pesos del feathering se calculan sobre esa ventana. Para
+    ello los pesos tienen un tope (`ancho_feathering`, por defecto el tamaño
+    de bloque): el resultado es el mismo que el de `fusionar_imagenes` con el
+    mismo método de blending y el mismo `ancho_feathering`.
+    
+    Args:
+        imagenes: lista de imágenes a fusionar (pueden ser np.memmap)
+        homografias: lista de homografías (desde cada imagen a la referencia)
+        ruta_salida: archivo .npy de salida (None = archivo temporal anónimo,
+            que se borra al liberar el resultado)
+        tam_bloque: lado de los bloques del canvas en píxeles
+        num_hilos: número de hilos para procesar bloques (None = número de CPUs)
+        metodo_blending: 'feathering' o 'promedio' (la mezcla multibanda
+            necesita el canvas completo)
+        ancho_feathering: tope de los pesos de distancia en píxeles
+            (None = tam_bloque)
+    
+    Returns:
+        imagen fusionada como np.memmap (se lee con np.load(ruta, mmap_mode='r'))
+    """
+    if len(imagenes) == 0:
+        return None
+    
+    if metodo_blending not in ['feathering', 'promedio']:
+        raise ValueError(f"Método de blending '{metodo_blending}' no disponible por bloques")
+    
+    img_ref = imagenes[0]
+    T, ancho, alto, cajas = _limites_canvas(imagenes, homografias)
+    transformaciones = [T] + [None if H is None else T @ H for H in homografias]
+    
+    ancho_pesos = None
+    if metodo_blending == 'feathering':
+        ancho_pesos = tam_bloque if ancho_feathering is None else ancho_feathering
+    
+    forma = (alto, ancho) + img_ref.shape[2:]
+    if ruta_salida is None:
+        # Archivo sin nombre: el sistema lo borra al cerrarse el último mapeo
+        with tempfile.TemporaryFile() as archivo:
+            canvas = np.memmap(archivo, dtype=img_ref.dtype, mode='w+', shape=forma)
+    else:
+        canvas = np.lib.format.open_memmap(ruta_salida, mode='w+', dtype=img_ref.dtype, shape=forma)
+    
+    bloques = [(x0, y0, min(x0 + tam_bloque, ancho), min(y0 + tam_bloque, alto))
+               for y0 in range(0, alto, tam_bloque) for x0 in range(0, ancho, tam_bloque)]
+    
+    def procesar(bloque):
+        x0, y0, x1, y1 = bloque
+        canvas[y0:y1, x0:x1] = _componer_bloque(imagenes, transformaciones, cajas, bloque,
+                                                img_ref.shape[2:], img_ref.dtype, ancho_pesos)
+    
+    # Los bloques son disjuntos, así que los hilos escriben en zonas distintas
+    num_hilos = num_hilos or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=min(num_hilos, len(bloques))) as ejecutor:
+        list(ejecutor.map(procesar, bloques))
+    
+    canvas.flush()
+    return canvas
+
+
+def aplicar_blending(img1, img2, alpha=0.5, metodo='alpha', mascaras=None, niveles=5):
+    """
+    Aplica blending entre dos imágenes alineadas del mismo tamaño.
     
     Args:
         img1: primera imagen
         img2: segunda imagen
-        alpha: peso de la primera imagen (0-1)
+        alpha: peso de la primera imagen (0-1), solo para metodo='alpha'
+        metodo: 'alpha' (peso fijo), 'feathering' (pesos por distancia al
+            borde de cada imagen) o 'multibanda' (pirámides laplacianas)
+        mascaras: (mascara1, mascara2) con los píxeles válidos de cada
+            imagen (None = píxeles distintos de cero)
+        niveles: niveles de pirámide de la mezcla multibanda
     
     Returns:
         imagen blended
     """
-    return cv2.addWeighted(img1, alpha, img2, 1-alpha, 0)
+    if metodo == 'alpha':
+        return cv2.addWeighted(img1, alpha, img2, 1-alpha, 0)
+    
+    if mascaras is None:
+        mascaras = (mascara_valida(img1), mascara_valida(img2))
+    h, w = img1.shape[:2]
+    capas = [(img, pesos_distancia(np.asarray(m, np.uint8)), (0, 0, w, h))
+             for img, m in zip((img1, img2), mascaras)]
+    
+    if metodo == 'feathering':
+        return mezclar_feathering(capas, img1.shape, img1.dtype)
+    elif metodo == 'multibanda':
+        return mezclar_multibanda(capas, img1.shape, img1.dtype, niveles)
+    else:
+        raise ValueError(f"Método de blending '{metodo}' no reconocido")
+
+
+if __name__ == '__main__':
+    import sys
+    
+    if len(sys.argv) < 2 or sys.argv[1] != 'batch':
+        print("Uso: python src/registration.py batch [opciones]  (ver 'batch --help')")
+        sys.exit(2)
+    
+    from lote import main
+    sys.exit(main(sys.argv[2:]))
@@ -0,0 +1,322 @@
+"""
+Módulo de registro incremental de secuencias de imágenes (vídeo).
+Mantiene el estado entre fotogramas: los puntos se siguen con flujo óptico
+piramidal (KLT) desde el último fotograma clave y la detección y el
+emparejamiento completos solo se repiten cuando la calidad del seguimiento
+cae por debajo de un umbral.
+"""
+
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+from feature_detection import detectar_caracteristicas
+from matching import emparejamiento_guiado, emparejar_caracteristicas, filtrar_matches_ransac
+from panorama import cargar_imagen_gris
+
+
+class RegistradorSecuencia:
+    """
+    Registro fotograma a fotograma de una secuencia contra su primer fotograma.
+    
+    Cada fotograma se registra contra el fotograma clave vigente siguiendo
+    con KLT las esquinas detectadas en él, y la homografía al fotograma de
+    referencia se obtiene componiendo con la del fotograma clave. La
+    predicción inicial de cada fotograma (movimiento constante a partir de
+    los dos anteriores) se usa como flujo inicial de KLT y como guía del
+    emparejamiento cuando hay que crear un nuevo fotograma clave.
+    
+    Uso típico:
+        reg = RegistradorSecuencia('orb')
+        for frame in frames:
+            H, info = reg.procesar(frame)
+    """
+    
+    def __init__(self, metodo='orb', max_features=1000, min_inliers=30, fraccion_min=0.5,
+                 max_puntos=300, distancia_min=10, reproj_thresh=3.0, tam_ventana=15,
+                 niveles_piramide=3, umbral_fb=1.0, radio_guiado=16.0, ventana_latencia=100):
+        """
+        Inicializa el registrador.
+        
+        Args:
+            metodo: 'orb', 'sift', 'akaze' (detector de los fotogramas clave)
+            max_features: número máximo de características por fotograma clave
+            min_inliers: inliers mínimos del seguimiento; por debajo se crea
+                un nuevo fotograma clave
+            fraccion_min: fracción mínima de los puntos del fotograma clave
+                que deben seguir siendo inliers
+            max_puntos: número máximo de esquinas seguidas con KLT
+            distancia_min: distancia mínima entre esquinas seguidas (píxeles)
+            reproj_thresh: umbral de RANSAC (píxeles)
+            tam_ventana: tamaño de la ventana de KLT
+            niveles_piramide: niveles de la pirámide de KLT
+            umbral_fb: error máximo ida-vuelta de KLT (None = sin comprobación)
+            radio_guiado: radio del emparejamiento guiado al crear un
+                fotograma clave
+            ventana_latencia: número de fotogramas recientes usados en las
+                estadísticas de latencia
+        """
+        self.metodo = metodo
+        self.max_features = max_features
+        self.min_inliers = min_inliers
+        self.fraccion_min = fraccion_min
+        self.max_puntos = max_puntos
+        self.distancia_min = distancia_min
+        self.reproj_thresh = reproj_thresh
+        self.umbral_fb = umbral_fb
+        self.radio_guiado = radio_guiado
+        self.params_klt = dict(
+            winSize=(tam_ventana, tam_ventana),
+            maxLevel=niveles_piramide,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+        )
+        
+        self.num_frames = 0
+        self.num_clave = 0
+        self.num_perdidos = 0
+        self._latencias = deque(maxlen=ventana_latencia)
+        self.reiniciar()
+    
+    def reiniciar(self):
+        """
+        Descarta el estado de seguimiento (el siguiente fotograma pasa a ser
+        la nueva referencia).
+        """
+        self._clave = None          # dict: imagen, kp, des, puntos, H (clave -> referencia)
+        self._anterior = None       # fotograma anterior en gris
+        self._puntos_anterior = None
+        self._indices = None        # índice en el fotograma clave de cada punto seguido
+        self._G = None              # homografías anterior y penúltima (fotograma -> clave)
+        self._G_previa = None
+        self._perdido = False
+    
+    def _prediccion(self):
+        """
+        Homografía predicha del fotograma actual al fotograma clave,
+        suponiendo que se repite el último movimiento entre fotogramas.
+        """
+        if self._G is None:
+            return np.eye(3)
+        if self._G_previa is None:
+            return self._G
+        G = self._G @ np.linalg.inv(self._G_previa) @ self._G
+        return G / G[2, 2]
+    
+    def _nuevo_clave(self, gris, H, kp, des):
+        # Los descriptores sirven para reanclar; para KLT se usan esquinas
+        # de Shi-Tomasi repartidas por la imagen (menos puntos, más estables)
+        esquinas = cv2.goodFeaturesToTrack(gris, self.max_puntos, 0.01, self.distancia_min)
+        puntos = np.empty((0, 2), np.float32) if esquinas is None else esquinas.reshape(-1, 2)
+        self._clave = {'imagen': gris, 'kp': kp, 'des': des, 'puntos': puntos, 'H': H}
+        self._anterior = gris
+        self._puntos_anterior = puntos
+        self._indices = np.arange(len(puntos))
+        self._G = np.eye(3)
+        self._G_previa = None
+        self._perdido = False
+        self.num_clave += 1
+    
+    def _seguir(self, gris, G_pred):
+        """
+        Sigue los puntos del fotograma anterior en el actual con KLT y estima
+        la homografía al fotograma clave.
+        
+        Returns:
+            (G, num_inliers) o (None, 0) si el seguimiento falla
+        """
+        if self._puntos_anterior is None or len(self._puntos_anterior) < 4:
+            return None, 0
+        
+        # Flujo inicial: posiciones predichas a partir del movimiento anterior
+        puntos_clave = self._clave['puntos'][self._indices]
+        iniciales = cv2.perspectiveTransform(puntos_clave.reshape(-1, 1, 2),
+                                             np.linalg.inv(G_pred)).astype(np.float32)
+        anteriores = self._puntos_anterior.reshape(-1, 1, 2)
+        actuales, estado, _ = cv2.calcOpticalFlowPyrLK(
+            self._anterior, gris, anteriores, iniciales,
+            flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **self.params_klt
+        )
+        validos = estado.ravel() == 1
+        
+        if self.umbral_fb is not None and np.any(validos):
+            # Comprobación ida-vuelta: el punto debe volver a su posición
+            vuelta, estado_vuelta, _ = cv2.calcOpticalFlowPyrLK(
+                gris, self._anterior, actuales, anteriores.copy(),
+                flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **self.params_klt
+            )
+            error_fb = np.linalg.norm((vuelta - anteriores).reshape(-1, 2), axis=1)
+            validos &= (estado_vuelta.ravel() == 1) & (error_fb < self.umbral_fb)
+        
+        if np.count_nonzero(validos) < 4:
+            return None, 0
+        
+        actuales = actuales.reshape(-1, 2)[validos]
+        indices = self._indices[validos]
+        G, mask = cv2.findHomography(actuales, self._clave['puntos'][indices], cv2.RANSAC,
+                                     self.reproj_thresh)
+        if G is None:
+            return None, 0
+        
+        # Solo se siguen manteniendo los inliers
+        inliers = mask.ravel().astype(bool)
+        self._puntos_anterior = actuales[inliers]
+        self._indices = indices[inliers]
+        return G, int(np.count_nonzero(inliers))
+    
+    def _reanclar(self, gris, G_pred):
+        """
+        Detecta características en el fotograma actual y las empareja con el
+        fotograma clave: primero guiado por la predicción y, si no basta,
+        con el emparejamiento completo.
+        
+        Returns:
+            (G, num_inliers, kp, des, modo)
+        """
+        kp, des = detectar_caracteristicas(gris, self.metodo, self.max_features, compacto=True)
+        if des is None or self._clave['des'] is None:
+            return None, 0, kp, des, None
+        
+        # Emparejamiento guiado (arranque en caliente desde la predicción)
+        _, G, mask = emparejamiento_guiado(self._clave['kp'], self._clave['des'], kp, des, G_pred,
+                                           self.metodo, self.radio_guiado,
+                                           reproj_thresh=self.reproj_thresh)
+        inliers = 0 if mask is None else int(np.count_nonzero(mask))
+        if inliers >= self.min_inliers:
+            return G, inliers, kp, des, 'guiado'
+        
+        matches = emparejar_caracteristicas(self._clave['des'], des, self.metodo, compacto=True)
+        if len(matches) < 4:
+            return None, 0, kp, des, None
+        G, mask = filtrar_matches_ransac(self._clave['kp'], kp, matches, self.reproj_thresh)
+        inliers = 0 if mask is None else int(np.count_nonzero(mask))
+        if G is None or inliers < self.min_inliers:
+            return None, inliers, kp, des, None
+        return G, inliers, kp, des, 'completo'
+    
+    def _afinar(self, gris, G):
+        """
+        Afina la homografía de un reanclaje siguiendo con KLT las esquinas del
+        fotograma clave directamente en el fotograma actual, partiendo de las
+        posiciones que predice G.
+        """
+        puntos = self._clave['puntos'].reshape(-1, 1, 2)
+        if len(puntos) < 4:
+            return G
+        iniciales = cv2.perspectiveTransform(puntos, np.linalg.inv(G)).astype(np.float32)
+        actuales, estado, _ = cv2.calcOpticalFlowPyrLK(
+            self._clave['imagen'], gris, puntos, iniciales,
+            flags=cv2.OPTFLOW_USE_INITIAL_FLOW, **self.params_klt
+        )
+        validos = estado.ravel() == 1
+        if np.count_nonzero(validos) < self.min_inliers:
+            return G
+        G_afinada, mask = cv2.findHomography(actuales.reshape(-1, 2)[validos],
+                                             puntos.reshape(-1, 2)[validos], cv2.RANSAC,
+                                             self.reproj_thresh)
+        if G_afinada is None or np.count_nonzero(mask) < self.min_inliers:
+            return G
+        return G_afinada
+    
+    def procesar(self, frame):
+        """
+        Registra el siguiente fotograma de la secuencia.
+        
+        Args:
+            frame: fotograma (gris, BGR o ruta)
+        
+        Returns:
+            (H, info): homografía del fotograma al fotograma de referencia
+            (None si se ha perdido el seguimiento) y diccionario con el tipo
+            de paso ('referencia', 'seguimiento', 'clave' o 'perdido'),
+            número de puntos e inliers, tiempo y estadísticas de latencia
+        """
+        t0 = time.perf_counter()
+        gris = cargar_imagen_gris(frame)
+        indice = self.num_frames
+        self.num_frames += 1
+        info = {'indice': indice, 'modo_emparejamiento': None}
+        
+        if self._clave is None:
+            kp, des = detectar_caracteristicas(gris, self.metodo, self.max_features, compacto=True)
+            H = np.eye(3)
+            self._nuevo_clave(gris, H, kp, des)
+            info.update(tipo='referencia', num_puntos=len(self._clave['puntos']), num_inliers=0)
+            return self._terminar(H, info, t0)
+        
+        G_pred = self._prediccion()
+        G, inliers = (None, 0) if self._perdido else self._seguir(gris, G_pred)
+        
+        fraccion = inliers / max(len(self._clave['puntos']), 1)
+        if G is not None and inliers >= self.min_inliers and fraccion >= self.fraccion_min:
+            self._G_previa, self._G = self._G, G
+            self._anterior = gris
+            H = self._clave['H'] @ G
+            info.update(tipo='seguimiento', num_puntos=len(self._indices), num_inliers=inliers)
+            return self._terminar(H / H[2, 2], info, t0)
+        
+        if G is not None and inliers >= self.min_inliers:
+            # El seguimiento aún es fiable pero quedan pocos puntos: se toma
+            # su homografía y solo se vuelven a detectar puntos
+            kp, des = detectar_caracteristicas(gris, self.metodo, self.max_features, compacto=True)
+            modo = 'seguimiento'
+        else:
+            # El seguimiento ha fallado: detección y emparejamiento con el fotograma clave
+            G, inliers, kp, des, modo = self._reanclar(gris, G_pred)
+            if G is not None:
+                G = self._afinar(gris, G)
+        
+        info['modo_emparejamiento'] = modo
+        if G is None:
+            self._perdido = True
+            self.num_perdidos += 1
+            info.update(tipo='perdido', num_puntos=0, num_inliers=inliers)
+            return self._terminar(None, info, t0)
+        
+        H = self._clave['H'] @ G
+        H = H / H[2, 2]
+        self._nuevo_clave(gris, H, kp, des)
+        info.update(tipo='clave', num_puntos=len(self._clave['puntos']), num_inliers=inliers)
+        return self._terminar(H, info, t0)
+    
+    def _terminar(self, H, info, t0):
+        info['tiempo_s'] = time.perf_counter() - t0
+        self._latencias.append(info['tiempo_s'])
+        info['latencia'] = self.estadisticas_latencia()
+        return H, info
+    
+    def estadisticas_latencia(self):
+        """
+        Estadísticas de latencia de los fotogramas recientes.
+        
+        Returns:
+            diccionario con media, mediana, p95 y máximo (en ms) y fotogramas
+            por segundo equivalentes
+        """
+        if not self._latencias:
+            return None
+        ms = np.asarray(self._latencias) * 1000
+        return {
+            'media_ms': float(ms.mean()),
+            'mediana_ms': float(np.median(ms)),
+            'p95_ms': float(np.percentile(ms, 95)),
+            'max_ms': float(ms.max()),
+            'fps': float(1000 / ms.mean()) if ms.mean() > 0 else float('inf')
+        }
+
+
+def registrar_secuencia(frames, **kwargs):
+    """
+    Registra incrementalmente una secuencia de fotogramas contra el primero.
+    
+    Args:
+        frames: iterable o generador de fotogramas (arrays o rutas)
+        **kwargs: parámetros de RegistradorSecuencia
+    
+    Yields:
+        (H, info) por fotograma, según se procesan (ver
+        `RegistradorSecuencia.procesar`)
+    """
+    registrador = RegistradorSecuencia(**kwargs)
+    for frame in frames:
+        yield registrador.procesar(frame)
@@ -3,6 +3,9 @@ Utilidades generales para el proyecto de registro de imágenes.
 Basado en los notebooks guía del curso de Visión por Computador.
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import cv2
 import matplotlib.pyplot as plt
@@ -52,40 +55,37 @@ def crear_imagen_sintetica(size=256, tipo='patron'):
     return imagen
 
 
-def aplicar_transformacion(imagen, tipo, params):
+def matriz_transformacion(tipo, params, forma):
     """
-    Aplica una transformación geométrica a una imagen.
+    Construye la matriz 2x3 de una transformación geométrica.
     
     Args:
-        imagen: imagen de entrada
         tipo: 'traslacion', 'rotacion', 'rigida', 'afin'
         params: diccionario con parámetros de la transformación
+        forma: forma de la imagen (las rotaciones son respecto a su centro)
     
     Returns:
-        (imagen_transformada, matriz_transformacion)
+        matriz de transformación 2x3
     """
-    h, w = imagen.shape[:2]
+    h, w = forma[:2]
     center = (w / 2, h / 2)
     
     if tipo == 'traslacion':
         tx = params.get('tx', 0)
         ty = params.get('ty', 0)
         M = np.float32([[1, 0, tx], [0, 1, ty]])
-        imagen_trans = cv2.warpAffine(imagen, M, (w, h))
         
     elif tipo == 'rotacion':
         angulo = params.get('angulo', 0)
-        M = cv2.getRotationMatrix2D(center, angulo, 1.0)
-        imagen_trans = cv2.warpAffine(imagen, M, (w, h))
+        M = cv2.getRotationMatrix2D(center, float(angulo), 1.0)
         
     elif tipo == 'rigida':
         angulo = params.get('angulo', 0)
         tx = params.get('tx', 0)
         ty = params.get('ty', 0)
-        M = cv2.getRotationMatrix2D(center, angulo, 1.0)
+        M = cv2.getRotationMatrix2D(center, float(angulo), 1.0)
         M[0, 2] += tx
         M[1, 2] += ty
-        imagen_trans = cv2.warpAffine(imagen, M, (w, h))
         
     elif tipo == 'afin':
         angulo = params.get('angulo', 0)
@@ -94,18 +94,90 @@ def aplicar_transformacion(imagen, tipo, params):
         ty = params.get('ty', 0)
         shear = params.get('shear', 0)
         
-        M = cv2.getRotationMatrix2D(center, angulo, escala)
+        M = cv2.getRotationMatrix2D(center, float(angulo), float(escala))
         M[0, 2] += tx
         M[1, 2] += ty
         M[0, 1] += shear
-        imagen_trans = cv2.warpAffine(imagen, M, (w, h))
     
     else:
         raise ValueError(f"Tipo '{tipo}' no reconocido")
     
+    return M
+
+
+def aplicar_transformacion(imagen, tipo, params):
+    """
+    Aplica una transformación geométrica a una imagen.
+    
+    Args:
+        imagen: imagen de entrada
+        tipo: 'traslacion', 'rotacion', 'rigida', 'afin'
+        params: diccionario con parámetros de la transformación
+    
+    Returns:
+        (imagen_transformada, matriz_transformacion)
+    """
+    h, w = imagen.shape[:2]
+    M = matriz_transformacion(tipo, params, imagen.shape)
+    imagen_trans = cv2.warpAffine(imagen, M, (w, h))
     return imagen_trans, M
 
 
+def aplicar_transformaciones_lote(imagen, tipo=None, params=None, matrices=None, salida=None,
+                                  num_hilos=None):
+    """
+    Aplica una pila de transformaciones a la misma imagen de una vez.
+    
+    Cada transformación se escribe directamente en su posición de la pila
+    de salida (que puede reutilizarse entre llamadas) y el trabajo se
+    reparte en un pool de hilos (warpAffine libera el GIL).
+    
+    Args:
+        imagen: imagen de entrada
+        tipo: tipo de transformación (ver `matriz_transformacion`), si se
+            dan parámetros
+        params: lista de diccionarios de parámetros, o diccionario de arrays
+            que se combinan elemento a elemento (p. ej. {'angulo': angulos,
+            'tx': 5})
+        matrices: alternativa a tipo/params, array (N, 2, 3) de matrices
+        salida: array (N, alto, ancho[, canales]) ya reservado para escribir
+            el resultado (None = se reserva uno nuevo)
+        num_hilos: hilos del pool (None = número de CPUs)
+    
+    Returns:
+        (pila, matrices): imágenes transformadas (N, alto, ancho[, canales])
+        y matrices (N, 2, 3)
+    """
+    if matrices is None:
+        if tipo is None or params is None:
+            raise ValueError("Hay que indicar 'matrices' o 'tipo' y 'params'")
+        if isinstance(params, dict):
+            valores = np.broadcast_arrays(*[np.atleast_1d(v) for v in params.values()])
+            params = [dict(zip(params.keys(), fila)) for fila in zip(*valores)]
+        matrices = np.stack([matriz_transformacion(tipo, p, imagen.shape) for p in params])
+    matrices = np.asarray(matrices)
+    
+    h, w = imagen.shape[:2]
+    n = len(matrices)
+    if salida is None:
+        salida = np.empty((n,) + imagen.shape, dtype=imagen.dtype)
+    elif salida.shape != (n,) + imagen.shape or salida.dtype != imagen.dtype:
+        raise ValueError(f"La salida debe tener forma {(n,) + imagen.shape} y tipo {imagen.dtype}")
+    
+    def transformar(indices):
+        for k in indices:
+            cv2.warpAffine(imagen, matrices[k], (w, h), dst=salida[k])
+    
+    num_hilos = min(num_hilos or os.cpu_count() or 1, max(n, 1))
+    if num_hilos == 1:
+        transformar(range(n))
+    else:
+        with ThreadPoolExecutor(max_workers=num_hilos) as ejecutor:
+            list(ejecutor.map(transformar, np.array_split(np.arange(n), num_hilos)))
+    
+    return salida, matrices
+
+
 def calcular_similitud(img1, img2, metrica='mse'):
     """
     Calcula una métrica de similitud entre dos imágenes.
@@ -142,6 +214,182 @@ def calcular_similitud(img1, img2, metrica='mse'):
         raise ValueError(f"Métrica '{metrica}' no reconocida")
 
 
+class EvaluadorSimilitud:
+    """
+    Evaluador de similitud ligado a una imagen de referencia.
+    
+    Calcula las mismas métricas que `calcular_similitud`, pero guarda las
+    estadísticas de la referencia (media, desviación, versión normalizada y
+    cuantizada) y reutiliza buffers float32 reservados una sola vez, de modo
+    que comparar muchas imágenes contra la misma referencia (p. ej. en la
+    búsqueda exhaustiva) no reserva memoria en cada llamada.
+    
+    Uso típico:
+        evaluador = EvaluadorSimilitud(img_fija, 'ncc')
+        for img in candidatas:
+            valor = evaluador(img)
+    """
+    
+    def __init__(self, img_referencia, metrica='mse', bins=20):
+        """
+        Inicializa el evaluador.
+        
+        Args:
+            img_referencia: imagen de referencia (fija)
+            metrica: 'mse', 'ncc', 'mi'
+            bins: número de intervalos por imagen del histograma conjunto (MI)
+        """
+        if metrica not in ['mse', 'ncc', 'mi']:
+            raise ValueError(f"Métrica '{metrica}' no reconocida")
+        
+        self.metrica = metrica
+        self.bins = bins
+        self.forma = img_referencia.shape
+        
+        self._ref = np.array(img_referencia, dtype=np.float32).ravel()
+        self.n = self._ref.size
+        self.media = float(self._ref.mean(dtype=np.float64))
+        self.std = float(self._ref.std(dtype=np.float64))
+        self.minimo = float(self._ref.min())
+        self.maximo = float(self._ref.max())
+        
+        # Buffers de trabajo (se reservan una vez)
+        self._buffer = np.empty(self.n, dtype=np.float32)
+        self._producto = np.empty(self.n, dtype=np.float32)
+        self._auxiliar = None
+        self._peso = None
+        self._valido = None
+        self._invalido = None
+        
+        if metrica == 'ncc':
+            self._ref_norm = ((self._ref - self.media) / (self.std + 1e-8)).astype(np.float32)
+        elif metrica == 'mi':
+            self._indices = np.empty(self.n, dtype=np.intp)
+            self._indices_ref = np.empty(self.n, dtype=np.intp)
+            self._ref_bins = self._cuantizar(self._ref, self.minimo, self.maximo,
+                                             np.empty(self.n, dtype=np.intp),
+                                             np.empty(self.n, dtype=np.float32)) * bins
+    
+    def _cuantizar(self, valores, minimo, maximo, salida, trabajo):
+        """
+        Índice del intervalo de cada valor con intervalos uniformes en
+        [minimo, maximo] (como np.histogram2d), sin reservar memoria.
+        """
+        escala = self.bins / (maximo - minimo) if maximo > minimo else 0.0
+        np.subtract(valores, minimo, out=trabajo)
+        np.multiply(trabajo, escala, out=trabajo)
+        np.copyto(salida, trabajo, casting='unsafe')
+        if escala == 0.0:
+            salida.fill(self.bins // 2)
+        np.minimum(salida, self.bins - 1, out=salida)
+        return salida
+    
+    def _suma_producto(self, a, b):
+        """
+        sum(a * b) con suma por parejas de NumPy (más precisa en float32 que
+        np.dot) sobre el buffer de productos.
+        """
+        np.multiply(a, b, out=self._producto)
+        return float(self._producto.sum())
+    
+    def _preparar_mascara(self, mascara):
+        if self._peso is None:
+            self._peso = np.empty(self.n, dtype=np.float32)
+            self._valido = np.empty(self.n, dtype=bool)
+            self._invalido = np.empty(self.n, dtype=bool)
+        np.equal(np.asarray(mascara).reshape(-1), 0, out=self._invalido)
+        np.logical_not(self._invalido, out=self._valido)
+        np.copyto(self._peso, self._valido)
+        return int(np.count_nonzero(self._valido))
+    
+    def __call__(self, imagen, mascara=None):
+        """
+        Similitud entre la referencia y una imagen del mismo tamaño.
+        
+        Args:
+            imagen: imagen a comparar (p. ej. la imagen móvil transformada)
+            mascara: máscara opcional del mismo tamaño; si se indica, solo se
+                comparan los píxeles válidos (p. ej. el solapamiento real de
+                la imagen transformada) en lugar de la imagen completa
+        
+        Returns:
+            valor de similitud (mismo criterio que `calcular_similitud`)
+        """
+        if imagen.shape != self.forma:
+            raise ValueError(f"La imagen {imagen.shape} no tiene el tamaño de la referencia {self.forma}")
+        
+        m = self._buffer
+        np.copyto(m, np.asarray(imagen).reshape(-1), casting='unsafe')
+        
+        if mascara is None:
+            return self._completa(m)
+        
+        n = self._preparar_mascara(mascara)
+        if n == 0:
+            return float('nan')
+        return self._enmascarada(m, n)
+    
+    def _completa(self, m):
+        if self.metrica == 'mse':
+            np.subtract(m, self._ref, out=m)
+            return self._suma_producto(m, m) / self.n
+        
+        if self.metrica == 'ncc':
+            media_m = float(m.mean(dtype=np.float64))
+            np.subtract(m, media_m, out=m)
+            std_m = np.sqrt(self._suma_producto(m, m) / self.n)
+            cruzado = self._suma_producto(self._ref_norm, m) / self.n
+            return cruzado / (std_m + 1e-8)
+        
+        minimo, maximo = float(m.min()), float(m.max())
+        indices = self._cuantizar(m, minimo, maximo, self._indices, m)
+        np.add(indices, self._ref_bins, out=indices)
+        return self._informacion_mutua(np.bincount(indices, minlength=self.bins ** 2))
+    
+    def _enmascarada(self, m, n):
+        if self._auxiliar is None:
+            self._auxiliar = np.empty(self.n, dtype=np.float32)
+        peso, r = self._peso, self._auxiliar
+        
+        if self.metrica == 'mse':
+            np.subtract(m, self._ref, out=m)
+            np.multiply(m, peso, out=m)
+            return self._suma_producto(m, m) / n
+        
+        if self.metrica == 'ncc':
+            media_f = self._suma_producto(peso, self._ref) / n
+            media_m = self._suma_producto(peso, m) / n
+            np.subtract(self._ref, media_f, out=r)
+            np.multiply(r, peso, out=r)
+            np.subtract(m, media_m, out=m)
+            np.multiply(m, peso, out=m)
+            std_f = np.sqrt(self._suma_producto(r, r) / n)
+            std_m = np.sqrt(self._suma_producto(m, m) / n)
+            return self._suma_producto(r, m) / n / ((std_f + 1e-8) * (std_m + 1e-8))
+        
+        # MI: rangos de ambas imágenes sobre los píxeles válidos; los no
+        # válidos van a un intervalo extra que se descarta
+        valido = self._valido
+        indices_ref = self._cuantizar(self._ref,
+                                      float(np.min(self._ref, where=valido, initial=np.inf)),
+                                      float(np.max(self._ref, where=valido, initial=-np.inf)),
+                                      self._indices_ref, r)
+        indices = self._cuantizar(m, float(np.min(m, where=valido, initial=np.inf)),
+                                  float(np.max(m, where=valido, initial=-np.inf)), self._indices, m)
+        np.multiply(indices_ref, self.bins, out=indices_ref)
+        np.add(indices, indices_ref, out=indices)
+        np.copyto(indices, self.bins ** 2, where=self._invalido)
+        hist = np.bincount(indices, minlength=self.bins ** 2 + 1)[:self.bins ** 2]
+        return self._informacion_mutua(hist)
+    
+    def _informacion_mutua(self, hist):
+        pxy = hist.reshape(self.bins, self.bins) / float(hist.sum())
+        px = pxy.sum(axis=1)
+        py = pxy.sum(axis=0)
+        nzs = pxy > 0
+        return float(np.sum(pxy[nzs] * np.log(pxy[nzs] / (px[:, None] * py[None, :])[nzs])))
+
+
 def visualizar_resultados(img_fija, img_movil, img_registrada, titulo='Registro de Imágenes'):
     """
     Visualiza el proceso de registro paso a paso.
@@ -217,17 +465,93 @@ def calcular_error_transformacion(M_real, M_estimada):
     }
 
 
-def anadir_ruido_gaussiano(imagen, sigma=10):
+def matriz_homogenea(M):
+    """
+    Convierte una matriz (o pila de matrices) 2x3 en 3x3 homogénea.
+    """
+    M = np.asarray(M, dtype=np.float64)
+    if M.shape[-2] == 3:
+        return M
+    ultima = np.broadcast_to(np.array([0.0, 0.0, 1.0]), M.shape[:-2] + (1, 3))
+    return np.concatenate([M, ultima], axis=-2)
+
+
+def calcular_errores_transformacion(M_real, M_estimada, forma=None):
+    """
+    Versión vectorizada de `calcular_error_transformacion` para pilas de
+    matrices (N, 2, 3) o (N, 3, 3), con el error de reproyección de las
+    esquinas de la imagen.
+    
+    Args:
+        M_real: matriz o pila de matrices reales
+        M_estimada: matriz o pila de matrices estimadas (NaN = fallo)
+        forma: forma de la imagen (alto, ancho) para el error de esquinas
+    
+    Returns:
+        diccionario de arrays (N,) con tx_error, ty_error, rmse y, si se da
+        la forma, error_esquinas (media en píxeles) y error_esquinas_max
+    """
+    afines = np.shape(M_real)[-2] == 2 and np.shape(M_estimada)[-2] == 2
+    real = matriz_homogenea(M_real).reshape(-1, 3, 3)
+    estimada = matriz_homogenea(M_estimada).reshape(-1, 3, 3)
+    
+    # Como en calcular_error_transformacion: si ambas son afines, el RMSE
+    # es sobre los 6 coeficientes; si alguna es 3x3, sobre los 9
+    filas = 2 if afines else 3
+    errores = {
+        'tx_error': np.abs(real[:, 0, 2] - estimada[:, 0, 2]),
+        'ty_error': np.abs(real[:, 1, 2] - estimada[:, 1, 2]),
+        'rmse': np.sqrt(np.mean((real[:, :filas] - estimada[:, :filas]) ** 2, axis=(1, 2)))
+    }
+    
+    if forma is not None:
+        h, w = forma[:2]
+        esquinas = np.array([[0, 0, 1], [w, 0, 1], [w, h, 1], [0, h, 1]], dtype=np.float64)
+        p_real = np.einsum('nij,kj->nki', real, esquinas)
+        p_est = np.einsum('nij,kj->nki', estimada, esquinas)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distancias = np.linalg.norm(p_real[..., :2] / p_real[..., 2:] -
+                                        p_est[..., :2] / p_est[..., 2:], axis=2)
+        errores['error_esquinas'] = distancias.mean(axis=1)
+        errores['error_esquinas_max'] = distancias.max(axis=1)
+    
+    return errores
+
+
+def anadir_ruido_gaussiano(imagen, sigma=10, rng=None, salida=None, trabajo=None):
     """
     Añade ruido gaussiano a una imagen.
     
+    Con un generador o una semilla, el ruido se genera en float32 con un
+    np.random.Generator y se suma en el propio buffer de trabajo, sin pasar
+    por float64. Sin ellos se usa el estado global de np.random como antes,
+    de modo que np.random.seed sigue haciendo reproducible el resultado.
+    
     Args:
-        imagen: imagen de entrada
+        imagen: imagen de entrada (uint8)
         sigma: desviación estándar del ruido
+        rng: np.random.Generator o semilla (None = estado global de np.random)
+        salida: array uint8 opcional donde escribir el resultado
+        trabajo: buffer float32 opcional de la forma de la imagen, para no
+            reservarlo en cada llamada
     
     Returns:
         imagen con ruido
     """
-    ruido = np.random.normal(0, sigma, imagen.shape)
-    imagen_ruidosa = np.clip(imagen + ruido, 0, 255).astype(np.uint8)
-    return imagen_ruidosa
+    if salida is None:
+        salida = np.empty(imagen.shape, dtype=np.uint8)
+    
+    if rng is None:
+        ruido = np.random.normal(0, sigma, imagen.shape)
+        np.copyto(salida, np.clip(imagen + ruido, 0, 255), casting='unsafe')
+        return salida
+    
+    rng = np.random.default_rng(rng)
+    if trabajo is None:
+        trabajo = np.empty(imagen.shape, dtype=np.float32)
+    rng.standard_normal(out=trabajo, dtype=np.float32)
+    trabajo *= sigma
+    trabajo += imagen
+    np.clip(trabajo, 0, 255, out=trabajo)
+    np.copyto(salida, trabajo, casting='unsafe')
+    return salida
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from base_datos_imagenes import BaseDatosImagenes
+from dataset_sintetico import generar_caso
+from feature_detection import detectar_caracteristicas
+
+
+def _casos():
+    # Las imágenes base y una versión transformada de cada una
+    return [generar_caso(k, 0, 256, (tipo,), ('rigida',), (5,))
+            for k, tipo in enumerate(('patron', 'texto', 'circulo'))]
+
+
+@pytest.mark.parametrize('metodo', ['orb', 'akaze', 'sift'])
+def test_consulta_recupera_la_imagen_original(metodo):
+    casos = _casos()
+    bd = BaseDatosImagenes(metodo, num_palabras=100)
+    for k, (fija, _, _, _, _) in enumerate(casos):
+        bd.agregar_imagen(k, fija, 500)
+    # Una imagen sin características no rompe la base de datos
+    bd.agregar(len(casos), None)
+    bd.construir_vocabulario()
+    
+    for k, (_, movil, _, _, _) in enumerate(casos[:2]):
+        _, descriptores = detectar_caracteristicas(movil, metodo, 500)
+        assert bd.consultar(descriptores, k=1)[0][0] == k
+
+
+@pytest.mark.parametrize('metodo, ancho, tipo', [('orb', 32, np.uint8), ('akaze', 61, np.uint8),
+                                                 ('sift', 128, np.float32)])
+def test_descriptores_vacios_segun_el_metodo(metodo, ancho, tipo):
+    bd = BaseDatosImagenes(metodo)
+    bd.agregar('vacia', None)
+    
+    assert bd._descriptores[0].shape == (0, ancho)
+    assert bd._descriptores[0].dtype == tipo
+
+
+def test_consulta_sin_descriptores():
+    casos = _casos()
+    bd = BaseDatosImagenes('sift', num_palabras=50)
+    for k, (fija, _, _, _, _) in enumerate(casos):
+        bd.agregar_imagen(k, fija, 300)
+    bd.construir_vocabulario()
+    
+    assert all(puntuacion == 0 for _, puntuacion in bd.consultar(None))
@@ -0,0 +1,63 @@
+import copy
+
+from benchmark import (ETAPAS, cargar_historial, comparar_benchmarks, ejecutar_benchmark,
+                       guardar_benchmark, main, medir_etapa)
+
+
+def _ejecucion(fecha='2026-01-01T10:00:00'):
+    filas = [
+        {'etapa': 'deteccion', 'entrada': 'a', 'resolucion': '256x256', 'mediana_ms': 10.0,
+         'p95_ms': 12.0, 'pico_rss_mb': 20.0},
+        {'etapa': 'ransac', 'entrada': 'a', 'resolucion': '256x256', 'mediana_ms': 0.2,
+         'p95_ms': 0.3, 'pico_rss_mb': 1.0},
+        {'etapa': 'fusion', 'entrada': 'a', 'resolucion': '256x256', 'mediana_ms': 50.0,
+         'p95_ms': 60.0, 'pico_rss_mb': 40.0},
+    ]
+    return {'fecha': fecha, 'entorno': {'python': '3'}, 'resultados': filas}
+
+
+def test_medir_etapa():
+    llamadas = []
+    resultado, tiempos, picos = medir_etapa(lambda: llamadas.append(1) or len(llamadas), 3, 2)
+    
+    assert resultado == 5 and len(tiempos) == 3
+    assert all(pico >= 0 for pico in picos)
+
+
+def test_comparar_marca_regresiones_y_mejoras():
+    base = _ejecucion()
+    nuevo = copy.deepcopy(base)
+    nuevo['resultados'][0]['mediana_ms'] = 13.0      # +30 %: regresión
+    nuevo['resultados'][1]['mediana_ms'] = 0.4       # +100 % pero < min_ms: ruido
+    nuevo['resultados'][2]['mediana_ms'] = 30.0      # -40 %: mejora
+    nuevo['resultados'][2]['pico_rss_mb'] = 80.0     # y el doble de memoria
+    nuevo['resultados'].append({**base['resultados'][0], 'entrada': 'b'})
+    
+    tabla = comparar_benchmarks(base, nuevo).set_index(['etapa', 'entrada'])['estado']
+    assert tabla[('deteccion', 'a')] == 'regresion'
+    assert tabla[('ransac', 'a')] == 'igual'
+    assert tabla[('fusion', 'a')] == 'regresion_memoria'
+    assert tabla[('deteccion', 'b')] == 'nueva'
+
+
+def test_historial_y_linea_de_comandos(tmp_path, capsys):
+    base = _ejecucion()
+    nuevo = _ejecucion('2026-01-02T10:00:00')
+    rutas = [guardar_benchmark(e, str(tmp_path)) for e in (base, nuevo)]
+    assert cargar_historial(str(tmp_path)) == rutas
+    
+    assert main(['compare', '--historial', str(tmp_path)]) == 0
+    nuevo['resultados'][0]['mediana_ms'] = 30.0
+    guardar_benchmark({**nuevo, 'fecha': '2026-01-03T10:00:00'}, str(tmp_path))
+    assert main(['compare', '--historial', str(tmp_path)]) == 1
+    assert '✗' in capsys.readouterr().out
+
+
+def test_benchmark_sintetico_mide_todas_las_etapas():
+    ejecucion = ejecutar_benchmark(None, tamanos_sinteticos=(256,), repeticiones=1, calentamiento=0,
+                                   verbose=False)
+    
+    assert [fila['etapa'] for fila in ejecucion['resultados']] == list(ETAPAS)
+    assert all(fila['resolucion'] == '256x256' for fila in ejecucion['resultados'])
+    # Se compara consigo misma sin regresiones
+    assert (comparar_benchmarks(ejecucion, ejecucion)['estado'] == 'igual').all()
@@ -0,0 +1,51 @@
+import numpy as np
+from blending import mascara_valida, mezclar_feathering, mezclar_multibanda, pesos_distancia
+
+
+def _capa(valor, caja):
+    x0, y0, x1, y1 = caja
+    imagen = np.full((y1 - y0, x1 - x0), valor, np.uint8)
+    return imagen, pesos_distancia(mascara_valida(imagen)), caja
+
+
+def test_multibanda_no_oscurece_los_bordes():
+    # Dos imágenes del mismo gris que se solapan: el resultado es uniforme
+    capas = [_capa(150, (0, 0, 120, 100)), _capa(150, (80, 20, 200, 128))]
+    resultado = mezclar_multibanda(capas, (128, 200), niveles=5)
+    
+    cubierto = np.zeros((128, 200), bool)
+    cubierto[0:100, 0:120] = cubierto[20:128, 80:200] = True
+    assert np.abs(resultado[cubierto].astype(int) - 150).max() <= 1
+    assert not resultado[~cubierto].any()
+
+
+def test_multibanda_empates_para_la_imagen_de_menor_indice():
+    # Mismas cajas y mismos pesos: la costura asigna todo a la primera imagen
+    capas = [_capa(100, (0, 0, 64, 64)), _capa(200, (0, 0, 64, 64))]
+    np.testing.assert_array_equal(mezclar_multibanda(capas, (64, 64), niveles=4), 100)
+    np.testing.assert_array_equal(mezclar_multibanda(capas[::-1], (64, 64), niveles=4), 200)
+
+
+def test_pesos_con_tope_y_bordes_de_ventana():
+    mascara = np.full((20, 30), 255, np.uint8)
+    pesos = pesos_distancia(mascara, max_distancia=4, bordes=(True, True, True, False))
+    
+    assert pesos.max() == 4
+    # El lado derecho no es borde de la imagen: el peso no cae allí
+    assert pesos[10, -1] == 4 and pesos[10, 0] < 1.5
+
+
+def test_feathering_no_depende_del_orden():
+    rng = np.random.default_rng(0)
+    capas = []
+    for caja in [(0, 0, 90, 70), (40, 10, 150, 100), (20, 50, 120, 128)]:
+        x0, y0, x1, y1 = caja
+        imagen = rng.integers(1, 256, (y1 - y0, x1 - x0, 3), np.uint8)
+        capas.append((imagen, pesos_distancia(mascara_valida(imagen)), caja))
+    
+    directo = mezclar_feathering(capas, (128, 150, 3))
+    inverso = mezclar_feathering(capas[::-1], (128, 150, 3))
+    # Solo cambia el orden de las sumas en float32 (redondeo a ±1)
+    assert np.abs(inverso.astype(int) - directo).max() <= 1
+    # Donde solo hay una imagen el resultado es esa imagen
+    np.testing.assert_array_equal(directo[:10, :40], capas[0][0][:10, :40])
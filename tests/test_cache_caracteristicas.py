@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+from cache_caracteristicas import CacheCaracteristicas
+from dataset_sintetico import generar_caso
+from feature_detection import detectar_caracteristicas, obtener_detector
+
+
+def _imagen(indice=0):
+    _, movil, _, _, _ = generar_caso(indice, 0, 256, ('patron',))
+    return movil.copy()
+
+
+def test_registro_reutiliza_detectores():
+    assert obtener_detector('orb', 300) is obtener_detector('orb', 300)
+    assert obtener_detector('orb', 300) is not obtener_detector('orb', 400)
+
+
+def test_acierto_devuelve_lo_mismo_que_la_deteccion():
+    cache = CacheCaracteristicas()
+    imagen = _imagen()
+    kp, des = detectar_caracteristicas(imagen, 'orb', 300, cache, compacto=True)
+    kp_cache, des_cache = detectar_caracteristicas(imagen, 'orb', 300, cache, compacto=True)
+    
+    assert cache.aciertos == 1 and cache.fallos == 1
+    np.testing.assert_array_equal(kp, kp_cache)
+    np.testing.assert_array_equal(des, des_cache)
+
+
+def test_acierto_devuelve_copias():
+    cache = CacheCaracteristicas()
+    imagen = _imagen()
+    kp, _ = detectar_caracteristicas(imagen, 'orb', 300, cache, compacto=True)
+    original = kp.copy()
+    
+    # Modificar la salida (de un fallo o de un acierto) no altera la caché
+    kp['x'] *= 4
+    kp_cache, des_cache = detectar_caracteristicas(imagen, 'orb', 300, cache, compacto=True)
+    kp_cache['x'] *= 4
+    des_cache[:] = 0
+    kp_cache, des_cache = detectar_caracteristicas(imagen, 'orb', 300, cache, compacto=True)
+    
+    np.testing.assert_array_equal(kp_cache, original)
+    assert des_cache.any()
+
+
+def test_expulsion_lru_vuelca_a_disco(tmp_path):
+    cache = CacheCaracteristicas(capacidad=1, directorio=str(tmp_path))
+    imagenes = [_imagen(0), _imagen(2)]
+    for imagen in imagenes:
+        detectar_caracteristicas(imagen, 'orb', 300, cache, compacto=True)
+    
+    # Solo la entrada expulsada está en disco; la otra sigue pendiente en memoria
+    assert len(os.listdir(tmp_path)) == 1
+    assert len(cache) == 1
+    
+    nueva = CacheCaracteristicas(directorio=str(tmp_path))
+    detectar_caracteristicas(imagenes[0], 'orb', 300, nueva, compacto=True)
+    assert nueva.aciertos == 1
+
+
+def test_volcar_al_salir_del_bloque(tmp_path):
+    imagen = _imagen()
+    with CacheCaracteristicas(directorio=str(tmp_path)) as cache:
+        kp, _ = detectar_caracteristicas(imagen, 'orb', 300, cache, compacto=True)
+        assert os.listdir(tmp_path) == []
+    
+    nueva = CacheCaracteristicas(directorio=str(tmp_path))
+    kp_disco, _ = detectar_caracteristicas(imagen, 'orb', 300, nueva, compacto=True)
+    assert nueva.aciertos == 1
+    np.testing.assert_array_equal(kp, kp_disco)
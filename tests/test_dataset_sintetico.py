@@ -0,0 +1,46 @@
+import numpy as np
+from dataset_sintetico import generar_caso, generar_casos, guardar_dataset, iterar_dataset
+from utils import anadir_ruido_gaussiano
+
+
+def test_ruido_sin_generador_usa_el_estado_global():
+    imagen = np.full((32, 32), 128, np.uint8)
+    
+    np.random.seed(3)
+    ruidosa = anadir_ruido_gaussiano(imagen, 10)
+    np.random.seed(3)
+    esperada = np.clip(imagen + np.random.normal(0, 10, imagen.shape), 0, 255).astype(np.uint8)
+    
+    np.testing.assert_array_equal(ruidosa, esperada)
+
+
+def test_ruido_con_semilla_es_reproducible():
+    imagen = np.full((32, 32), 128, np.uint8)
+    np.testing.assert_array_equal(anadir_ruido_gaussiano(imagen, 10, 5),
+                                  anadir_ruido_gaussiano(imagen, 10, 5))
+
+
+def test_casos_no_dependen_del_orden():
+    casos = [(movil.copy(), M) for _, movil, M, _, _ in generar_casos(4, semilla=7, size=64)]
+    # El caso 2 generado solo es igual al generado en la serie
+    _, movil, M, _, _ = generar_caso(2, 7, size=64)
+    np.testing.assert_array_equal(movil, casos[2][0])
+    np.testing.assert_array_equal(M, casos[2][1])
+
+
+def test_buffers_reutilizados_dan_los_mismos_casos():
+    copias = [movil.copy() for _, movil, _, _, _ in generar_casos(3, semilla=1, size=64,
+                                                                     reutilizar_buffers=True)]
+    for k, copia in enumerate(copias):
+        np.testing.assert_array_equal(copia, generar_caso(k, 1, size=64)[1])
+
+
+def test_guardar_e_iterar_dataset(tmp_path):
+    guardar_dataset(str(tmp_path), 5, semilla=2, tam_lote=2, verbose=False, size=64)
+    
+    for (fija, movil, M, sigma, info), k in zip(iterar_dataset(str(tmp_path)), range(5)):
+        fija_g, movil_g, M_g, sigma_g, info_g = generar_caso(k, 2, size=64)
+        np.testing.assert_array_equal(fija, fija_g)
+        np.testing.assert_array_equal(movil, movil_g)
+        np.testing.assert_allclose(M, M_g)
+        assert sigma == sigma_g and info['params'] == info_g['params']
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from feature_detection import (array_a_keypoints, comparar_detectores, coordenadas_keypoints,
+                               detectar_caracteristicas, detectar_caracteristicas_por_bloques,
+                               keypoints_a_array, tabla_detectores)
+from utils import crear_imagen_sintetica
+
+
+def _imagen_grande():
+    # Textura en toda la imagen y mucho más contraste en la mitad izquierda
+    rng = np.random.default_rng(4)
+    imagen = rng.integers(0, 256, (600, 800), np.uint8)
+    imagen[:, 400:] //= 3
+    return imagen
+
+
+def test_keypoints_compactos_ida_y_vuelta():
+    imagen = crear_imagen_sintetica(256, 'patron')
+    kp, des = detectar_caracteristicas(imagen, 'orb', 300)
+    kp_compacto, des_compacto = detectar_caracteristicas(imagen, 'orb', 300, compacto=True)
+    
+    np.testing.assert_array_equal(kp_compacto, keypoints_a_array(kp))
+    np.testing.assert_array_equal(des_compacto, des)
+    np.testing.assert_array_equal(coordenadas_keypoints(kp_compacto), coordenadas_keypoints(kp))
+    
+    recuperados = array_a_keypoints(kp_compacto)
+    assert [(k.pt, k.size, k.angle, k.octave) for k in recuperados] == \
+        [(k.pt, k.size, k.angle, k.octave) for k in kp]
+
+
+@pytest.mark.parametrize('reparto', ['rejilla', 'anms'])
+def test_bloques_respetan_el_presupuesto(reparto):
+    imagen = _imagen_grande()
+    kps, des = detectar_caracteristicas_por_bloques(imagen, 'orb', 400, tam_bloque=200, solape=32,
+                                                    num_hilos=2, reparto=reparto, compacto=True)
+    
+    assert len(kps) == len(des) == 400
+    assert np.all((kps['x'] >= 0) & (kps['x'] < 800) & (kps['y'] >= 0) & (kps['y'] < 600))
+    # Sin duplicados en las costuras entre bloques
+    assert len(np.unique(kps[['x', 'y', 'octave']])) == len(kps)
+
+
+def test_reparto_rejilla_cubre_toda_la_imagen():
+    imagen = _imagen_grande()
+    kps, _ = detectar_caracteristicas_por_bloques(imagen, 'orb', 400, tam_bloque=200, compacto=True)
+    
+    # Con cuota por bloque, la mitad de poco contraste también recibe keypoints
+    bloques = set(zip((kps['x'] // 200).astype(int), (kps['y'] // 200).astype(int)))
+    assert len(bloques) == 12
+
+
+def test_bloques_desde_detectar_caracteristicas():
+    imagen = crear_imagen_sintetica(256, 'patron')
+    kps, des = detectar_caracteristicas(imagen, 'orb', 200, bloques={'tam_bloque': 128, 'num_hilos': 1})
+    
+    assert 0 < len(kps) <= 200 and len(des) == len(kps)
+    assert not isinstance(kps, np.ndarray)
+
+
+def test_bloques_sin_caracteristicas():
+    kps, des = detectar_caracteristicas_por_bloques(np.zeros((300, 300), np.uint8), 'orb', 100,
+                                                    tam_bloque=128, compacto=True)
+    assert len(kps) == 0 and des is None
+
+
+@pytest.mark.parametrize('paralelo', [False, True])
+def test_comparar_detectores_informa_costes(paralelo):
+    imagen = crear_imagen_sintetica(256, 'patron')
+    resultados = comparar_detectores(imagen, ['orb', 'akaze', 'inexistente'], 300,
+                                     paralelo=paralelo, verbose=False)
+    
+    assert resultados['inexistente'] is None
+    kp, _ = detectar_caracteristicas(imagen, 'orb', 300)
+    assert resultados['orb']['num_keypoints'] == len(resultados['orb']['keypoints']) == len(kp)
+    assert resultados['orb']['bytes_descriptores'] == len(kp) * 32
+    
+    tabla = tabla_detectores(resultados)
+    assert list(tabla['metodo']) == ['orb', 'akaze', 'inexistente']
+    assert tabla['tiempo_s'].iloc[:2].gt(0).all() and tabla['tiempo_s'].isna().iloc[2]
@@ -0,0 +1,70 @@
+import csv
+
+import cv2
+import numpy as np
+from lote import leer_completados, leer_manifiesto, pares_directorio, registrar_lote, truncar_linea_incompleta
+
+
+def _imagenes(directorio, n=4):
+    # Recortes desplazados de una misma escena
+    escena = cv2.GaussianBlur(np.random.default_rng(2).integers(0, 256, (260, 400), np.uint8), (3, 3), 0)
+    rutas = []
+    for k in range(n):
+        ruta = directorio / f'img{k}.png'
+        cv2.imwrite(str(ruta), escena[:, 20 * k:20 * k + 240])
+        rutas.append(str(ruta))
+    return rutas
+
+
+def _filas(ruta):
+    with open(ruta, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def test_reanudar_omite_los_pares_completados(tmp_path):
+    _imagenes(tmp_path)
+    pares = pares_directorio(str(tmp_path))
+    salida = str(tmp_path / 'salida' / 'lote.csv')
+    
+    resumen = registrar_lote(pares[:2], salida, num_procesos=1, verbose=False)
+    assert resumen['ok'] == 2 and resumen['omitidos'] == 0
+    
+    resumen = registrar_lote(pares, salida, num_procesos=1, verbose=False)
+    assert resumen['ok'] == 1 and resumen['omitidos'] == 2
+    assert [fila['id'] for fila in _filas(salida)] == [p[0] for p in pares]
+
+
+def test_reanudar_descarta_la_fila_incompleta(tmp_path):
+    _imagenes(tmp_path)
+    pares = pares_directorio(str(tmp_path), 'img0.png')
+    salida = str(tmp_path / 'lote.csv')
+    registrar_lote(pares[:2], salida, num_procesos=1, verbose=False)
+    
+    # Simular una interrupción a mitad de escribir la fila del tercer par
+    with open(salida, 'a', encoding='utf-8') as f:
+        f.write(f'{pares[2][0]},{pares[2][1]},{pares[2][2]},ok')
+    
+    resumen = registrar_lote(pares, salida, num_procesos=1, verbose=False)
+    filas = _filas(salida)
+    
+    assert resumen['ok'] == 1 and resumen['omitidos'] == 2
+    assert [fila['id'] for fila in filas] == [p[0] for p in pares]
+    assert all(fila['estado'] == 'ok' and fila['h00'] for fila in filas)
+
+
+def test_truncar_sin_fila_incompleta_no_cambia_nada(tmp_path):
+    ruta = tmp_path / 'lote.csv'
+    ruta.write_text('id,estado\r\na,ok\r\n', encoding='utf-8')
+    assert truncar_linea_incompleta(str(ruta), bloque=4) == 0
+    
+    ruta.write_text('id,estado\r\na,ok\r\nb,o', encoding='utf-8')
+    assert truncar_linea_incompleta(str(ruta), bloque=4) == 3
+    assert leer_completados(str(ruta)) == {'a'}
+
+
+def test_leer_manifiesto_con_rutas_relativas(tmp_path):
+    _imagenes(tmp_path, 2)
+    (tmp_path / 'pares.csv').write_text('fija,movil\nimg0.png,img1.png\n', encoding='utf-8')
+    
+    assert leer_manifiesto(str(tmp_path / 'pares.csv')) == [
+        ('0', str(tmp_path / 'img0.png'), str(tmp_path / 'img1.png'))]
@@ -0,0 +1,186 @@
+import cv2
+import numpy as np
+import pytest
+from dataset_sintetico import generar_caso
+from feature_detection import DTYPE_KEYPOINT, detectar_caracteristicas
+from matching import (DTYPE_MATCH, IndiceDescriptores, aplicar_ratio_test, array_a_matches,
+                      benchmark_emparejadores, calcular_estadisticas_matches, comparar_estimadores,
+                      emparejar_caracteristicas,
+                      RejillaEspacial, emparejamiento_guiado, filtrar_matches_ransac, matches_a_array,
+                      prefiltro_geometrico)
+
+
+def _keypoints(puntos):
+    kps = np.zeros(len(puntos), dtype=DTYPE_KEYPOINT)
+    kps['x'], kps['y'] = np.asarray(puntos, dtype=np.float32).T
+    return kps
+
+
+def _matches_identidad(n):
+    matches = np.zeros(n, dtype=DTYPE_MATCH)
+    matches['queryIdx'] = matches['trainIdx'] = np.arange(n)
+    return matches
+
+
+def _descriptores(metodo, max_features=500):
+    fija, movil, _, _, _ = generar_caso(0, 0, 256, ('patron',), ('rigida',), (5,))
+    _, des1 = detectar_caracteristicas(fija, metodo, max_features)
+    _, des2 = detectar_caracteristicas(movil, metodo, max_features)
+    return des1, des2
+
+
+def _pares(matches):
+    return set(zip(matches['queryIdx'].tolist(), matches['trainIdx'].tolist()))
+
+
+@pytest.mark.parametrize('metodo', ['orb', 'sift'])
+def test_ratio_test_vectorizado_igual_que_bfmatcher(metodo):
+    des1, des2 = _descriptores(metodo)
+    lista = emparejar_caracteristicas(des1, des2, metodo)
+    arr = emparejar_caracteristicas(des1, des2, metodo, compacto=True)
+    
+    assert _pares(arr) == {(m.queryIdx, m.trainIdx) for m in lista}
+    mutuos = emparejar_caracteristicas(des1, des2, metodo, compacto=True, mutuo=True)
+    assert _pares(mutuos) <= _pares(arr)
+
+
+def test_ratio_test_descarta_vecinos_ausentes():
+    distancias = np.array([[1.0, 2.0], [1.0, 1.1], [1.0, np.inf]], np.float32)
+    indices = np.array([[0, 1], [2, 3], [4, -1]])
+    np.testing.assert_array_equal(aplicar_ratio_test(distancias, indices), [True, False, False])
+
+
+def test_estadisticas_de_matches():
+    matches = matches_a_array([cv2.DMatch(0, 0, 10.0), cv2.DMatch(1, 1, 20.0), cv2.DMatch(2, 2, 60.0)])
+    estadisticas = calcular_estadisticas_matches(matches, np.array([[1], [1], [0]], np.uint8))
+    
+    assert estadisticas['num_inliers'] == 2
+    assert estadisticas['distancia_media'] == pytest.approx(30.0)
+    assert estadisticas['distancia_media_inliers'] == pytest.approx(15.0)
+    assert calcular_estadisticas_matches([])['num_matches'] == 0
+
+
+@pytest.mark.parametrize('metodo', ['orb', 'sift'])
+def test_flann_aproxima_la_fuerza_bruta(metodo):
+    des1, des2 = _descriptores(metodo)
+    exactos = emparejar_caracteristicas(des1, des2, metodo, compacto=True)
+    aproximados = emparejar_caracteristicas(des1, des2, metodo, compacto=True, backend='flann')
+    
+    assert len(exactos) > 50
+    assert len(_pares(exactos) & _pares(aproximados)) >= 0.8 * len(exactos)
+
+
+def test_indice_reutilizable_entre_consultas():
+    des1, des2 = _descriptores('sift')
+    indice = IndiceDescriptores(des2, 'sift', 'flann', checks=128)
+    
+    primera = emparejar_caracteristicas(des1, None, 'sift', compacto=True, indice=indice)
+    segunda = emparejar_caracteristicas(des1, None, 'sift', compacto=True, indice=indice)
+    np.testing.assert_array_equal(primera, segunda)
+    
+    tabla = benchmark_emparejadores(des1, des2, 'sift', repeticiones=1)
+    assert list(tabla['backend']) == ['bf', 'flann'] and tabla['recall'].iloc[0] == 1.0
+
+
+@pytest.mark.parametrize('modelo, n', [('similitud', 2), ('afin', 3)])
+def test_modelos_afines_con_la_muestra_minima(modelo, n):
+    # La imagen 2 está desplazada (+10, +5) respecto a la 1
+    pts1 = np.array([[10, 10], [200, 30], [60, 180]])[:n]
+    kp1, kp2 = _keypoints(pts1), _keypoints(pts1 - [10, 5])
+    
+    H, mask = filtrar_matches_ransac(kp1, kp2, _matches_identidad(n), estimador='lmeds', modelo=modelo)
+    
+    assert H is not None and mask.sum() == n
+    np.testing.assert_allclose(H[:2, 2], [10, 5], atol=1e-6)
+
+
+def test_estimadores_recuperan_la_homografia_con_outliers():
+    rng = np.random.default_rng(3)
+    H_real = np.array([[1.02, 0.05, 12], [-0.04, 0.98, -7], [1e-4, 5e-5, 1]])
+    pts2 = rng.uniform(0, 400, (200, 2))
+    pts1 = cv2.perspectiveTransform(pts2.reshape(-1, 1, 2), H_real).reshape(-1, 2)
+    pts1[150:] = rng.uniform(0, 400, (50, 2))
+    matches = _matches_identidad(200)
+    matches['distance'] = rng.uniform(0, 50, 200)
+    
+    tabla = comparar_estimadores(_keypoints(pts1), _keypoints(pts2), matches, H_real=H_real,
+                                 puntos_control=pts2[:150])
+    
+    assert set(tabla['estimador']) == {'ransac', 'lmeds', 'rho', 'usac', 'usac_rapido', 'usac_preciso',
+                                       'prosac', 'magsac'}
+    assert (tabla['error_px'] < 0.5).all()
+    assert (tabla['num_inliers'] >= 150).all()
+    assert (tabla['iteraciones_estimadas'] < 2000).all()
+
+
+def test_estimador_no_disponible_para_el_modelo():
+    pts = [[10, 10], [200, 30], [60, 180], [90, 90]]
+    with pytest.raises(ValueError):
+        filtrar_matches_ransac(_keypoints(pts), _keypoints(pts), _matches_identidad(4), estimador='rho',
+                               modelo='similitud')
+
+
+def test_homografia_necesita_cuatro_matches():
+    pts = [[10, 10], [200, 30], [60, 180]]
+    H, mask = filtrar_matches_ransac(_keypoints(pts), _keypoints(pts), _matches_identidad(3))
+    assert H is None and mask is None
+
+
+def test_matches_compactos_ida_y_vuelta():
+    lista = [cv2.DMatch(0, 3, 12.0), cv2.DMatch(4, 1, 30.5)]
+    arr = matches_a_array(lista)
+    
+    assert arr.dtype == DTYPE_MATCH and matches_a_array(arr) is arr
+    assert [(m.queryIdx, m.trainIdx, m.distance) for m in array_a_matches(arr)] == \
+        [(0, 3, 12.0), (4, 1, 30.5)]
+    assert len(matches_a_array([])) == 0
+
+
+def test_prefiltro_gms_separa_inliers_de_outliers():
+    rng = np.random.default_rng(0)
+    # 400 inliers con una traslación de (15, -10) y 150 outliers al azar
+    pts1 = rng.uniform(0, 400, (550, 2))
+    pts2 = pts1 + [15, -10]
+    pts2[400:] = rng.uniform(0, 400, (150, 2))
+    matches = _matches_identidad(550)
+    
+    filtrados, info = prefiltro_geometrico(_keypoints(pts1), _keypoints(pts2), matches,
+                                           (400, 400), (400, 400))
+    conservados = filtrados['queryIdx']
+    
+    assert np.mean(conservados < 400) > 0.9
+    assert np.count_nonzero(conservados < 400) > 0.95 * 400
+    assert info['eliminados'] == 550 - len(filtrados)
+    
+    lista = prefiltro_geometrico(_keypoints(pts1), _keypoints(pts2), array_a_matches(matches),
+                                 (400, 400), (400, 400))[0]
+    assert [m.queryIdx for m in lista] == conservados.tolist()
+
+
+def test_rejilla_espacial_igual_que_fuerza_bruta():
+    rng = np.random.default_rng(1)
+    puntos = rng.uniform(-50, 300, (400, 2))
+    consultas = rng.uniform(-60, 310, (100, 2))
+    idx_consulta, idx_punto = RejillaEspacial(puntos, 12).vecinos(consultas, 12)
+    
+    d = np.linalg.norm(consultas[:, None] - puntos[None], axis=2)
+    esperados = set(zip(*np.nonzero(d <= 12)))
+    assert set(zip(idx_consulta.tolist(), idx_punto.tolist())) == {(int(i), int(j)) for i, j in esperados}
+
+
+def test_emparejamiento_guiado_con_la_homografia_real():
+    fija, movil, M, _, _ = generar_caso(0, 0, 256, ('patron',), ('rigida',), (5,))
+    kp1, des1 = detectar_caracteristicas(fija, 'orb', 500, compacto=True)
+    kp2, des2 = detectar_caracteristicas(movil, 'orb', 500, compacto=True)
+    # H lleva la imagen 2 (móvil) a la 1 (fija)
+    H = np.linalg.inv(np.vstack([M, [0, 0, 1]]))
+    
+    matches, H_nueva, mask, info = emparejamiento_guiado(kp1, des1, kp2, des2, H, 'orb', radio=6,
+                                                         devolver_info=True)
+    
+    assert len(matches) > 50 and info['num_inliers'] == int(mask.sum())
+    # Cada keypoint de la imagen 2 aparece una sola vez
+    assert len(np.unique(matches['trainIdx'])) == len(matches)
+    esquinas = np.array([[[0, 0]], [[255, 0]], [[255, 255]], [[0, 255]]], np.float32)
+    error = cv2.perspectiveTransform(esquinas, H_nueva) - cv2.perspectiveTransform(esquinas, H)
+    assert np.abs(error).max() < 2.0
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from montecarlo import AcumuladorEstadisticas, ejecutar_montecarlo, percentil_histograma
+
+
+def test_acumulador_igual_que_numpy():
+    valores = np.random.default_rng(0).normal(3, 2, 1000)
+    acumulador = AcumuladorEstadisticas()
+    for bloque in np.array_split(valores, 7):
+        acumulador.agregar(np.append(bloque, np.nan))
+    resumen = acumulador.resumen()
+    
+    assert resumen['n'] == 1000
+    assert resumen['media'] == pytest.approx(valores.mean())
+    assert resumen['std'] == pytest.approx(valores.std(ddof=1))
+    assert (resumen['min'], resumen['max']) == (valores.min(), valores.max())
+    assert np.isnan(AcumuladorEstadisticas().resumen()['media'])
+
+
+def test_percentil_histograma():
+    bordes = np.logspace(-3, 0, 61)
+    valores = np.random.default_rng(1).uniform(0.01, 0.5, 5000)
+    cuentas = np.histogram(valores, bordes)[0]
+    
+    assert percentil_histograma(cuentas, bordes, 50) == pytest.approx(np.median(valores), rel=0.06)
+    assert np.isnan(percentil_histograma(np.zeros(60), bordes, 50))
+
+
+@pytest.mark.parametrize('num_procesos', [1, 2])
+def test_montecarlo_reproducible(num_procesos):
+    params = dict(metodos=('orb', 'exhaustiva'), sigmas=(0, 10), transformaciones=('traslacion',),
+                  num_ensayos=3, size=128, tipos_imagen=('texto',), ensayos_por_tarea=2,
+                  verbose=False)
+    tabla, latencias = ejecutar_montecarlo(num_procesos=num_procesos, **params)
+    
+    assert set(tabla['metodo']) == {'orb', 'exhaustiva'} and (tabla['n'] <= 3).all()
+    exhaustiva = tabla[(tabla['metodo'] == 'exhaustiva') & (tabla['metrica'] == 'error_esquinas')]
+    assert (exhaustiva['tasa_exito'] == 1.0).all()
+    assert list(latencias['n']) == [6, 6]
+    assert (latencias['p50_ms'] <= latencias['max_ms']).all()
+    
+    # Los mismos casos dan los mismos errores
+    repetida, _ = ejecutar_montecarlo(num_procesos=1, **params)
+    np.testing.assert_allclose(repetida['media'], tabla['media'])
@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+from panorama import _encadenar, arbol_expansion_maximo, preparar_fusion, registrar_conjunto
+
+
+def _traslacion(tx, ty):
+    return np.array([[1, 0, tx], [0, 1, ty], [0, 0, 1]], dtype=np.float64)
+
+
+def test_encadenar_cadena_larga():
+    # Cadena 0 <- 1 <- 2 <- ... con una traslación de 1 px por arista
+    n = 5000
+    padres = {k: k - 1 for k in range(1, n)}
+    resultados = {(k - 1, k): {'H': _traslacion(1, 0)} for k in range(1, n)}
+    homografias = _encadenar(padres, resultados, 0, n)
+    
+    np.testing.assert_allclose(homografias[-1], _traslacion(n - 1, 0))
+    # Las aristas se usan en el sentido que toque (hijo -> padre)
+    homografias = _encadenar({k: k + 1 for k in range(n - 1)}, resultados, n - 1, n)
+    np.testing.assert_allclose(homografias[0], _traslacion(-(n - 1), 0))
+
+
+def test_arbol_expansion_maximo_prefiere_aristas_fuertes():
+    aristas = {(0, 1): 100, (1, 2): 80, (0, 2): 10, (3, 4): 50}
+    padres = arbol_expansion_maximo(5, aristas, 0)
+    assert padres == {1: 0, 2: 1}
+
+
+def test_registrar_conjunto_recupera_traslaciones():
+    rng = np.random.default_rng(1)
+    escena = cv2.GaussianBlur(rng.integers(0, 256, (300, 560), np.uint8), (3, 3), 0)
+    origenes = [0, 120, 240]
+    imagenes = [escena[:, x:x + 320].copy() for x in origenes]
+    
+    homografias, info = registrar_conjunto(imagenes, 'orb', 2000, referencia=0, num_procesos=1,
+                                           verbose=False)
+    
+    assert info['no_conectadas'] == []
+    for H, x in zip(homografias, origenes):
+        np.testing.assert_allclose(H / H[2, 2], _traslacion(x, 0), atol=0.5)
+    ordenadas, resto = preparar_fusion(imagenes, homografias, info['referencia'])
+    assert ordenadas[0] is imagenes[0] and len(resto) == 2
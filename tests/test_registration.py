@@ -0,0 +1,210 @@
+import os
+import tempfile
+
+import cv2
+import numpy as np
+import pytest
+from dataset_sintetico import generar_caso
+from feature_detection import coordenadas_keypoints, detectar_caracteristicas, reducir_imagen
+from panorama import cargar_imagen_gris
+from registration import (fusionar_imagenes, refinar_ecc, registro_busqueda_exhaustiva,
+                          registro_con_caracteristicas, registro_fourier_mellin, validar_fourier_mellin)
+from utils import (aplicar_transformacion, calcular_errores_transformacion, crear_imagen_sintetica,
+                   matriz_homogenea)
+
+
+def _inliers_consistentes(H, info, umbral):
+    """
+    Comprueba que los inliers, indexando los keypoints de info con los
+    matches de info, cumplen la homografía devuelta.
+    """
+    mask = info['mask'].ravel().astype(bool)
+    matches = info['matches'][mask]
+    pts1 = coordenadas_keypoints(info['keypoints1'])[matches['queryIdx']]
+    pts2 = coordenadas_keypoints(info['keypoints2'])[matches['trainIdx']]
+    proyectados = cv2.perspectiveTransform(pts2.reshape(-1, 1, 2), H).reshape(-1, 2)
+    return np.all(np.linalg.norm(proyectados - pts1, axis=1) <= umbral)
+
+
+def test_guiado_rechazado_conserva_keypoints_originales():
+    # Caso en el que el guiado con la nueva detección obtiene menos inliers
+    fija, movil, _, _, _ = generar_caso(5, 0, 512, ('patron',))
+    H, _, info = registro_con_caracteristicas(fija, movil, 'orb', 300, guiado=True,
+                                              max_features_guiado=2000)
+    
+    assert info['guiado']['num_inliers'] < info['num_inliers']
+    kp1, _ = detectar_caracteristicas(fija, 'orb', 300, compacto=True)
+    assert len(info['keypoints1']) == len(kp1)
+    assert info['ransac']['num_inliers'] == info['num_inliers']
+    assert _inliers_consistentes(H, info, 5.0)
+
+
+def test_guiado_aceptado_usa_keypoints_de_la_nueva_deteccion():
+    fija, movil, _, _, _ = generar_caso(1, 0, 256, ('patron',))
+    H, _, info = registro_con_caracteristicas(fija, movil, 'orb', 100, guiado=True,
+                                              max_features_guiado=2000)
+    
+    assert info['num_inliers'] == info['guiado']['num_inliers']
+    assert info['ransac']['num_inliers'] == info['num_inliers']
+    assert len(info['mask']) == len(info['matches'])
+    assert _inliers_consistentes(H, info, 5.0)
+
+
+def test_guiado_respeta_el_modelo():
+    fija, movil, _, _, _ = generar_caso(1, 0, 256, ('patron',))
+    H, _, info = registro_con_caracteristicas(fija, movil, 'orb', 300, modelo='afin', guiado=True,
+                                              max_features_guiado=2000)
+    
+    assert info['guiado']['num_inliers'] > 0
+    np.testing.assert_allclose(H[2], [0, 0, 1], atol=1e-12)
+
+
+@pytest.mark.parametrize('metrica, paso', [('mse', 1), ('ncc', 1), ('mse', 3), ('ncc', 2)])
+def test_busqueda_fft_igual_que_fuerza_bruta(metrica, paso):
+    fija, movil, _, _, _ = generar_caso(3, 0, 96, ('texto',), ('traslacion',), (5,))
+    rangos = dict(rango_tx=(-12, 9), rango_ty=(-7, 14), paso=paso, metrica=metrica)
+    
+    M_fft, valor_fft, superficie_fft = registro_busqueda_exhaustiva(fija, movil, motor='fft', **rangos)
+    M_bf, valor_bf, superficie_bf = registro_busqueda_exhaustiva(fija, movil, motor='fuerza_bruta',
+                                                                 **rangos)
+    
+    np.testing.assert_allclose(superficie_fft, superficie_bf, rtol=1e-4, atol=1e-3)
+    np.testing.assert_allclose(M_fft, M_bf, atol=1e-4)
+    assert valor_fft == pytest.approx(valor_bf, rel=1e-4)
+
+
+@pytest.mark.parametrize('metrica', ['mse', 'ncc'])
+def test_busqueda_piramidal_encuentra_el_mismo_pico(metrica):
+    fija, movil, M, _, _ = generar_caso(0, 0, 128, ('texto',), ('traslacion',), (0,))
+    rangos = dict(rango_tx=(-30, 30), rango_ty=(-30, 30), metrica=metrica, subpixel=False)
+    
+    M_completa, _, _ = registro_busqueda_exhaustiva(fija, movil, **rangos)
+    M_piramide, _, superficie = registro_busqueda_exhaustiva(fija, movil, niveles=3, **rangos)
+    
+    np.testing.assert_array_equal(M_piramide, M_completa)
+    assert np.isnan(superficie).mean() > 0.9
+
+
+def test_busqueda_fase_rechaza_piramide():
+    fija, movil, _, _, _ = generar_caso(0, 0, 128, ('texto',), ('traslacion',), (0,))
+    
+    with pytest.raises(ValueError):
+        registro_busqueda_exhaustiva(fija, movil, metrica='fase', niveles=3)
+
+
+def test_busqueda_fase_recupera_traslacion():
+    fija, movil, M, _, _ = generar_caso(0, 0, 128, ('texto',), ('traslacion',), (0,))
+    M_est, _, _ = registro_busqueda_exhaustiva(fija, movil, metrica='fase')
+    
+    # M_est lleva la imagen móvil a la fija (traslación inversa de M)
+    np.testing.assert_allclose(M_est[:, 2], -M[:, 2], atol=1.0)
+
+
+@pytest.mark.parametrize('params', [{'angulo': 10, 'tx': 4, 'ty': 3},
+                                    {'angulo': 40, 'escala': 0.85, 'tx': 5, 'ty': 5},
+                                    {'angulo': -150, 'escala': 1.1}])
+def test_fourier_mellin_recupera_rotacion_y_escala(params):
+    fija = crear_imagen_sintetica(256, 'texto')
+    movil, M_real = aplicar_transformacion(fija, 'afin', params)
+    M, registrada, info = registro_fourier_mellin(fija, movil, devolver_info=True)
+    
+    assert info['angulo'] == pytest.approx(-params['angulo'], abs=1.0)
+    assert info['escala'] == pytest.approx(1 / params.get('escala', 1.0), rel=0.02)
+    # M lleva la móvil a la fija: su inversa es la transformación aplicada
+    np.testing.assert_allclose(cv2.invertAffineTransform(M), M_real, atol=1.5)
+    assert registrada.shape == fija.shape
+
+
+def test_validar_fourier_mellin_frente_a_la_busqueda():
+    tabla = validar_fourier_mellin(casos=[{'angulo': 20, 'tx': 3}], size=128, verbose=False)
+    errores = tabla.set_index('metodo')['rmse']
+    assert errores['fourier_mellin'] < 1.0 < errores['exhaustiva']
+
+
+def test_refinar_ecc_reduce_el_error():
+    fija, movil, M, _, _ = generar_caso(3, 0, 256, ('texto',), ('rigida',), (5,),
+                                        rangos={'tx': (-40, 40), 'ty': (-40, 40)})
+    real = np.linalg.inv(matriz_homogenea(M))
+    inicial = real.copy()
+    inicial[:2, 2] += [2.0, -1.5]
+    
+    H, info = refinar_ecc(fija, movil, inicial)
+    
+    errores = calcular_errores_transformacion(real[None], np.stack([inicial, H]), fija.shape)
+    assert info['ecc'] is not None
+    assert errores['error_esquinas'][1] < 0.5 < errores['error_esquinas'][0]
+
+
+def _par_fotos(escala=0.25):
+    raiz = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'original')
+    return [reducir_imagen(cargar_imagen_gris(os.path.join(raiz, nombre)), escala)
+            for nombre in ('IMG02.jpg', 'IMG03.jpg')]
+
+
+def test_piramide_mantiene_el_contrato_de_info():
+    fija, movil = _par_fotos()
+    _, _, info = registro_con_caracteristicas(fija, movil, 'orb', 1000)
+    H, _, info_piramide = registro_con_caracteristicas(fija, movil, 'orb', 1000, escala_piramide=0.5,
+                                                       medir_ahorro=True)
+    
+    assert set(info) <= set(info_piramide)
+    assert info_piramide['ransac']['num_inliers'] == info_piramide['num_inliers']
+    assert 'ahorro_s' in info_piramide
+    assert _inliers_consistentes(H, info_piramide, 5.0)
+
+
+def test_piramide_respeta_modelo_y_opciones():
+    fija, movil = _par_fotos()
+    H, _, info = registro_con_caracteristicas(fija, movil, 'orb', 1000, escala_piramide=0.5,
+                                              modelo='afin', prefiltro='gms', guiado=True, refinar=True)
+    
+    np.testing.assert_allclose(H[2], [0, 0, 1], atol=1e-12)
+    assert info['prefiltro'] is not None
+    assert info['guiado'] is not None
+    assert info['refinamiento']['ecc'] is not None
+
+
+def test_canvas_ajustado_a_las_esquinas_proyectadas():
+    img = np.full((100, 200), 50, np.uint8)
+    # La segunda imagen desplazada (-30, 40) y la tercera sin homografía
+    homografias = [np.array([[1, 0, -30], [0, 1, 40], [0, 0, 1]], np.float64), None]
+    
+    canvas = fusionar_imagenes([img, img, img], homografias)
+    
+    assert canvas.shape == (140, 230)
+    # Referencia en x 30..230, y 0..100; la segunda en x 0..200, y 40..140
+    assert canvas[:40, :30].sum() == 0 and canvas[100:, 200:].sum() == 0
+    assert np.all(canvas[:100, 30:] == 50) and np.all(canvas[40:, :200] == 50)
+
+
+def test_canvas_rechaza_homografias_degeneradas():
+    img = np.full((50, 50), 50, np.uint8)
+    H = np.array([[1, 0, 0], [0, 1, 0], [-0.05, 0, 1]], np.float64)
+    with pytest.raises(ValueError):
+        fusionar_imagenes([img, img], [H])
+
+
+def _mosaico_sintetico():
+    # Tres recortes de una misma escena con rotación, escala y perspectiva
+    escena = cv2.GaussianBlur(np.random.default_rng(0).integers(1, 256, (400, 500, 3), np.uint8), (5, 5), 0)
+    homografias = [np.array([[0.98, -0.17, 60], [0.17, 0.98, -20], [0, 0, 1]]),
+                   np.array([[1.1, 0.05, -90], [-0.02, 0.95, 70], [2e-4, -1e-4, 1]])]
+    return [escena[:300, :320], escena[50:330, 100:400], escena[120:400, 150:480]], homografias
+
+
+@pytest.mark.parametrize('metodo', ['feathering', 'promedio'])
+def test_fusion_por_bloques_igual_a_fusion_completa(metodo):
+    imagenes, homografias = _mosaico_sintetico()
+    completa = fusionar_imagenes(imagenes, homografias, metodo_blending=metodo, ancho_feathering=40)
+    por_bloques = fusionar_imagenes(imagenes, homografias, tam_bloque=64, num_hilos=2,
+                                    metodo_blending=metodo, ancho_feathering=40)
+    
+    np.testing.assert_array_equal(por_bloques, completa)
+
+
+def test_fusion_por_bloques_sin_ruta_no_deja_archivos(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    imagenes, homografias = _mosaico_sintetico()
+    canvas = fusionar_imagenes(imagenes, homografias, tam_bloque=128)
+    
+    assert canvas.any() and os.listdir(tmp_path) == []
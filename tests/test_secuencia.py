@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+from secuencia import RegistradorSecuencia, registrar_secuencia
+
+
+def _escena():
+    rng = np.random.default_rng(5)
+    return cv2.GaussianBlur(rng.integers(0, 256, (240, 700), np.uint8), (5, 5), 0)
+
+
+def _frames(desplazamientos, escena=None):
+    escena = _escena() if escena is None else escena
+    return [escena[:, x:x + 240].copy() for x in desplazamientos]
+
+
+def test_secuencia_sigue_una_panoramica():
+    desplazamientos = [4 * k for k in range(60)]
+    resultados = list(registrar_secuencia(_frames(desplazamientos), min_inliers=20))
+    tipos = [info['tipo'] for _, info in resultados]
+    
+    assert tipos[0] == 'referencia' and 'perdido' not in tipos
+    # Casi todos los fotogramas se resuelven solo con KLT
+    assert tipos.count('seguimiento') > 0.8 * len(tipos) and 'clave' in tipos
+    for (H, _), x in zip(resultados, desplazamientos):
+        # El fotograma desplazado x píxeles está en x de la referencia
+        np.testing.assert_allclose(H[:2, 2], [x, 0], atol=1.0)
+        np.testing.assert_allclose(H[:2, :2], np.eye(2), atol=0.01)
+
+
+def test_secuencia_se_recupera_tras_un_fotograma_vacio():
+    frames = _frames([0, 3, 6, 9])
+    frames.insert(3, np.zeros_like(frames[0]))
+    registrador = RegistradorSecuencia(min_inliers=20)
+    resultados = [registrador.procesar(f) for f in frames]
+    
+    assert [info['tipo'] for _, info in resultados] == ['referencia', 'seguimiento', 'seguimiento',
+                                                        'perdido', 'clave']
+    assert resultados[3][0] is None and registrador.num_perdidos == 1
+    np.testing.assert_allclose(resultados[4][0][:2, 2], [9, 0], atol=1.0)
+    
+    latencia = registrador.estadisticas_latencia()
+    assert latencia['max_ms'] >= latencia['mediana_ms'] > 0
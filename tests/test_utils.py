@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+import pytest
+from utils import (EvaluadorSimilitud, aplicar_transformacion, aplicar_transformaciones_lote,
+                   calcular_similitud, crear_imagen_sintetica)
+
+
+def _par():
+    fija = crear_imagen_sintetica(128, 'texto')
+    movil = cv2.warpAffine(fija, np.float32([[1, 0, 3], [0, 1, -2]]), (128, 128))
+    return fija, movil
+
+
+@pytest.mark.parametrize('metrica', ['mse', 'ncc', 'mi'])
+def test_evaluador_igual_que_calcular_similitud(metrica):
+    fija, movil = _par()
+    evaluador = EvaluadorSimilitud(fija, metrica)
+    
+    for img in (movil, fija, 255 - movil):
+        esperado = calcular_similitud(fija, img, metrica)
+        assert evaluador(img) == pytest.approx(esperado, rel=1e-4, abs=1e-6)
+
+
+@pytest.mark.parametrize('metrica', ['mse', 'ncc', 'mi'])
+def test_evaluador_con_mascara(metrica):
+    fija, movil = _par()
+    mascara = np.zeros(fija.shape, np.uint8)
+    mascara[10:100, 20:120] = 1
+    valido = mascara > 0
+    
+    valor = EvaluadorSimilitud(fija, metrica)(movil, mascara)
+    assert valor == pytest.approx(calcular_similitud(fija[valido], movil[valido], metrica),
+                                  rel=1e-4, abs=1e-6)
+
+
+def test_evaluador_rechaza_otro_tamano():
+    fija, _ = _par()
+    evaluador = EvaluadorSimilitud(fija, 'mse')
+    with pytest.raises(ValueError):
+        evaluador(fija[:64])
+    assert np.isnan(evaluador(fija, np.zeros(fija.shape, np.uint8)))
+
+
+@pytest.mark.parametrize('num_hilos', [1, 3])
+def test_lote_igual_que_transformaciones_sueltas(num_hilos):
+    imagen = cv2.cvtColor(crear_imagen_sintetica(96, 'patron'), cv2.COLOR_GRAY2BGR)
+    angulos = [-20, 0, 15, 30, 45]
+    pila, matrices = aplicar_transformaciones_lote(imagen, 'rigida', {'angulo': angulos, 'tx': 5},
+                                                   num_hilos=num_hilos)
+    
+    assert pila.shape == (5,) + imagen.shape
+    for k, angulo in enumerate(angulos):
+        esperada, M = aplicar_transformacion(imagen, 'rigida', {'angulo': angulo, 'tx': 5})
+        np.testing.assert_array_equal(pila[k], esperada)
+        np.testing.assert_allclose(matrices[k], M)
+
+
+def test_lote_reutiliza_la_salida():
+    imagen = crear_imagen_sintetica(64, 'circulo')
+    matrices = np.stack([np.float32([[1, 0, tx], [0, 1, 0]]) for tx in (0, 4, 8)])
+    salida = np.empty((3, 64, 64), np.uint8)
+    
+    pila, _ = aplicar_transformaciones_lote(imagen, matrices=matrices, salida=salida)
+    assert pila is salida
+    np.testing.assert_array_equal(pila[0], imagen)
+    
+    with pytest.raises(ValueError):
+        aplicar_transformaciones_lote(imagen, matrices=matrices, salida=salida[:2])
+    with pytest.raises(ValueError):
+        aplicar_transformaciones_lote(imagen)